@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+# vim: set fileencoding=utf-8
+
+"""
+Benchmarks of the hot paths of pywifi against the simulated wpa_supplicant.
+
+Run from the top of the repository:
+
+    python benchmarks/bench_pywifi.py [--quick] [--output bench_output.txt]
+
+Each result is written as one JSON object per line to the output file.
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+
+import pywifi
+from pywifi import const
+from pywifi import _wifiutil_linux
+from pywifi import interning
+from pywifi.iface import Interface
+from pywifi.testing import WpaSupplicantSimulator
+
+BENCH_IFACE = 'wlan0'
+PARSE_SIZES = [10, 100, 1000, 10000]
+PROFILE_SIZES = [10, 100, 1000]
+LATENCY_RUNS = 200
+IMPORT_RUNS = 20
+
+
+def percentiles(samples):
+    """Get the summary of the samples in seconds."""
+
+    samples = sorted(samples)
+
+    def pick(q):
+
+        return samples[min(int(q * len(samples)), len(samples) - 1)]
+
+    return {
+        'min': samples[0],
+        'p50': pick(0.5),
+        'p90': pick(0.9),
+        'p99': pick(0.99),
+        'max': samples[-1],
+        'mean': sum(samples) / len(samples)
+    }
+
+
+def timed_runs(func, min_time=0.2, max_runs=1000, setup=None):
+    """Run func repeatedly and get the duration of each run.
+
+    The setup, if any, is called untimed before each run.
+    """
+
+    samples = []
+    start = time.perf_counter()
+    while len(samples) < max_runs and \
+            (time.perf_counter() - start < min_time or len(samples) < 3):
+        if setup is not None:
+            setup()
+        t0 = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - t0)
+
+    return samples
+
+
+def make_profile(ssid):
+
+    profile = pywifi.Profile()
+    profile.ssid = ssid
+    profile.akm = const.AKM_TYPE_WPA2PSK
+    profile.cipher = const.CIPHER_TYPE_CCMP
+    profile.key = '12345678'
+
+    return profile
+
+
+def clear_interning():
+
+    interning.bssids.clear()
+    interning.ssids.clear()
+
+
+def bench_parse(sizes, ctrl_dir):
+    """Measure the parsing of SCAN_RESULTS replies.
+
+    The parsing is measured with the interning tables cleared before each
+    run (cold) and filled by the previous runs (warm). Scans with more
+    BSSIDs than interning.BSSID_INTERN_SIZE evict their own entries, so
+    they stay close to cold.
+    """
+
+    results = []
+    for ssids_kind in ('ascii', 'utf-8'):
+        for size in sizes:
+            sim = WpaSupplicantSimulator(ctrl_dir, [BENCH_IFACE],
+                                         reply_size=1 << 30)
+            ssids = None
+            if ssids_kind == 'utf-8':
+                ssids = ['咖啡店-{}'.format(i) for i in range(max(size // 4, 1))]
+            sim.populate(size, ssids)
+            reply = sim.reply(BENCH_IFACE, 'SCAN_RESULTS')
+
+            # Only the parsing is measured, so the reply is served directly.
+            util = _wifiutil_linux.WifiUtil()
+            util._send_cmd_to_wpas = lambda *args, **kwargs: reply
+            obj = {'name': BENCH_IFACE}
+            for cache in ('cold', 'warm'):
+                clear_interning()
+                samples = timed_runs(
+                    lambda: util.scan_results(obj),
+                    setup=clear_interning if cache == 'cold' else None)
+                summary = percentiles(samples)
+                results.append({
+                    'benchmark': 'parse_scan_results',
+                    'params': {'bsses': size, 'ssids': ssids_kind,
+                               'cache': cache, 'reply_bytes': len(reply)},
+                    'runs': len(samples),
+                    'seconds': summary,
+                    'bsses_per_second': size / summary['p50']
+                })
+
+    return results
+
+
+def bench_profiles(sizes, ctrl_dir):
+    """Measure adding, listing and removing network profiles."""
+
+    results = []
+    for size in sizes:
+        with WpaSupplicantSimulator(ctrl_dir, [BENCH_IFACE]):
+            util = _wifiutil_linux.WifiUtil()
+            iface = Interface(util.interfaces(True)[0], util)
+            profiles = [make_profile('bench-{}'.format(i))
+                        for i in range(size)]
+
+            t0 = time.perf_counter()
+            for profile in profiles:
+                iface.add_network_profile(profile)
+            add_time = time.perf_counter() - t0
+
+            samples = timed_runs(iface.network_profiles, max_runs=20)
+            list_summary = percentiles(samples)
+
+            t0 = time.perf_counter()
+            iface.remove_network_profile(profiles[-1])
+            remove_time = time.perf_counter() - t0
+
+            t0 = time.perf_counter()
+            iface.remove_all_network_profiles()
+            remove_all_time = time.perf_counter() - t0
+
+            util.close()
+
+        results.append({
+            'benchmark': 'profiles',
+            'params': {'networks': size},
+            'runs': len(samples),
+            'seconds': {
+                'add_all': add_time,
+                'add_each': add_time / size,
+                'list': list_summary,
+                'remove_one': remove_time,
+                'remove_all': remove_all_time
+            }
+        })
+
+    return results
+
+
+def bench_latency(runs, ctrl_dir):
+    """Measure the end-to-end latency of the interface operations."""
+
+    results = []
+    with WpaSupplicantSimulator(ctrl_dir, [BENCH_IFACE],
+                                assoc_delay=0) as sim:
+        sim.populate(40)
+        sim.add_bss('00:11:22:33:44:55', 'testap', 5180, -40,
+                    '[WPA2-PSK-CCMP][ESS]')
+        util = _wifiutil_linux.WifiUtil()
+        iface = Interface(util.interfaces(True)[0], util)
+        profile = iface.add_network_profile(make_profile('testap'))
+
+        operations = [
+            ('status', iface.status),
+            ('scan_results', iface.scan_results),
+            ('network_profiles', iface.network_profiles),
+            ('attempt_connect', lambda: iface.attempt_connect(profile, 5)),
+        ]
+        for name, func in operations:
+            count = runs if name != 'attempt_connect' else max(runs // 10, 3)
+            samples = [timed_runs(func, 0, 1)[0] for _ in range(count)]
+            results.append({
+                'benchmark': 'latency',
+                'params': {'operation': name},
+                'runs': count,
+                'seconds': percentiles(samples)
+            })
+
+        util.close()
+
+    return results
+
+
+def bench_import(runs):
+    """Measure importing pywifi in a fresh interpreter."""
+
+    code = (
+        'import sys, time\n'
+        't = time.perf_counter()\n'
+        'import pywifi\n'
+        'print(time.perf_counter() - t)\n'
+        'print(int(any(m.startswith("pywifi._wifiutil")\n'
+        '              for m in sys.modules)))\n'
+    )
+    root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+    samples = []
+    backend_loaded = False
+    for _ in range(runs):
+        output = subprocess.check_output([sys.executable, '-c', code],
+                                         cwd=root).decode().split()
+        samples.append(float(output[0]))
+        backend_loaded = backend_loaded or output[1] == '1'
+
+    return [{
+        'benchmark': 'import',
+        'params': {'backend_loaded': backend_loaded},
+        'runs': runs,
+        'seconds': percentiles(samples)
+    }]
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--output', default='bench_output.txt',
+                        help='file of the JSON lines results')
+    parser.add_argument('--quick', action='store_true',
+                        help='run the smaller sizes only')
+    parser.add_argument('--only',
+                        choices=['import', 'parse', 'profiles', 'latency'],
+                        action='append', help='run the selected benchmarks')
+    args = parser.parse_args()
+
+    if platform.system().lower() != 'linux':
+        parser.error('the benchmarks need the Linux backend')
+
+    parse_sizes = PARSE_SIZES[:3] if args.quick else PARSE_SIZES
+    profile_sizes = PROFILE_SIZES[:2] if args.quick else PROFILE_SIZES
+    latency_runs = LATENCY_RUNS // 10 if args.quick else LATENCY_RUNS
+    import_runs = IMPORT_RUNS // 4 if args.quick else IMPORT_RUNS
+    selected = args.only or ['import', 'parse', 'profiles', 'latency']
+
+    results = [{
+        'benchmark': 'environment',
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S%z')
+    }]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        ctrl_dir = os.path.join(tmp_dir, 'wpa_supplicant')
+        _wifiutil_linux.CTRL_IFACE_DIR = ctrl_dir
+        _wifiutil_linux.CTRL_GLOBAL_IFACE = os.path.join(tmp_dir, 'global')
+        # The interfaces are listed right after the sockets are created.
+        _wifiutil_linux.CTRL_DIR_SETTLE_TIME = 0
+
+        if 'import' in selected:
+            results += bench_import(import_runs)
+        if 'parse' in selected:
+            results += bench_parse(parse_sizes, ctrl_dir)
+        if 'profiles' in selected:
+            results += bench_profiles(profile_sizes, ctrl_dir)
+        if 'latency' in selected:
+            results += bench_latency(latency_runs, ctrl_dir)
+
+    with open(args.output, 'w') as f:
+        for result in results:
+            f.write(json.dumps(result, sort_keys=True) + '\n')
+
+    for result in results[1:]:
+        seconds = result['seconds']
+        if 'p50' in seconds:
+            timing = 'p50 {:.6f}s p99 {:.6f}s'.format(
+                seconds['p50'], seconds['p99'])
+        else:
+            timing = 'add {:.6f}s/network list p50 {:.6f}s'.format(
+                seconds['add_each'], seconds['list']['p50'])
+        print('{:<20} {:<50} {}'.format(
+            result['benchmark'], json.dumps(result['params']), timing))
+    print('Results are written to {}'.format(args.output))
+
+
+if __name__ == '__main__':
+    main()
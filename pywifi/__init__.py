@@ -11,7 +11,7 @@ This library is made for manipulating wifi device on varient platforms.
 import logging
 
 from . import const 
-from .profile import Profile
+from .profile import Profile, ProfileStore
 from .wifi import PyWiFi
 
 
@@ -23,4 +23,5 @@ def set_loglevel(level=logging.NOTSET):
     logger.setLevel(level)
 
 
-set_loglevel()
+# Leave the logging configuration to the application.
+logging.getLogger('pywifi').addHandler(logging.NullHandler())
@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+# vim: set fileencoding=utf-8
+
+"""Select the wifi backend of the platform on first use."""
+
+import platform
+import threading
+
+_wifiutil = None
+_lock = threading.Lock()
+
+
+def wifiutil():
+    """Get the backend module of the platform, importing it once."""
+
+    global _wifiutil
+
+    if _wifiutil is None:
+        with _lock:
+            if _wifiutil is None:
+                system = platform.system().lower()
+                if system == 'windows':
+                    from . import _wifiutil_win as module
+                elif system == 'linux':
+                    from . import _wifiutil_linux as module
+                else:
+                    raise NotImplementedError
+                _wifiutil = module
+
+    return _wifiutil
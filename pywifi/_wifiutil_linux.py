@@ -3,18 +3,47 @@
 
 """Implementations of wifi functions of Linux."""
 
+import collections
+import itertools
 import logging
+import select
 import socket
 import stat
 import os
 import re
+import threading
+import time
 
 from .const import *
 from .profile import Profile
+from .flightrecorder import FlightRecorder, FLIGHT_RECORDER_SIZE
+from .traffic import TrafficRecorder
+from .interning import intern_bssid, intern_ssid
+from .ie import InformationElements
+from . import metrics
+from . import tracing
 
 CTRL_IFACE_DIR = '/var/run/wpa_supplicant'
+CTRL_GLOBAL_IFACE = '/var/run/wpa_supplicant-global'
 CTRL_IFACE_RETRY = 3
+# Default seconds to wait for the reply of a command.
+CTRL_IFACE_TIMEOUT = 5
+# Seconds of the first and the longest wait between reconnection attempts.
+RECONNECT_DELAY = 0.05
+RECONNECT_MAX_DELAY = 1
+# Seconds of silence after which a monitor is checked with a PING.
+KEEPALIVE_INTERVAL = 30
+# Directory of the client sockets if the abstract namespace is unavailable.
+CLIENT_SOCK_DIR = '/tmp'
+# Seconds for which a changed control directory is listed on every call,
+# since a change within the mtime granularity would go unnoticed.
+CTRL_DIR_SETTLE_TIME = 1
 REPLY_SIZE = 4096
+# The id, BSSID, frequency, level, IEs, flags, SSID, delimiter and beacon
+# IEs of a BSS reply.
+BSS_IES_MASK = 0x821c87
+
+_client_sock_ids = itertools.count()
 
 status_dict = {
     'completed': IFACE_CONNECTED,
@@ -29,6 +58,35 @@ status_dict = {
     'scanning': IFACE_SCANNING
 }
 
+# Indexed by the wpa_states enum carried in CTRL-EVENT-STATE-CHANGE.
+wpa_state_to_status = [
+    IFACE_DISCONNECTED,
+    IFACE_INACTIVE,
+    IFACE_INACTIVE,
+    IFACE_SCANNING,
+    IFACE_CONNECTING,
+    IFACE_CONNECTING,
+    IFACE_CONNECTING,
+    IFACE_CONNECTING,
+    IFACE_CONNECTING,
+    IFACE_CONNECTED
+]
+
+event_to_status = {
+    'CTRL-EVENT-CONNECTED': IFACE_CONNECTED,
+    'CTRL-EVENT-DISCONNECTED': IFACE_DISCONNECTED,
+    'CTRL-EVENT-TERMINATING': IFACE_INACTIVE,
+}
+
+# Events telling that the selected network can not be connected to.
+connect_failure_events = frozenset([
+    'CTRL-EVENT-ASSOC-REJECT',
+    'CTRL-EVENT-AUTH-REJECT',
+    'CTRL-EVENT-NETWORK-NOT-FOUND',
+    'CTRL-EVENT-SSID-TEMP-DISABLED',
+    'CTRL-EVENT-EAP-FAILURE',
+])
+
 key_mgmt_to_str = {
     AKM_TYPE_WPA: 'WPA-EAP',
     AKM_TYPE_WPAPSK: 'WPA-PSK',
@@ -39,6 +97,19 @@ key_mgmt_to_str = {
     AKM_TYPE_WPA3ENT: 'WPA-EAP-SHA256',
 }
 
+key_mgmt_to_ft_str = {
+    'WPA-PSK': 'FT-PSK',
+    'WPA-EAP': 'FT-EAP',
+    'WPA-EAP-SHA256': 'FT-EAP',
+    'SAE': 'FT-SAE',
+}
+
+ft_str_to_key_mgmt = {
+    'FT-PSK': 'WPA-PSK',
+    'FT-EAP': 'WPA-EAP',
+    'FT-SAE': 'SAE',
+}
+
 key_mgmt_to_proto_str = {
     AKM_TYPE_WPA: 'WPA',
     AKM_TYPE_WPAPSK: 'WPA',
@@ -70,19 +141,214 @@ cipher_str_to_value = {
     'CCMP': CIPHER_TYPE_CCMP,
 }
 
+# The AKM of the key management names in the scan flags, by protocol.
+scan_key_mgmt_to_akm = {
+    'WPA': {
+        'PSK': AKM_TYPE_WPAPSK,
+        'EAP': AKM_TYPE_WPA,
+        'NONE': AKM_TYPE_WPANONE,
+    },
+    'RSN': {
+        'PSK': AKM_TYPE_WPA2PSK,
+        'PSK-SHA256': AKM_TYPE_WPA2PSK,
+        'EAP': AKM_TYPE_WPA2,
+        'EAP-SHA256': AKM_TYPE_WPA3ENT,
+        'EAP-SUITE-B': AKM_TYPE_WPA3ENT,
+        'EAP-SUITE-B-192': AKM_TYPE_WPA3ENT,
+        'EAP-SHA384': AKM_TYPE_WPA3ENT,
+        'SAE': AKM_TYPE_WPA3SAE,
+        'SAE-EXT-KEY': AKM_TYPE_WPA3SAE,
+        'OWE': AKM_TYPE_OWE,
+    },
+}
+
+# The strongest first, to pick the AKM and the cipher of a scanned AP.
+akm_strength = [AKM_TYPE_WPA3SAE, AKM_TYPE_WPA3ENT, AKM_TYPE_WPA3,
+                AKM_TYPE_WPA2PSK, AKM_TYPE_WPA2, AKM_TYPE_OWE,
+                AKM_TYPE_WPAPSK, AKM_TYPE_WPA, AKM_TYPE_WPANONE]
+cipher_strength = [CIPHER_TYPE_CCMP, CIPHER_TYPE_TKIP, CIPHER_TYPE_WEP,
+                   CIPHER_TYPE_UNKNOWN]
+
+_scan_flag_re = re.compile(r'\[([^\]]*)\]')
+_security_flag_re = re.compile(
+    r'^(WPA|WPA2|RSN)-([^-].*?)-((?:CCMP|TKIP|GCMP|CCMP-256|GCMP-256|'
+    r'WEP40|WEP104|NONE|\?)(?:\+[^-+]+(?:-256)?)*)(?:-preauth)?$')
+_scan_flags_cache = {}
+_SCAN_FLAGS_CACHE_SIZE = 256
+
+
+def parse_scan_flags(flags):
+    """Parse the flags of a scanned AP like '[WPA-PSK-CCMP][WPA2-PSK-CCMP]'.
+
+    Return a tuple of the AkmFlag, the CipherFlag and whether FT is offered.
+    """
+
+    parsed = _scan_flags_cache.get(flags)
+    if parsed is not None:
+        return parsed
+
+    akms = AkmFlag(0)
+    ciphers = CipherFlag(0)
+    ft = False
+    for group in _scan_flag_re.findall(flags):
+        if group == 'WEP':
+            ciphers |= CipherFlag.WEP
+            continue
+
+        match = _security_flag_re.match(group)
+        if not match:
+            continue
+
+        proto, key_mgmts, pairwise = match.groups()
+        key_mgmt_to_akm = scan_key_mgmt_to_akm[
+            'WPA' if proto == 'WPA' else 'RSN']
+        for key_mgmt in key_mgmts.split('+'):
+            if key_mgmt.startswith('FT/'):
+                ft = True
+                key_mgmt = key_mgmt[3:]
+            if key_mgmt in key_mgmt_to_akm:
+                akms |= akm_flags(key_mgmt_to_akm[key_mgmt])
+        for cipher in pairwise.split('+'):
+            if cipher.startswith('WEP'):
+                cipher = 'WEP'
+            ciphers |= cipher_flags(
+                {'WEP': CIPHER_TYPE_WEP, 'NONE': CIPHER_TYPE_NONE}.get(
+                    cipher, cipher_str_to_value.get(cipher,
+                                                    CIPHER_TYPE_UNKNOWN)))
+
+    if not akms:
+        akms = AkmFlag.NONE
+    if not ciphers:
+        ciphers = CipherFlag.NONE
+
+    if len(_scan_flags_cache) >= _SCAN_FLAGS_CACHE_SIZE:
+        _scan_flags_cache.clear()
+    parsed = _scan_flags_cache[flags] = (akms, ciphers, ft)
+
+    return parsed
+
+
+def _decode_scan_ssid(ssid):
+
+    # 定义一个正则表达式来匹配ssid转义序列
+    pattern = r'\\x([0-9a-fA-F]{2}|[0-9a-fA-F]{4})'
+    # 使用lambda表达式来替换匹配到的ssid转义序列
+    ssid = re.sub(pattern, lambda m: chr(int(m.group(1), 16)), ssid)
+
+    # * 该部分用于将SSID转换为UTF-8编码，可正常显示中文字符 p.s.由 PR #31 提供
+    temp_cnt = 0
+    temp_hex_res = 0
+    bytes_list = []
+    converted_name = ""
+    for bin_encode_char in ssid:
+        if (32 <= ord(bin_encode_char) <= 126):
+            converted_name += bin_encode_char
+        else:
+            temp_cnt += 1
+            temp_now = int(str(bin(ord(bin_encode_char)))[2:6], 2)
+            temp_now1 = int(str(bin(ord(bin_encode_char)))[6:10], 2)
+            temp_hex_res = temp_hex_res + temp_now * 16 + temp_now1
+            bytes_list.append(temp_hex_res)
+            temp_hex_res = 0
+            # 收集到完整的UTF-8字符时（最多四个字节）
+            if temp_cnt >= 1 and temp_cnt <= 4:
+                try:
+                    converted_name = converted_name + bytes(bytes_list).decode('utf-8')
+                    bytes_list = []
+                    temp_hex_res = 0
+                    temp_cnt = 0
+                except UnicodeDecodeError:
+                    # 如果解码失败，忽略错误并继续处理下一个字符
+                    pass
+    # 处理末尾可能剩下的未完成的字节序列
+    if bytes_list:
+        try:
+            decoded_chars = bytes(bytes_list).decode('utf-8', 'ignore')
+            converted_name += decoded_chars
+        except UnicodeDecodeError:
+            pass
+
+    return converted_name
+
+
+def _strongest(flags, strength, default):
+
+    for value in strength:
+        if flags & (1 << value):
+            return value
+
+    return default
+
+
 class WifiUtil():
     """WifiUtil implements the wifi functions in Linux."""
 
-    _connections = {}
+    _ifaces = None
+    _ifaces_stamp = None
     _logger = logging.getLogger('pywifi')
+    # The tracer of this backend, or None to use the global tracer.
+    tracer = None
+
+    def __init__(self, timeout=CTRL_IFACE_TIMEOUT,
+                 flight_size=FLIGHT_RECORDER_SIZE):
+
+        self._timeout = timeout
+        self._flight_recorder = FlightRecorder(flight_size)
+        self._traffic_recorder = None
+        self._connections = {}
+        self._monitors = {}
+        self._associations = {}
+        self._bssid_hints = {}
+        self._stale_socks = set()
+        self._lock = threading.RLock()
+
+    def close(self):
+        """Close all the connections to wpa_supplicant."""
+
+        for name in list(self._monitors):
+            if name != CTRL_GLOBAL_IFACE:
+                self.detach({'name': name})
+
+        for name in list(self._connections):
+            if name != CTRL_GLOBAL_IFACE:
+                self._disconnect_from_wpa_s(name)
+        self._disconnect_from_wpa_s(CTRL_GLOBAL_IFACE)
+
+        self._ifaces = None
+        self._ifaces_stamp = None
+        self.stop_recording()
+
+    def start_recording(self, path):
+        """Record the commands, replies and events to a file."""
+
+        self.stop_recording()
+        self._traffic_recorder = TrafficRecorder(path)
+        if self._ifaces is not None:
+            self._traffic_recorder.record_interfaces(
+                [iface['name'] for iface in self._ifaces])
+
+    def stop_recording(self):
+        """Stop recording and close the file."""
+
+        if self._traffic_recorder is not None:
+            self._traffic_recorder.close()
+            self._traffic_recorder = None
 
     def scan(self, obj):
         """Trigger the wifi interface to scan."""
 
+        if metrics.enabled:
+            metrics.scan_started(obj['name'])
         self._send_cmd_to_wpas(obj['name'], 'SCAN')
 
-    def scan_results(self, obj):
-        """Get the AP list after scanning."""
+    def scan_results(self, obj, ies=False):
+        """Get the AP list after scanning.
+
+        With ies, the information elements of the APs are fetched too.
+        """
+
+        if ies:
+            return self._scan_results_with_ies(obj)
 
         bsses = []
         bsses_summary = self._send_cmd_to_wpas(obj['name'], 'SCAN_RESULTS', True)
@@ -92,69 +358,59 @@ class WifiUtil():
 
         for l in bsses_summary[1:]:
             values = l.split('\t')
-            bss = Profile()
-            bss.bssid = values[0]
-            bss.freq = int(values[1])
-            bss.signal = int(values[2])
-
-            # 定义一个正则表达式来匹配ssid转义序列
-            pattern = r'\\x([0-9a-fA-F]{2}|[0-9a-fA-F]{4})'
-            # 使用lambda表达式来替换匹配到的ssid转义序列
-            ssid = re.sub(pattern, lambda m: chr(int(m.group(1), 16)), values[4])
-
-            # * 该部分用于将SSID转换为UTF-8编码，可正常显示中文字符 p.s.由 PR #31 提供
-            temp_cnt = 0
-            temp_hex_res = 0
-            bytes_list = []
-            converted_name = ""
-            for bin_encode_char in ssid:
-                if (32 <= ord(bin_encode_char) <= 126):
-                    converted_name += bin_encode_char
-                else:
-                    temp_cnt += 1
-                    temp_now = int(str(bin(ord(bin_encode_char)))[2:6], 2)
-                    temp_now1 = int(str(bin(ord(bin_encode_char)))[6:10], 2)
-                    temp_hex_res = temp_hex_res + temp_now * 16 + temp_now1
-                    bytes_list.append(temp_hex_res)
-                    temp_hex_res = 0
-                    # 收集到完整的UTF-8字符时（最多四个字节）
-                    if temp_cnt >= 1 and temp_cnt <= 4:
-                        try:
-                            converted_name = converted_name + bytes(bytes_list).decode('utf-8')
-                            bytes_list = []
-                            temp_hex_res = 0
-                            temp_cnt = 0
-                        except UnicodeDecodeError:
-                            # 如果解码失败，忽略错误并继续处理下一个字符
-                            pass
-            # 处理末尾可能剩下的未完成的字节序列
-            if bytes_list:
-                try:
-                    decoded_chars = bytes(bytes_list).decode('utf-8', 'ignore')
-                    converted_name += decoded_chars
-                except UnicodeDecodeError:
-                    pass
-            bss.ssid = converted_name
-
-            bss.akm = 7
-            if 'WPA-PSK' in values[3]:
-                bss.akm = AKM_TYPE_WPAPSK
-            elif 'WPA2-PSK' in values[3]:
-                bss.akm = AKM_TYPE_WPA2PSK
-            elif 'WPA2-SAE' in values[3]:
-                bss.akm = AKM_TYPE_WPA3SAE
-            elif 'WPA-EAP' in values[3]:
-                bss.akm = AKM_TYPE_WPA
-            elif 'WPA2-EAP' in values[3]:
-                bss.akm = AKM_TYPE_WPA2
-
-            bss.auth = AUTH_ALG_OPEN
-
-            bsses.append(bss)
+            bsses.append(self._scan_bss(values[0], values[1], values[2],
+                                        values[3], values[4]))
 
         return bsses
 
-    def connect(self, obj, network):
+    def _scan_results_with_ies(self, obj):
+
+        # Each BSS reply only holds the whole entries fitting in it, so the
+        # entries are fetched in pages from the id after the last one.
+        bsses = []
+        first = 0
+        while True:
+            reply = self._send_cmd_to_wpas(
+                obj['name'],
+                'BSS RANGE={}- MASK=0x{:x}'.format(first, BSS_IES_MASK),
+                True)
+            if reply.upper().startswith('FAIL'):
+                return bsses
+            entries = [e for e in reply.split('====\n') if e.strip()]
+            last = first
+            for entry in entries:
+                fields = dict(line.split('=', 1)
+                              for line in entry.split('\n') if '=' in line)
+                bss = self._scan_bss(
+                    fields.get('bssid', ''), fields.get('freq', 0),
+                    fields.get('level', 0), fields.get('flags', ''),
+                    fields.get('ssid', ''))
+                bss.ies = InformationElements(fields.get('ie'),
+                                              fields.get('beacon_ie'))
+                bsses.append(bss)
+                first = max(first, int(fields.get('id', -1)) + 1)
+            if first == last:
+                return bsses
+
+    def _scan_bss(self, bssid, freq, signal, flags, ssid):
+
+        bss = Profile()
+        bss.bssid = intern_bssid(bssid)
+        bss.freq = int(freq)
+        bss.signal = int(signal)
+        bss.ssid = intern_ssid(ssid, _decode_scan_ssid)
+
+        akms, ciphers, bss.ft = parse_scan_flags(flags)
+        bss.akm_flags = akms
+        bss.cipher_flags = ciphers
+        bss.akm = _strongest(akms, akm_strength, AKM_TYPE_NONE)
+        bss.cipher = _strongest(ciphers, cipher_strength, CIPHER_TYPE_NONE)
+
+        bss.auth = AUTH_ALG_OPEN
+
+        return bss
+
+    def connect(self, obj, network, fast=False):
         """Connect to the specified AP."""
 
         network_summary = self._send_cmd_to_wpas(
@@ -163,20 +419,61 @@ class WifiUtil():
             True)
         network_summary = network_summary[:-1].split('\n')
         if len(network_summary) == 1:
-            return networks
+            return
+
+        association = None
+        if fast:
+            association = self.last_association(obj, network)
 
         for l in network_summary[1:]:
             values = l.split('\t')
             if values[1] == network.ssid:
+                cmd = 'SELECT_NETWORK {}'.format(values[0])
+                self._clear_bssid_hint(
+                    obj, values[0] if association else None)
+                if association:
+                    # bssid_hint is only a preference, so wpa_supplicant
+                    # still falls back to any BSS if the AP has moved.
+                    self._send_cmd_to_wpas(
+                        obj['name'],
+                        'SET_NETWORK {} bssid_hint {}'.format(
+                            values[0],
+                            association['bssid']))
+                    self._bssid_hints[obj['name']] = values[0]
+                    cmd += ' freq={}'.format(association['freq'])
                 network_summary = self._send_cmd_to_wpas(
                     obj['name'],
-                    'SELECT_NETWORK {}'.format(values[0]),
+                    cmd,
                     True)
 
+    def last_association(self, obj, network):
+        """Get the BSSID and frequency last associated with the profile."""
+
+        return self._associations.get((obj['name'], network.ssid))
+
     def disconnect(self, obj):
         """Disconnect to the specified AP."""
 
         self._send_cmd_to_wpas(obj['name'], 'DISCONNECT')
+        self._clear_bssid_hint(obj)
+
+    def _clear_bssid_hint(self, obj, keep=None):
+
+        # The hint of a fast connect must not outlive its association,
+        # or the later connects would keep preferring that BSS.
+        network_id = self._bssid_hints.get(obj['name'])
+        if network_id is None or network_id == keep:
+            return
+
+        del self._bssid_hints[obj['name']]
+        self._send_cmd_to_wpas(
+            obj['name'],
+            'SET_NETWORK {} bssid_hint any'.format(network_id))
+
+    def roam(self, obj, bssid):
+        """Roam to the specified BSS of the current network."""
+
+        self._send_cmd_to_wpas(obj['name'], 'ROAM {}'.format(bssid))
 
     def add_network_profile(self, obj, params):
         """Add an AP profile for connecting to afterward."""
@@ -202,6 +499,10 @@ class WifiUtil():
         else:
             key_mgmt = 'NONE'
 
+        # Keep the non-FT key management so APs without 802.11r still work.
+        if params.ft and key_mgmt in key_mgmt_to_ft_str:
+            key_mgmt = '{} {}'.format(key_mgmt, key_mgmt_to_ft_str[key_mgmt])
+
         if key_mgmt:
             self._send_cmd_to_wpas(
                     obj['name'],
@@ -231,6 +532,19 @@ class WifiUtil():
                     obj['name'],
                     'SET_NETWORK {} psk \"{}\"'.format(network_id, params.key))
 
+        if params.proactive_key_caching:
+            self._send_cmd_to_wpas(
+                    obj['name'],
+                    'SET_NETWORK {} proactive_key_caching 1'.format(
+                        network_id))
+
+        if params.pmf is not None:
+            self._send_cmd_to_wpas(
+                    obj['name'],
+                    'SET_NETWORK {} ieee80211w {}'.format(
+                        network_id,
+                        params.pmf))
+
         return params
 
     def network_profiles(self, obj):
@@ -267,10 +581,14 @@ class WifiUtil():
                 'GET_NETWORK {} key_mgmt'.format(network_id),
                 True)
 
-            network.akm = []
             if key_mgmt.upper().startswith('FAIL'):
                 continue
             else:
+                key_mgmts = key_mgmt.upper().split()
+                network.ft = any(k in ft_str_to_key_mgmt for k in key_mgmts)
+                key_mgmts = [ft_str_to_key_mgmt.get(k, k) for k in key_mgmts]
+                key_mgmt = key_mgmts[0] if key_mgmts else ''
+
                 if key_mgmt.upper() == 'WPA-PSK':
                     proto = self._send_cmd_to_wpas(
                         obj['name'],
@@ -312,7 +630,8 @@ class WifiUtil():
             else:
                 # Assume the possible ciphers TKIP and CCMP
                 if len(ciphers) == 1:
-                    network.cipher = cipher_str_to_value(ciphers[0].upper())
+                    network.cipher = cipher_str_to_value.get(
+                        ciphers[0].upper(), CIPHER_TYPE_UNKNOWN)
                 elif 'CCMP' in ciphers:
                     network.cipher = CIPHER_TYPE_CCMP
 
@@ -327,7 +646,7 @@ class WifiUtil():
         profiles = self.network_profiles(obj)
 
         for profile in profiles:
-            if profile == params:
+            if profile.matches(params):
                 network_id = profile.id
 
         if network_id != -1:
@@ -339,21 +658,213 @@ class WifiUtil():
 
         self._send_cmd_to_wpas(obj['name'], 'REMOVE_NETWORK all')
 
+    def pmksa(self, obj):
+        """Get the PMKSA cache entries."""
+
+        entries = []
+        pmksa_summary = self._send_cmd_to_wpas(obj['name'], 'PMKSA', True)
+        pmksa_summary = pmksa_summary[:-1].split('\n')
+
+        for l in pmksa_summary[1:]:
+            values = l.split()
+            if len(values) < 5:
+                continue
+            entries.append({
+                'bssid': values[1],
+                'pmkid': values[2],
+                'expiration': int(values[3]),
+                'opportunistic': values[4] == '1'
+            })
+
+        return entries
+
+    def pmksa_flush(self, obj):
+        """Flush the PMKSA cache."""
+
+        self._send_cmd_to_wpas(obj['name'], 'PMKSA_FLUSH')
+
     def status(self, obj):
         """Get the wifi interface status."""
 
         reply = self._send_cmd_to_wpas(obj['name'], 'STATUS', True)
-        result = reply.split('\n')
 
-        status = ''
-        for l in result:
-            if l.startswith('wpa_state='):
-                status = l[10:]
-                return status_dict[status.lower()]
+        fields = {}
+        for l in reply.split('\n'):
+            key, sep, value = l.partition('=')
+            if sep:
+                fields[key] = value
+
+        if 'wpa_state' not in fields:
+            return None
+
+        status = status_dict[fields['wpa_state'].lower()]
+        if status == IFACE_CONNECTED and 'bssid' in fields and \
+                'freq' in fields and 'ssid' in fields:
+            # The SSID of STATUS is escaped like in the scan results.
+            ssid = intern_ssid(fields['ssid'], _decode_scan_ssid)
+            self._associations[(obj['name'], ssid)] = {
+                'bssid': fields['bssid'],
+                'freq': int(fields['freq'])
+            }
 
-    def interfaces(self):
+        return status
+
+    def interfaces(self, refresh=False):
         """Get the wifi interface lists."""
-        
+
+        # The interfaces are only discovered again when the control
+        # sockets have changed.
+        stamp = self._ctrl_dir_stamp()
+        if not refresh and stamp is not None and stamp == self._ifaces_stamp:
+            return [dict(iface) for iface in self._ifaces]
+
+        ifaces = None
+        if self._is_ctrl_sock(CTRL_GLOBAL_IFACE):
+            ifaces = self._global_interfaces()
+        if ifaces is None:
+            ifaces = self._ctrl_dir_interfaces()
+
+        names = set(iface['name'] for iface in ifaces)
+        for name in list(self._connections):
+            if name != CTRL_GLOBAL_IFACE and name not in names:
+                self._logger.info("Interface '%s' is removed", name)
+                self._disconnect_from_wpa_s(name)
+
+        self._ifaces = ifaces
+        self._ifaces_stamp = stamp
+        if self._traffic_recorder is not None:
+            self._traffic_recorder.record_interfaces(
+                [iface['name'] for iface in ifaces])
+
+        return [dict(iface) for iface in ifaces]
+
+    def attach(self, obj):
+        """Subscribe to the unsolicited events of the wifi interface."""
+
+        # The threads connecting on several interfaces may attach at once
+        # and must not open two monitors of the global control interface.
+        with self._lock:
+            iface = obj['name']
+            if iface in self._monitors:
+                return
+
+            conn = self._connections.get(iface)
+            if conn is None or 'ifname' not in conn:
+                monitor = self._open_monitor(
+                    '/'.join([CTRL_IFACE_DIR, iface]))
+                if monitor is not None:
+                    self._monitors[iface] = monitor
+                return
+
+            # All the interfaces share the monitor of the global control
+            # interface, and its events are sorted into a queue per
+            # interface.
+            monitor = self._monitors.get(CTRL_GLOBAL_IFACE)
+            if monitor is None:
+                monitor = self._open_monitor(CTRL_GLOBAL_IFACE)
+                if monitor is None:
+                    return
+                monitor['queues'] = {}
+                self._monitors[CTRL_GLOBAL_IFACE] = monitor
+
+            monitor['queues'][iface] = collections.deque()
+            self._monitors[iface] = monitor
+
+    def detach(self, obj):
+        """Stop receiving the events of the wifi interface."""
+
+        with self._lock:
+            monitor = self._monitors.pop(obj['name'], None)
+            if monitor is None:
+                return
+
+            if 'queues' in monitor:
+                monitor['queues'].pop(obj['name'], None)
+                if monitor['queues']:
+                    return
+                self._monitors.pop(CTRL_GLOBAL_IFACE, None)
+
+            try:
+                monitor['sock'].send(b'DETACH')
+            except OSError:
+                # The control interface is already gone.
+                pass
+            monitor['sock'].close()
+            self._remove_existed_sock(monitor['sock_file'])
+
+    def events(self, obj, timeout=0):
+        """Get the pending events, waiting up to timeout for the first."""
+
+        iface = obj['name']
+        monitor = self._monitors.get(iface)
+        if monitor is None:
+            return []
+
+        # The datagrams received since the last poll, the PONG included,
+        # are taken first so a slow poller does not attach again for a
+        # PONG it has not read yet.
+        pending = self._recv_events(monitor, 0)
+        self._check_monitor(monitor)
+
+        if 'queues' not in monitor:
+            if not pending:
+                pending = self._recv_events(monitor, timeout)
+            events = [self._strip_event_level(msg) for msg in pending]
+            self._record_events(iface, events)
+            return events
+
+        queue = monitor['queues'][iface]
+        self._dispatch_events(monitor, pending)
+        deadline = time.monotonic() + timeout
+        while not queue and time.monotonic() < deadline:
+            self._dispatch_events(monitor, self._recv_events(
+                monitor, max(deadline - time.monotonic(), 0)))
+
+        events = list(queue)
+        queue.clear()
+        self._record_events(iface, events)
+
+        return events
+
+    def flight_records(self, obj):
+        """Get the recent commands, replies and events of the interface."""
+
+        return self._flight_recorder.records(obj['name'])
+
+    def dump_flight_records(self, obj, stream=None):
+        """Write the recent commands, replies and events of the interface."""
+
+        self._flight_recorder.dump(stream, obj['name'])
+
+    def event_status(self, event):
+        """Get the interface status implied by an event, or None."""
+
+        name = event.split(' ', 1)[0]
+        if name == 'CTRL-EVENT-STATE-CHANGE':
+            match = re.search(r'\bstate=(\d+)', event)
+            if match and int(match.group(1)) < len(wpa_state_to_status):
+                return wpa_state_to_status[int(match.group(1))]
+            return None
+
+        return event_to_status.get(name)
+
+    def connect_failed(self, event):
+        """Check whether an event tells that connecting has failed."""
+
+        return event.split(' ', 1)[0] in connect_failure_events
+
+    def _record_events(self, iface, events):
+
+        for event in events:
+            self._flight_recorder.record_event(iface, event)
+            if self._traffic_recorder is not None:
+                self._traffic_recorder.record_event(iface, event)
+            if metrics.enabled and \
+                    event.startswith('CTRL-EVENT-SCAN-RESULTS'):
+                metrics.scan_completed(iface)
+
+    def _ctrl_dir_interfaces(self):
+
         ifaces = []
         for f in sorted(os.listdir(CTRL_IFACE_DIR)):
             sock_file = '/'.join([CTRL_IFACE_DIR, f])
@@ -362,58 +873,345 @@ class WifiUtil():
                 iface = {}
                 iface['name'] = f
                 ifaces.append(iface)
-                self._connect_to_wpa_s(f)
+                if f not in self._connections:
+                    self._connect_to_wpa_s(f)
+
+        return ifaces
+
+    def _ctrl_dir_stamp(self):
+
+        stamp = []
+        for path in (CTRL_IFACE_DIR, CTRL_GLOBAL_IFACE):
+            try:
+                st = os.stat(path)
+            except OSError:
+                stamp.append(None)
+                continue
+            if time.time() - st.st_mtime < CTRL_DIR_SETTLE_TIME:
+                return None
+            stamp.append((st.st_ino, st.st_mtime_ns))
+
+        # An interface added with INTERFACE_ADD through the global control
+        # interface may have no control socket in the directory, so the
+        # interfaces listed by wpa_supplicant are part of the stamp.
+        if CTRL_GLOBAL_IFACE in self._connections and stamp[1] is not None:
+            try:
+                reply = self._send_cmd_to_wpas(CTRL_GLOBAL_IFACE,
+                                               'INTERFACES', True)
+            except OSError:
+                return None
+            stamp.append(tuple(sorted(reply.split())))
+
+        return tuple(stamp)
+
+    def _global_interfaces(self):
+
+        if CTRL_GLOBAL_IFACE not in self._connections:
+            self._connect_to_wpa_s(CTRL_GLOBAL_IFACE, CTRL_GLOBAL_IFACE)
+            if CTRL_GLOBAL_IFACE not in self._connections:
+                return None
+
+        reply = self._send_cmd_to_wpas(CTRL_GLOBAL_IFACE, 'INTERFACES', True)
+        if reply.startswith('FAIL') or reply.startswith('UNKNOWN COMMAND'):
+            return None
+
+        # Each interface is driven through the global connection by
+        # prefixing its commands with IFNAME=<iface>.
+        conn = self._connections[CTRL_GLOBAL_IFACE]
+        ifaces = []
+        for name in sorted(reply.split()):
+            iface = {}
+            iface['name'] = name
+            ifaces.append(iface)
+            self._connections[name] = dict(conn, ifname=name)
 
         return ifaces
 
-    def _connect_to_wpa_s(self, iface):
+    def _is_ctrl_sock(self, ctrl_iface):
 
-        ctrl_iface = '/'.join([CTRL_IFACE_DIR, iface])
-        if ctrl_iface in self._connections:
+        return os.path.exists(ctrl_iface) and \
+            stat.S_ISSOCK(os.stat(ctrl_iface).st_mode)
+
+    def _open_monitor(self, ctrl_iface):
+
+        sock, sock_file = self._open_ctrl_sock(
+            ctrl_iface,
+            os.path.basename(ctrl_iface) + '_mon')
+
+        try:
+            sock.settimeout(self._timeout)
+            sock.send(b'ATTACH')
+            reply = sock.recv(REPLY_SIZE)
+        except OSError as err:
+            self._logger.error("Attach to '%s' failed: %s", ctrl_iface, err)
+            reply = None
+        if reply != b'OK\n':
+            self._logger.error("Attach to '%s' failed!", ctrl_iface)
+            sock.close()
+            self._remove_existed_sock(sock_file)
+            return None
+
+        # Events are waited for with select().
+        sock.settimeout(None)
+
+        return {
+            'sock': sock,
+            'sock_file': sock_file,
+            'ctrl_iface': ctrl_iface,
+            'alive_at': time.monotonic(),
+            'ping_at': None
+        }
+
+    def _reopen_monitor(self, monitor):
+
+        try:
+            new_monitor = self._open_monitor(monitor['ctrl_iface'])
+        except OSError as err:
+            self._logger.error("Attach to '%s' failed: %s",
+                               monitor['ctrl_iface'], err)
+            new_monitor = None
+        if new_monitor is None:
+            # Try again at the next check.
+            monitor['alive_at'] = time.monotonic()
+            monitor['ping_at'] = None
+            return
+
+        monitor['sock'].close()
+        self._remove_existed_sock(monitor['sock_file'])
+        # Update in place, since the monitor of the global control
+        # interface is shared by several interfaces.
+        monitor.update(new_monitor)
+
+    def _check_monitor(self, monitor):
+
+        now = time.monotonic()
+        if now - monitor['alive_at'] < KEEPALIVE_INTERVAL:
+            return
+
+        # wpa_supplicant drops the monitors it can't deliver events to and
+        # forgets all of them on restart, so attach again if PING fails.
+        if monitor['ping_at'] is not None and \
+                now - monitor['ping_at'] > self._timeout:
+            self._logger.warning("Monitor of '%s' is not answering, "
+                                 "attach again", monitor['ctrl_iface'])
+            self._reopen_monitor(monitor)
+            return
+
+        if monitor['ping_at'] is None:
+            try:
+                monitor['sock'].send(b'PING')
+                monitor['ping_at'] = now
+            except OSError:
+                self._reopen_monitor(monitor)
+
+    def _recv_events(self, monitor, timeout):
+
+        msgs = []
+        sock = monitor['sock']
+        while select.select([sock], [], [], timeout)[0]:
+            try:
+                msg = sock.recv(REPLY_SIZE, socket.MSG_DONTWAIT)
+            except (BlockingIOError, InterruptedError):
+                # Another thread has taken the message.
+                break
+            except OSError:
+                self._reopen_monitor(monitor)
+                break
+            timeout = 0
+            monitor['alive_at'] = time.monotonic()
+            monitor['ping_at'] = None
+            if msg.startswith(b'PONG'):
+                continue
+            msgs.append(msg.decode('utf-8', 'replace'))
+
+        return msgs
+
+    def _dispatch_events(self, monitor, msgs):
+
+        for msg in msgs:
+            if not msg.startswith('IFNAME='):
+                continue
+            name, _, msg = msg[len('IFNAME='):].partition(' ')
+            if name in monitor['queues']:
+                monitor['queues'][name].append(self._strip_event_level(msg))
+
+    def _strip_event_level(self, msg):
+
+        if msg.startswith('<'):
+            msg = msg[msg.find('>') + 1:]
+
+        return msg
+
+    def _open_ctrl_sock(self, ctrl_iface, name):
+
+        # Each socket gets an address of its own, so replies never go to
+        # another process or PyWiFi using the same interface.
+        sock_name = '{}_{}_{}_{}'.format(
+            'pywifi', name, os.getpid(), next(_client_sock_ids))
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        sock_file = None
+        try:
+            # An abstract address leaves nothing on the filesystem.
+            sock.bind('\0' + sock_name)
+        except OSError:
+            sock_file = '/'.join([CLIENT_SOCK_DIR, sock_name])
+            self._remove_existed_sock(sock_file)
+            sock.bind(sock_file)
+
+        try:
+            sock.connect(ctrl_iface)
+        except OSError:
+            sock.close()
+            self._remove_existed_sock(sock_file)
+            raise
+
+        return sock, sock_file
+
+    def _connect_to_wpa_s(self, iface, ctrl_iface=None):
+
+        if iface in self._connections:
             self._logger.info(
                 "Connection for iface '%s' aleady existed!",
                 iface)
 
-        sock_file = '{}/{}_{}'.format('/tmp', 'pywifi', iface)
-        self._remove_existed_sock(sock_file)
-        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
-        sock.bind(sock_file)
-        sock.connect(ctrl_iface)
+        conn = self._open_connection(iface, ctrl_iface)
+        if conn is not None:
+            self._connections[iface] = conn
 
-        send_len = sock.send(b'PING')
-        retry = CTRL_IFACE_RETRY
-        while retry >= 0:
-            reply = sock.recv(REPLY_SIZE)
-            if reply == b'':
-                self._logger.error("Connection to '%s' is broken!", iface_ctrl)
-                break
+        return conn
+
+    def _open_connection(self, iface, ctrl_iface=None):
+
+        if ctrl_iface is None:
+            ctrl_iface = '/'.join([CTRL_IFACE_DIR, iface])
+
+        try:
+            sock, sock_file = self._open_ctrl_sock(
+                ctrl_iface,
+                os.path.basename(iface))
+        except OSError as err:
+            self._logger.error("Connect to '%s' failed: %s", ctrl_iface, err)
+            return None
 
-            if reply.startswith(b'PONG'):
-                self._logger.info(
-                    "Connect to sock '%s' successfully!", ctrl_iface)
-                self._connections[iface] = {
-                    'sock': sock,
-                    'sock_file': sock_file,
-                    'ctrl_iface': ctrl_iface
-                }
+        conn = None
+        retry = CTRL_IFACE_RETRY
+        try:
+            sock.settimeout(self._timeout)
+            sock.send(b'PING')
+            while retry >= 0:
+                reply = sock.recv(REPLY_SIZE)
+                if reply.startswith(b'PONG'):
+                    break
+                retry -= 1
+        except OSError as err:
+            self._logger.error("Connection to '%s' is broken: %s",
+                               ctrl_iface, err)
+            retry = -1
+
+        if retry >= 0:
+            self._logger.info(
+                "Connect to sock '%s' successfully!", ctrl_iface)
+            conn = {
+                'sock': sock,
+                'sock_file': sock_file,
+                'ctrl_iface': ctrl_iface,
+                'lock': threading.Lock()
+            }
+        else:
+            sock.close()
+            self._remove_existed_sock(sock_file)
+
+        return conn
+
+    def _reconnect(self, iface, deadline, broken=None):
+
+        with self._lock:
+            old_conn = self._connections.get(iface)
+            name = iface
+            ctrl_iface = None
+            if old_conn is not None and 'ifname' in old_conn:
+                name = CTRL_GLOBAL_IFACE
+                ctrl_iface = CTRL_GLOBAL_IFACE
+                old_conn = self._connections.get(name)
+            elif iface == CTRL_GLOBAL_IFACE:
+                ctrl_iface = CTRL_GLOBAL_IFACE
+
+            if old_conn is not None:
+                if broken is None or old_conn['sock'] is not broken['sock']:
+                    # Another thread has reconnected already.
+                    return self._connections[iface]
+                self._connections.pop(name, None)
+                self._stale_socks.discard(old_conn['sock'])
+                old_conn['sock'].close()
+                self._remove_existed_sock(old_conn['sock_file'])
+
+        # Back off while wpa_supplicant recreates its socket, without the
+        # lock so the other interfaces are served meanwhile.
+        delay = RECONNECT_DELAY
+        while True:
+            conn = self._open_connection(name, ctrl_iface)
+            if conn is not None:
                 break
-            retry -= 1
+            if time.monotonic() + delay > deadline:
+                raise socket.timeout(
+                    "Can't connect to wpa_supplicant for '{}'".format(iface))
+            time.sleep(delay)
+            delay = min(delay * 2, RECONNECT_MAX_DELAY)
+
+        with self._lock:
+            if name in self._connections:
+                # Another thread has reconnected meanwhile.
+                conn['sock'].close()
+                self._remove_existed_sock(conn['sock_file'])
+                return self._connections[iface]
+
+            self._connections[name] = conn
+            if name == CTRL_GLOBAL_IFACE:
+                for other in list(self._connections):
+                    if 'ifname' in self._connections[other]:
+                        self._connections[other] = dict(conn, ifname=other)
+
+            if old_conn is not None:
+                monitors = dict((id(m), m) for m in self._monitors.values())
+                for monitor in monitors.values():
+                    if monitor['ctrl_iface'] == conn['ctrl_iface']:
+                        self._reopen_monitor(monitor)
+
+            return self._connections[iface]
+
+    def _disconnect_from_wpa_s(self, iface):
+
+        conn = self._connections.pop(iface, None)
+        if conn is None:
+            return
+
+        self.detach({'name': iface})
+        if 'ifname' in conn:
+            # The socket belongs to the global connection.
+            return
+
+        conn['sock'].close()
+        self._remove_existed_sock(conn['sock_file'])
 
     def _remove_existed_sock(self, sock_file):
 
-        if os.path.exists(sock_file):
+        if sock_file and os.path.exists(sock_file):
             mode = os.stat(sock_file).st_mode
             if stat.S_ISSOCK(mode):
                 os.remove(sock_file)
 
-    def _send_cmd_to_wpas(self, iface, cmd, get_reply=False):
+    def _send_cmd_to_wpas(self, iface, cmd, get_reply=False, timeout=None):
 
-        if 'psk' not in cmd:
-            self._logger.info("Send cmd '%s' to wpa_s", cmd)
-        sock = self._connections[iface]['sock']
+        if timeout is None:
+            timeout = self._timeout
+
+        if tracing.get_tracer(self) is not None:
+            reply = self._traced_roundtrip(iface, cmd, timeout)
+        elif metrics.enabled:
+            reply = self._measured_roundtrip(iface, cmd, timeout)
+        else:
+            reply = self._roundtrip(iface, cmd, timeout)
 
-        sock.send(bytearray(cmd, 'utf-8'))
-        reply = sock.recv(REPLY_SIZE)
         if get_reply:
             return reply.decode('utf-8')
 
@@ -422,3 +1220,108 @@ class WifiUtil():
                 "Unexpected resp '%s' for Command '%s'",
                 reply.decode('utf-8'),
                 cmd)
+
+    def _measured_roundtrip(self, iface, cmd, timeout):
+
+        reply = None
+        start = time.perf_counter()
+        try:
+            reply = self._roundtrip(iface, cmd, timeout)
+            return reply
+        finally:
+            metrics.record_command(
+                cmd.split(' ', 1)[0], len(cmd),
+                0 if reply is None else len(reply),
+                time.perf_counter() - start,
+                reply is None or reply.startswith(b'FAIL'))
+
+    def _traced_roundtrip(self, iface, cmd, timeout):
+
+        span = tracing.start_span(cmd.split(' ', 1)[0], self, iface=iface)
+        reply = None
+        error = None
+        try:
+            if metrics.enabled:
+                reply = self._measured_roundtrip(iface, cmd, timeout)
+            else:
+                reply = self._roundtrip(iface, cmd, timeout)
+            return reply
+        except Exception as err:
+            error = err
+            raise
+        finally:
+            if reply is None:
+                tracing.end_span(span, error)
+            else:
+                tracing.end_span(span, reply_size=len(reply),
+                                 failed=reply.startswith(b'FAIL'))
+
+    def _roundtrip(self, iface, cmd, timeout):
+
+        started = time.monotonic()
+        deadline = started + timeout
+        self._flight_recorder.record_cmd(iface, cmd)
+        reply = None
+        while reply is None:
+            conn = self._connections.get(iface)
+            if conn is None:
+                conn = self._reconnect(iface, deadline)
+
+            try:
+                reply = self._request(conn, cmd, deadline)
+            except socket.timeout as err:
+                self._flight_recorder.record_error(iface, err)
+                self._logger.error(
+                    "Command '%s' to '%s' timed out after %ss",
+                    cmd.split(' ', 1)[0], iface, timeout)
+                if self._logger.isEnabledFor(logging.DEBUG):
+                    self._logger.debug("Recent traffic of '%s':\n%s", iface,
+                                       self._flight_recorder.format(iface))
+                raise
+            except OSError as err:
+                # wpa_supplicant has restarted and recreated its socket.
+                self._flight_recorder.record_error(iface, err)
+                self._logger.warning("Connection to '%s' is broken: %s",
+                                     conn['ctrl_iface'], err)
+                self._reconnect(iface, deadline, conn)
+
+        self._flight_recorder.record_reply(iface, reply)
+        if self._traffic_recorder is not None:
+            self._traffic_recorder.record_exchange(
+                iface, cmd, reply, started, time.monotonic())
+
+        return reply
+
+    def _request(self, conn, cmd, deadline):
+
+        sock = conn['sock']
+        if 'ifname' in conn:
+            cmd = 'IFNAME={} {}'.format(conn['ifname'], cmd)
+
+        # A global connection is shared by the interfaces, so keep each
+        # command and its reply together.
+        with conn['lock']:
+            if sock in self._stale_socks:
+                # Drop the late replies of the commands which timed out.
+                self._stale_socks.discard(sock)
+                self._drain_sock(sock)
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise socket.timeout('Deadline exceeded')
+            sock.settimeout(remaining)
+            try:
+                sock.send(bytearray(cmd, 'utf-8'))
+                return sock.recv(REPLY_SIZE)
+            except socket.timeout:
+                self._stale_socks.add(sock)
+                raise
+
+    def _drain_sock(self, sock):
+
+        sock.settimeout(0)
+        while True:
+            try:
+                sock.recv(REPLY_SIZE, socket.MSG_DONTWAIT)
+            except (BlockingIOError, InterruptedError):
+                break
@@ -13,6 +13,8 @@ from comtypes import GUID
 
 from .const import *
 from .profile import Profile
+from .interning import intern_bssid, intern_ssid
+from .ie import InformationElements
 
 
 if platform.release().lower() == 'xp':
@@ -253,18 +255,40 @@ class WLAN_PROFILE_INFO_LIST(Structure):
 class WifiUtil():
     """WifiUtil implements the wifi functions in Windows."""
 
-    _nego_version = DWORD()
-    _handle = HANDLE()
-    _ifaces = pointer(WLAN_INTERFACE_INFO_LIST())
+    _nego_version = None
+    _handle = None
+    _ifaces = None
     _logger = logging.getLogger('pywifi')
 
+    def __init__(self):
+
+        # Each instance opens its own client handle once and reuses it.
+        self._nego_version = DWORD()
+        self._handle = HANDLE()
+        self._ifaces = pointer(WLAN_INTERFACE_INFO_LIST())
+        if self._wlan_open_handle(CLIENT_VERSION,
+                                  byref(self._nego_version),
+                                  byref(self._handle)) \
+           is not ERROR_SUCCESS:
+            self._logger.error("Open handle failed!")
+
+    def close(self):
+        """Close the handle of the Native Wifi API."""
+
+        if self._handle.value:
+            self._wlan_close_handle(self._handle)
+            self._handle = HANDLE()
+
     def scan(self, obj):
         """Trigger the wifi interface to scan."""
 
         self._wlan_scan(self._handle, byref(obj['guid']))
 
-    def scan_results(self, obj):
-        """Get the AP list after scanning."""
+    def scan_results(self, obj, ies=False):
+        """Get the AP list after scanning.
+
+        With ies, the information elements of the APs are kept too.
+        """
 
         avail_network_list = pointer(WLAN_AVAILABLE_NETWORK_LIST())
         self._wlan_get_available_network_list(self._handle,
@@ -333,7 +357,7 @@ class WifiUtil():
                     except UnicodeDecodeError:
                         pass
         
-                ssid = converted_name
+                ssid = intern_ssid(converted_name)
                 # * 转换结束
                 
                 bss_list = pointer(WLAN_BSS_LIST())
@@ -359,21 +383,24 @@ class WifiUtil():
                     network = Profile()
 
                     network.ssid = ssid # type: ignore
-
-                    network.bssid = '' # type: ignore
-                    for k in range(6):
-                        network.bssid += "%02x:" % bsses[j].dot11Bssid[k]
+                    network.bssid = intern_bssid(
+                        bytes(bsses[j].dot11Bssid)) # type: ignore
 
                     network.signal = bsses[j].lRssi # type: ignore
                     network.freq = bsses[j].ulChCenterFrequency # type: ignore
                     network.auth = auth_alg
                     network.akm = akm
                     network.cipher = cipher
+                    if ies:
+                        # The IEs follow the entry at its offset.
+                        network.ies = InformationElements(string_at(
+                            addressof(bsses[j]) + bsses[j].ulIeOffset,
+                            bsses[j].ulIeSize))
                     network_list.append(network)
 
         return network_list
 
-    def connect(self, obj, params):
+    def connect(self, obj, params, fast=False):
         """Connect to the specified AP."""
 
         connect_params = WLAN_CONNECTION_PARAMETERS()
@@ -386,6 +413,17 @@ class WifiUtil():
             self._handle, obj['guid'], byref(connect_params))
         self._logger.debug('connect result: %d', ret)
 
+    def roam(self, obj, bssid):
+        """Roam to the specified BSS of the current network."""
+
+        raise NotImplementedError(
+            "Roaming to a BSS is not exposed by WLAN API")
+
+    def last_association(self, obj, params):
+        """Get the BSSID and frequency last associated with the profile."""
+
+        return None
+
     def disconnect(self, obj):
         """Disconnect to the specified AP."""
 
@@ -546,17 +584,69 @@ class WifiUtil():
 
         return status_dict[data.contents.value]
 
-    def interfaces(self):
+    def pmksa(self, obj):
+        """Get the PMKSA cache entries."""
+
+        raise NotImplementedError("PMKSA cache is not exposed by WLAN API")
+
+    def pmksa_flush(self, obj):
+        """Flush the PMKSA cache."""
+
+        raise NotImplementedError("PMKSA cache is not exposed by WLAN API")
+
+    def attach(self, obj):
+        """Subscribe to the events of the wifi interface."""
+
+        # Native Wifi notifications are not wired up, so a tracked status
+        # is refreshed by polling only.
+
+    def detach(self, obj):
+        """Stop receiving the events of the wifi interface."""
+
+    def events(self, obj, timeout=0):
+        """Get the pending events of the wifi interface."""
+
+        if timeout:
+            time.sleep(timeout)
+
+        return []
+
+    def start_recording(self, path):
+        """Record the commands, replies and events to a file."""
+
+        raise NotImplementedError(
+            "WLAN API has no wpa_supplicant traffic to record")
+
+    def stop_recording(self):
+        """Stop recording and close the file."""
+
+        pass
+
+    def flight_records(self, obj):
+        """Get the recent commands, replies and events of the interface."""
+
+        return []
+
+    def dump_flight_records(self, obj, stream=None):
+        """Write the recent commands, replies and events of the interface."""
+
+        pass
+
+    def event_status(self, event):
+        """Get the interface status implied by an event, or None."""
+
+        return None
+
+    def connect_failed(self, event):
+        """Check whether an event tells that connecting has failed."""
+
+        return False
+
+    def interfaces(self, refresh=False):
         """Get the wifi interface lists."""
 
         ifaces = []
 
-        if self._wlan_open_handle(CLIENT_VERSION,
-                                  byref(self._nego_version),
-                                  byref(self._handle)) \
-           is not ERROR_SUCCESS:
-            self._logger.error("Open handle failed!")
-
         if self._wlan_enum_interfaces(self._handle, byref(self._ifaces)) \
            is not ERROR_SUCCESS:
             self._logger.error("Enum interface failed!")
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+# vim: set fileencoding=utf-8
+
+"""Summarize the channels and bands of scan results for channel planning.
+
+The summaries are computed over columns of the scan, the frequencies and
+the signals, with NumPy if it is installed and from the standard array
+module otherwise.
+"""
+
+import array
+import collections
+import math
+
+from .const import *
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# The frequencies in MHz covered by the lookup tables.
+FREQ_MIN = 2400
+FREQ_MAX = 7125
+# MHz between two channel centers at which they stop overlapping.
+OVERLAP_WIDTH = 20
+
+
+def _build_tables():
+
+    channels = array.array('h', bytes(2 * (FREQ_MAX - FREQ_MIN + 1)))
+    bands = array.array('b', bytes(FREQ_MAX - FREQ_MIN + 1))
+    for channel in range(1, 14):
+        freq = 2407 + channel * 5
+        channels[freq - FREQ_MIN] = channel
+        bands[freq - FREQ_MIN] = BAND_2GHZ
+    channels[2484 - FREQ_MIN] = 14
+    bands[2484 - FREQ_MIN] = BAND_2GHZ
+    for freq in range(4910, 5900, 5):
+        channels[freq - FREQ_MIN] = (freq - 5000) // 5 if freq >= 5000 \
+            else (freq - 4000) // 5
+        bands[freq - FREQ_MIN] = BAND_5GHZ
+    for freq in range(5955, FREQ_MAX + 1, 5):
+        channels[freq - FREQ_MIN] = (freq - 5950) // 5
+        bands[freq - FREQ_MIN] = BAND_6GHZ
+    channels[5935 - FREQ_MIN] = 2
+    bands[5935 - FREQ_MIN] = BAND_6GHZ
+
+    return channels, bands
+
+
+channel_table, band_table = _build_tables()
+
+
+def freq_mhz(freq):
+    """Get a center frequency given in MHz or in kHz in MHz.
+
+    Windows reports the frequencies in kHz and wpa_supplicant in MHz.
+    """
+
+    if freq > 0xffff:
+        return freq // 1000
+
+    return freq
+
+
+def freq_channel(freq):
+    """Get the channel number of a center frequency, or 0 if unknown."""
+
+    freq = freq_mhz(freq)
+    if FREQ_MIN <= freq <= FREQ_MAX:
+        return channel_table[freq - FREQ_MIN]
+
+    return 0
+
+
+def freq_band(freq):
+    """Get the BAND_* of a center frequency, or 0 if unknown."""
+
+    freq = freq_mhz(freq)
+    if FREQ_MIN <= freq <= FREQ_MAX:
+        return band_table[freq - FREQ_MIN]
+
+    return 0
+
+
+def scan_columns(bsses):
+    """Get the frequencies in MHz and the signals of the scan results."""
+
+    freqs = array.array('l', [freq_mhz(bss.freq or 0) for bss in bsses])
+    signals = array.array('l', [bss.signal or 0 for bss in bsses])
+
+    return {'freq': freqs, 'signal': signals}
+
+
+def analyze(scan, use_numpy=None):
+    """Get the channel occupancy, band summaries and interference of a scan.
+
+    scan is a list of scan results or a dict of the 'freq' and 'signal'
+    columns. The channels are keyed by (band, channel). The interference
+    of a channel is the power in dBm of all the BSSes, weighted by how
+    much their channels overlap with it.
+    """
+
+    if isinstance(scan, dict):
+        columns = scan
+    else:
+        columns = scan_columns(scan)
+    if use_numpy is None:
+        use_numpy = numpy is not None
+
+    if use_numpy:
+        return _analyze_numpy(columns['freq'], columns['signal'])
+
+    return _analyze_arrays(columns['freq'], columns['signal'])
+
+
+def _analyze_arrays(freqs, signals):
+
+    counts = collections.Counter()
+    powers = collections.defaultdict(float)
+    bands = {}
+    for freq, signal in zip(freqs, signals):
+        freq = freq_mhz(freq)
+        if not FREQ_MIN <= freq <= FREQ_MAX or \
+                not band_table[freq - FREQ_MIN]:
+            continue
+        counts[freq] += 1
+        powers[freq] += 10 ** (signal / 10)
+        band = band_table[freq - FREQ_MIN]
+        summary = bands.get(band)
+        if summary is None:
+            bands[band] = [1, signal, signal, signal]
+        else:
+            summary[0] += 1
+            summary[1] += signal
+            summary[2] = min(summary[2], signal)
+            summary[3] = max(summary[3], signal)
+
+    # The BSSes are grouped by frequency, so the overlaps are only taken
+    # between the few frequencies in use.
+    interference = {}
+    for freq in counts:
+        total = 0.0
+        for other, power in powers.items():
+            weight = 1 - abs(freq - other) / OVERLAP_WIDTH
+            if weight > 0:
+                total += weight * power
+        interference[freq] = total
+
+    return _result(counts, interference,
+                   {band: tuple(summary) for band, summary in bands.items()})
+
+
+def _analyze_numpy(freqs, signals):
+
+    freqs = numpy.asarray(freqs, dtype=numpy.int64)
+    freqs = numpy.where(freqs > 0xffff, freqs // 1000, freqs)
+    signals = numpy.asarray(signals, dtype=numpy.float64)
+    known = (freqs >= FREQ_MIN) & (freqs <= FREQ_MAX)
+    index = freqs[known] - FREQ_MIN
+    signals = signals[known]
+    band = numpy.frombuffer(band_table, dtype=numpy.int8)[index]
+    index = index[band > 0]
+    signals = signals[band > 0]
+    band = band[band > 0]
+
+    size = FREQ_MAX - FREQ_MIN + 1
+    counts = numpy.bincount(index, minlength=size)
+    powers = numpy.bincount(index, weights=10 ** (signals / 10),
+                            minlength=size)
+    offsets = numpy.arange(1 - OVERLAP_WIDTH, OVERLAP_WIDTH)
+    kernel = 1 - numpy.abs(offsets) / OVERLAP_WIDTH
+    weighted = numpy.convolve(powers, kernel, mode='same')
+
+    used = numpy.nonzero(counts)[0]
+    bands = {}
+    for value in numpy.unique(band):
+        selected = signals[band == value]
+        bands[int(value)] = (len(selected), float(selected.sum()),
+                             float(selected.min()), float(selected.max()))
+
+    return _result(
+        {int(i) + FREQ_MIN: int(counts[i]) for i in used},
+        {int(i) + FREQ_MIN: float(weighted[i]) for i in used},
+        bands)
+
+
+def _result(counts, interference, bands):
+
+    occupancy = {}
+    scores = {}
+    channels = collections.defaultdict(set)
+    for freq, count in counts.items():
+        band = band_table[freq - FREQ_MIN]
+        key = (band, channel_table[freq - FREQ_MIN])
+        occupancy[key] = occupancy.get(key, 0) + count
+        scores[key] = 10 * math.log10(interference[freq])
+        channels[band].add(key[1])
+
+    summaries = {}
+    for band, (count, total, weakest, strongest) in bands.items():
+        summaries[band] = {
+            'count': count,
+            'channels': sorted(channels[band]),
+            'mean_signal': total / count,
+            'min_signal': float(weakest),
+            'max_signal': float(strongest),
+        }
+
+    return {
+        'occupancy': dict(sorted(occupancy.items())),
+        'bands': summaries,
+        'interference': dict(sorted(scores.items()))
+    }
@@ -3,6 +3,8 @@
 
 """Constants used in pywifi library define here."""
 
+from enum import IntFlag as _IntFlag
+
 # Define interface status.
 IFACE_DISCONNECTED = 0
 IFACE_SCANNING = 1
@@ -35,5 +37,80 @@ CIPHER_TYPE_TKIP = 2
 CIPHER_TYPE_CCMP = 4
 CIPHER_TYPE_UNKNOWN = 5
 
+# Define frequency bands.
+BAND_2GHZ = 1
+BAND_5GHZ = 2
+BAND_6GHZ = 3
+
+# Define protected management frame modes.
+PMF_DISABLED = 0
+PMF_OPTIONAL = 1
+PMF_REQUIRED = 2
+
 KEY_TYPE_NETWORKKEY = 0
 KEY_TYPE_PASSPHRASE = 1
+
+
+class AkmFlag(_IntFlag):
+    """Bitmask of key management types, one bit per AKM_TYPE_* value."""
+
+    NONE = 1 << AKM_TYPE_NONE
+    OPEN = 1 << AKM_TYPE_OPEN
+    SHARED = 1 << AKM_TYPE_SHARED
+    WPA = 1 << AKM_TYPE_WPA
+    WPAPSK = 1 << AKM_TYPE_WPAPSK
+    WPANONE = 1 << AKM_TYPE_WPANONE
+    WPA2 = 1 << AKM_TYPE_WPA2
+    WPA2PSK = 1 << AKM_TYPE_WPA2PSK
+    WPA3 = 1 << AKM_TYPE_WPA3
+    WPA3SAE = 1 << AKM_TYPE_WPA3SAE
+    OWE = 1 << AKM_TYPE_OWE
+    WPA3ENT = 1 << AKM_TYPE_WPA3ENT
+
+    PSK = WPAPSK | WPA2PSK
+    ENTERPRISE = WPA | WPA2 | WPA3 | WPA3ENT
+    WPA3_ANY = WPA3 | WPA3SAE | WPA3ENT
+    WPA2_OR_BETTER = WPA2 | WPA2PSK | WPA3 | WPA3SAE | OWE | WPA3ENT
+
+
+class CipherFlag(_IntFlag):
+    """Bitmask of cipher types, one bit per CIPHER_TYPE_* value."""
+
+    NONE = 1 << CIPHER_TYPE_NONE
+    WEP = 1 << CIPHER_TYPE_WEP
+    TKIP = 1 << CIPHER_TYPE_TKIP
+    CCMP = 1 << CIPHER_TYPE_CCMP
+    UNKNOWN = 1 << CIPHER_TYPE_UNKNOWN
+
+
+def akm_flags(akms):
+    """Get the AkmFlag of an AKM_TYPE_* value or a list of them."""
+
+    return AkmFlag(_to_bits(akms, AKM_TYPE_WPA3ENT))
+
+
+def cipher_flags(ciphers):
+    """Get the CipherFlag of a CIPHER_TYPE_* value or a list of them."""
+
+    return CipherFlag(_to_bits(ciphers, CIPHER_TYPE_UNKNOWN))
+
+
+def flag_values(flags):
+    """Get the AKM_TYPE_* or CIPHER_TYPE_* values set in a bitmask."""
+
+    return [value for value in range(int(flags).bit_length())
+            if flags & (1 << value)]
+
+
+def _to_bits(values, last):
+
+    if isinstance(values, int):
+        values = (values,)
+
+    # Values a platform defines beyond the known types have no bit.
+    bits = 0
+    for value in values:
+        if 0 <= value <= last:
+            bits |= 1 << value
+
+    return bits
@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+# vim: set fileencoding=utf-8
+
+"""Locate a scan among reference fingerprints of RSSI by location."""
+
+import array
+import heapq
+import json
+import math
+import struct
+
+from .interning import bssid_to_int, format_bssid
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# dBm taken for an AP missing from a fingerprint.
+MISSING_RSSI = -100
+
+FINGERPRINT_MAGIC = b'PWFP\x01'
+
+# Missing RSSI and the numbers of BSSIDs, fingerprints and RSSI values,
+# and the length of the locations in JSON.
+_db_header = struct.Struct('<dIIII')
+
+
+def fingerprint(scan):
+    """Get the {48-bit BSSID: RSSI} of a scan or of a {BSSID: RSSI} dict."""
+
+    if isinstance(scan, dict):
+        items = scan.items()
+    else:
+        items = ((bss.bssid, bss.signal) for bss in scan)
+
+    return {bssid if isinstance(bssid, int) else bssid_to_int(bssid):
+            float(rssi) for bssid, rssi in items}
+
+
+def average(scans):
+    """Get the fingerprint of the mean RSSI of each AP over the scans."""
+
+    sums = {}
+    counts = {}
+    for scan in scans:
+        for bssid, rssi in fingerprint(scan).items():
+            sums[bssid] = sums.get(bssid, 0.0) + rssi
+            counts[bssid] = counts.get(bssid, 0) + 1
+
+    return {bssid: sums[bssid] / counts[bssid] for bssid in sums}
+
+
+class FingerprintDB:
+    """FingerprintDB keeps reference fingerprints for nearest neighbours."""
+
+    """
+    The fingerprints are the rows of a sparse BSSID x location matrix in
+    compressed rows. The APs missing from a fingerprint or from the scan
+    take the missing RSSI, and the values are kept relative to it, so a
+    missing AP is a zero which is not stored. The squared distance of the
+    scan to every row is then the squared norms of the row and of the
+    scan minus twice their dot product, and the dot products only involve
+    the columns of the APs in the scan. The columns are indexed on the
+    first query after an addition.
+    """
+    _locations = []
+    _columns = {}
+
+    def __init__(self, missing=MISSING_RSSI):
+
+        self.missing = missing
+        self._locations = []
+        self._columns = {}
+        self._bssids = array.array('Q')
+        self._indptr = array.array('I', [0])
+        self._indices = array.array('I')
+        self._values = array.array('f')
+        self._norms = array.array('d')
+        self._by_column = None
+        self._csc = None
+
+    def __len__(self):
+
+        return len(self._locations)
+
+    def add(self, location, scan):
+        """Add the fingerprint of a scan taken at the location.
+
+        The scan may also be a {BSSID: RSSI} dict, like the average() of
+        several scans.
+        """
+
+        row = sorted((self._column(bssid), rssi - self.missing)
+                     for bssid, rssi in fingerprint(scan).items())
+        for column, value in row:
+            self._indices.append(column)
+            self._values.append(value)
+        self._indptr.append(len(self._indices))
+        self._norms.append(sum(value * value for _, value in row))
+        self._locations.append(location)
+        self._by_column = None
+        self._csc = None
+
+    def add_survey(self, log, location, since=None, until=None):
+        """Add the average of the scans of a SurveyLog at the location.
+
+        Only the scans between since and until are averaged.
+        """
+
+        self.add(location, average(
+            {o['bssid']: o['signal'] for o in observations}
+            for _, _, observations in log.scans(since, until)))
+
+    def bssids(self):
+        """Get the BSSIDs of the fingerprints."""
+
+        return [format_bssid(bssid) for bssid in self._bssids]
+
+    def nearest(self, scan, k=3, use_numpy=None):
+        """Get the (location, distance in dB) of the k nearest fingerprints."""
+
+        if not self._locations:
+            return []
+        if use_numpy is None:
+            use_numpy = numpy is not None
+
+        query = []
+        # The APs unknown to the database are missing from every row.
+        extra = 0.0
+        for bssid, rssi in fingerprint(scan).items():
+            value = rssi - self.missing
+            column = self._columns.get(bssid)
+            if column is None:
+                extra += value * value
+            else:
+                query.append((column, value))
+        extra += sum(value * value for _, value in query)
+
+        if use_numpy:
+            distances = self._distances_numpy(query, extra)
+        else:
+            distances = self._distances_arrays(query, extra)
+
+        return [(self._locations[row], float(distance)) for distance, row in
+                heapq.nsmallest(k, zip(distances, range(len(distances))))]
+
+    def save(self, path):
+        """Save the database, whose locations are JSON values, to a file."""
+
+        locations = json.dumps(self._locations).encode('utf-8')
+        with open(path, 'wb') as f:
+            f.write(FINGERPRINT_MAGIC)
+            f.write(_db_header.pack(self.missing, len(self._bssids),
+                                    len(self._locations), len(self._values),
+                                    len(locations)))
+            for values in (self._bssids, self._indptr, self._indices,
+                           self._values, self._norms):
+                values.tofile(f)
+            f.write(locations)
+
+    @classmethod
+    def load(cls, path):
+        """Load a database saved by save()."""
+
+        with open(path, 'rb') as f:
+            if f.read(len(FINGERPRINT_MAGIC)) != FINGERPRINT_MAGIC:
+                raise ValueError(
+                    "'{}' is not a fingerprint database".format(path))
+            missing, bssids, rows, values, locations = _db_header.unpack(
+                f.read(_db_header.size))
+
+            db = cls(missing)
+            db._bssids.fromfile(f, bssids)
+            db._indptr = array.array('I')
+            db._indptr.fromfile(f, rows + 1)
+            db._indices.fromfile(f, values)
+            db._values.fromfile(f, values)
+            db._norms.fromfile(f, rows)
+            db._locations = json.loads(f.read(locations).decode('utf-8'))
+
+        db._columns = {bssid: i for i, bssid in enumerate(db._bssids)}
+
+        return db
+
+    def _column(self, bssid):
+
+        column = self._columns.get(bssid)
+        if column is None:
+            column = self._columns[bssid] = len(self._bssids)
+            self._bssids.append(bssid)
+
+        return column
+
+    def _index_columns(self):
+
+        by_column = [([], []) for _ in range(len(self._bssids))]
+        for row in range(len(self._locations)):
+            for i in range(self._indptr[row], self._indptr[row + 1]):
+                rows, values = by_column[self._indices[i]]
+                rows.append(row)
+                values.append(self._values[i])
+        self._by_column = by_column
+
+    def _distances_arrays(self, query, extra):
+
+        if self._by_column is None:
+            self._index_columns()
+
+        dots = array.array('d', bytes(8 * len(self._locations)))
+        for column, value in query:
+            rows, values = self._by_column[column]
+            for row, row_value in zip(rows, values):
+                dots[row] += row_value * value
+
+        return [math.sqrt(max(norm + extra - 2 * dot, 0.0))
+                for norm, dot in zip(self._norms, dots)]
+
+    def _distances_numpy(self, query, extra):
+
+        if self._csc is None:
+            # The entries sorted by column, with the start of each column.
+            indices = numpy.frombuffer(self._indices, dtype=numpy.uint32)
+            rows = numpy.repeat(
+                numpy.arange(len(self._locations)),
+                numpy.diff(numpy.frombuffer(self._indptr,
+                                            dtype=numpy.uint32)))
+            order = numpy.argsort(indices, kind='stable')
+            starts = numpy.searchsorted(indices[order],
+                                        numpy.arange(len(self._bssids) + 1))
+            self._csc = (
+                rows[order],
+                numpy.frombuffer(self._values, dtype=numpy.float32)[order],
+                starts)
+
+        rows, values, starts = self._csc
+        dots = numpy.zeros(len(self._locations))
+        if query:
+            slices = [numpy.arange(starts[c], starts[c + 1])
+                      for c, _ in query]
+            entries = numpy.concatenate(slices)
+            weights = numpy.repeat([value for _, value in query],
+                                   [len(s) for s in slices])
+            dots = numpy.bincount(rows[entries],
+                                  weights=values[entries] * weights,
+                                  minlength=len(self._locations))
+
+        norms = numpy.frombuffer(self._norms, dtype=numpy.float64)
+
+        return numpy.sqrt(numpy.maximum(norms + extra - 2 * dots, 0.0))
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# vim: set fileencoding=utf-8
+
+"""Keep the recent traffic with wpa_supplicant for debugging failures."""
+
+import collections
+import re
+import sys
+import time
+
+# Number of records kept by default.
+FLIGHT_RECORDER_SIZE = 512
+
+RECORD_CMD = 'cmd'
+RECORD_REPLY = 'reply'
+RECORD_EVENT = 'event'
+RECORD_ERROR = 'error'
+
+_secret_re = re.compile(
+    r'^((?:IFNAME=\S+ )?SET_NETWORK \d+ '
+    r'(?:psk|password|sae_password|wep_key\d|private_key_passwd) ).*$',
+    re.S)
+
+
+def redact(cmd):
+    """Hide the secret of a command which sets one."""
+
+    return _secret_re.sub(r'\1[REDACTED]', cmd)
+
+
+class FlightRecorder:
+    """FlightRecorder keeps the last records in a ring buffer."""
+
+    """
+    Each record is stored as a tuple of the raw values and only formatted
+    when dumped, so recording costs an append to a bounded deque. Commands
+    carrying secrets are redacted before they are stored.
+    """
+    _records = None
+
+    def __init__(self, size=FLIGHT_RECORDER_SIZE):
+
+        self._records = collections.deque(maxlen=size)
+
+    def record_cmd(self, iface, cmd):
+        """Record a command sent to the interface."""
+
+        if cmd.startswith('SET_NETWORK'):
+            cmd = redact(cmd)
+        self._records.append((time.time(), RECORD_CMD, iface, cmd))
+
+    def record_reply(self, iface, reply):
+        """Record the raw reply of a command."""
+
+        self._records.append((time.time(), RECORD_REPLY, iface, reply))
+
+    def record_event(self, iface, event):
+        """Record an unsolicited event of the interface."""
+
+        self._records.append((time.time(), RECORD_EVENT, iface, event))
+
+    def record_error(self, iface, error):
+        """Record an error of a command."""
+
+        self._records.append((time.time(), RECORD_ERROR, iface, error))
+
+    def records(self, iface=None):
+        """Get the records as (time, kind, iface, data) tuples."""
+
+        records = list(self._records)
+        if iface is not None:
+            records = [r for r in records if r[2] == iface]
+
+        return records
+
+    def clear(self):
+        """Drop all the records."""
+
+        self._records.clear()
+
+    def format(self, iface=None):
+        """Format the records as lines of text."""
+
+        lines = []
+        for timestamp, kind, name, data in self.records(iface):
+            if isinstance(data, bytes):
+                data = data.decode('utf-8', 'replace')
+            lines.append('{} {:<5} {}: {}'.format(
+                time.strftime('%H:%M:%S', time.localtime(timestamp)) +
+                '.{:03d}'.format(int(timestamp * 1000) % 1000),
+                kind, name, str(data).rstrip('\n').replace('\n', '\\n')))
+
+        return '\n'.join(lines)
+
+    def dump(self, stream=None, iface=None):
+        """Write the formatted records to the stream, stderr by default."""
+
+        if stream is None:
+            stream = sys.stderr
+        text = self.format(iface)
+        if text:
+            stream.write(text + '\n')
@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+# vim: set fileencoding=utf-8
+
+"""Parse the capabilities of an AP from its information elements."""
+
+import struct
+
+from .interning import join_hex
+
+IE_SSID = 0
+IE_DS_PARAMS = 3
+IE_BSS_LOAD = 11
+IE_HT_CAPABILITIES = 45
+IE_RSN = 48
+IE_HT_OPERATION = 61
+IE_VHT_CAPABILITIES = 191
+IE_VHT_OPERATION = 192
+IE_EXTENSION = 255
+IE_EXT_HE_CAPABILITIES = 35
+IE_EXT_HE_OPERATION = 36
+
+# The names of the suites of the IEEE 802.11 OUI 00-0f-ac, as
+# wpa_supplicant shows them in the scan flags.
+rsn_cipher_suites = {
+    0: 'USE-GROUP',
+    1: 'WEP40',
+    2: 'TKIP',
+    4: 'CCMP',
+    5: 'WEP104',
+    6: 'BIP-CMAC-128',
+    7: 'NO-GROUP',
+    8: 'GCMP',
+    9: 'GCMP-256',
+    10: 'CCMP-256',
+    11: 'BIP-GMAC-128',
+    12: 'BIP-GMAC-256',
+    13: 'BIP-CMAC-256',
+}
+
+rsn_akm_suites = {
+    1: 'EAP',
+    2: 'PSK',
+    3: 'FT/EAP',
+    4: 'FT/PSK',
+    5: 'EAP-SHA256',
+    6: 'PSK-SHA256',
+    8: 'SAE',
+    9: 'FT/SAE',
+    11: 'EAP-SUITE-B',
+    12: 'EAP-SUITE-B-192',
+    13: 'FT/EAP-SHA384',
+    18: 'OWE',
+    24: 'SAE-EXT-KEY',
+    25: 'FT/SAE-EXT-KEY',
+}
+
+_RSN_OUI = b'\x00\x0f\xac'
+_u16 = struct.Struct('<H')
+
+
+def iter_ies(data):
+    """Iterate the (element id, body) of the elements in the bytes.
+
+    The bodies are memoryview slices of the data, and the iteration stops
+    at an element running past the end.
+    """
+
+    view = memoryview(data)
+    size = len(view)
+    offset = 0
+    while offset + 2 <= size:
+        length = view[offset + 1]
+        end = offset + 2 + length
+        if end > size:
+            return
+        yield view[offset], view[offset + 2:end]
+        offset = end
+
+
+class RsnInfo:
+    """RsnInfo is the content of an RSN element."""
+
+    __slots__ = ('version', 'group_cipher', 'pairwise_ciphers',
+                 'akm_suites', 'capabilities', 'mfp_capable', 'mfp_required')
+
+    def __init__(self):
+
+        self.version = 0
+        self.group_cipher = None
+        self.pairwise_ciphers = []
+        self.akm_suites = []
+        self.capabilities = 0
+        self.mfp_capable = False
+        self.mfp_required = False
+
+    def __repr__(self):
+
+        return 'RsnInfo(group={!r}, pairwise={!r}, akm={!r})'.format(
+            self.group_cipher, self.pairwise_ciphers, self.akm_suites)
+
+
+class InformationElements:
+    """InformationElements are the capabilities announced by an AP."""
+
+    """
+    The elements are kept as given, hex text or bytes, and only parsed
+    the first time one of the fields is read, so the scans which do not
+    look at them pay for keeping the text only. The elements of the probe
+    response come first, and the beacon adds the ones it lacks. The
+    channel width is the widest one the operation elements announce, and
+    the spatial streams the most the supported MCS sets receive.
+    """
+
+    _fields = ('ssid', 'channel', 'ht', 'vht', 'he', 'channel_width',
+               'spatial_streams', 'station_count', 'channel_utilization',
+               'admission_capacity', 'rsn', 'elements')
+
+    __slots__ = ('_ie', '_beacon_ie') + _fields
+
+    def __init__(self, ie, beacon_ie=None):
+
+        self._ie = ie
+        self._beacon_ie = beacon_ie
+
+    def __getattr__(self, name):
+
+        # Only called while the fields are unset, i.e. before parsing.
+        if name not in InformationElements._fields:
+            raise AttributeError(name)
+        self._parse()
+
+        return object.__getattribute__(self, name)
+
+    def __repr__(self):
+
+        return 'InformationElements(channel_width={!r}, ' \
+            'spatial_streams={!r}, he={!r})'.format(
+                self.channel_width, self.spatial_streams, self.he)
+
+    def element(self, element_id, ext_id=None):
+        """Get the body of an element as bytes, or None if it is absent."""
+
+        body = self.elements.get(
+            element_id if ext_id is None else (element_id, ext_id))
+
+        return None if body is None else bytes(body)
+
+    def _parse(self):
+
+        elements = {}
+        for raw in (self._ie, self._beacon_ie):
+            if not raw:
+                continue
+            if isinstance(raw, str):
+                try:
+                    raw = bytes.fromhex(raw)
+                except ValueError:
+                    continue
+            for element_id, body in iter_ies(raw):
+                if element_id == IE_EXTENSION and len(body):
+                    element_id = (IE_EXTENSION, body[0])
+                    body = body[1:]
+                elements.setdefault(element_id, body)
+
+        self.elements = elements
+        self.ssid = None
+        self.channel = None
+        self.ht = IE_HT_CAPABILITIES in elements
+        self.vht = IE_VHT_CAPABILITIES in elements
+        self.he = (IE_EXTENSION, IE_EXT_HE_CAPABILITIES) in elements
+        self.channel_width = 20
+        self.spatial_streams = 1
+        self.station_count = None
+        self.channel_utilization = None
+        self.admission_capacity = None
+        self.rsn = None
+
+        body = elements.get(IE_SSID)
+        if body is not None:
+            self.ssid = bytes(body)
+        body = elements.get(IE_DS_PARAMS)
+        if body is not None and len(body) >= 1:
+            self.channel = body[0]
+        body = elements.get(IE_BSS_LOAD)
+        if body is not None and len(body) >= 5:
+            self.station_count = _u16.unpack_from(body, 0)[0]
+            self.channel_utilization = body[2]
+            self.admission_capacity = _u16.unpack_from(body, 3)[0]
+        body = elements.get(IE_RSN)
+        if body is not None:
+            self.rsn = _parse_rsn(body)
+
+        self._parse_ht(elements)
+        self._parse_vht(elements)
+        self._parse_he(elements)
+
+    def _parse_ht(self, elements):
+
+        body = elements.get(IE_HT_CAPABILITIES)
+        if body is not None and len(body) >= 7:
+            # The first 4 bytes of the RX MCS bitmask are 1 stream each.
+            self.spatial_streams = max(
+                self.spatial_streams,
+                sum(1 for b in body[3:7] if b))
+
+        body = elements.get(IE_HT_OPERATION)
+        if body is not None and len(body) >= 2:
+            # A secondary channel with the STA channel width bit is 40 MHz.
+            if body[1] & 0x03 and body[1] & 0x04:
+                self.channel_width = max(self.channel_width, 40)
+
+    def _parse_vht(self, elements):
+
+        body = elements.get(IE_VHT_CAPABILITIES)
+        if body is not None and len(body) >= 6:
+            self.spatial_streams = max(
+                self.spatial_streams,
+                _mcs_map_streams(_u16.unpack_from(body, 4)[0]))
+
+        body = elements.get(IE_VHT_OPERATION)
+        if body is not None and len(body) >= 3 and body[0] >= 1:
+            self.channel_width = max(
+                self.channel_width,
+                _segments_width(body[0], body[1], body[2]))
+
+    def _parse_he(self, elements):
+
+        body = elements.get((IE_EXTENSION, IE_EXT_HE_CAPABILITIES))
+        # MAC (6 bytes) and PHY (11 bytes) capabilities, then the RX MCS
+        # map of the channels up to 80 MHz.
+        if body is not None and len(body) >= 19:
+            self.spatial_streams = max(
+                self.spatial_streams,
+                _mcs_map_streams(_u16.unpack_from(body, 17)[0]))
+
+        body = elements.get((IE_EXTENSION, IE_EXT_HE_OPERATION))
+        if body is None or len(body) < 6:
+            return
+
+        params = body[0] | body[1] << 8 | body[2] << 16
+        offset = 6
+        if params & (1 << 14):
+            # The VHT operation information.
+            if len(body) >= offset + 3 and body[offset] >= 1:
+                self.channel_width = max(
+                    self.channel_width,
+                    _segments_width(body[offset], body[offset + 1],
+                                    body[offset + 2]))
+            offset += 3
+        if params & (1 << 15):
+            # The co-hosted BSS.
+            offset += 1
+        if params & (1 << 17) and len(body) >= offset + 5:
+            # The 6 GHz operation information.
+            width = (20, 40, 80, 160)[body[offset + 1] & 0x03]
+            self.channel_width = max(self.channel_width, width)
+
+
+def _mcs_map_streams(mcs_map):
+
+    # 2 bits per stream, where 3 is not supported.
+    streams = 0
+    for stream in range(8):
+        if (mcs_map >> (stream * 2)) & 0x03 != 0x03:
+            streams = stream + 1
+
+    return streams
+
+
+def _segments_width(width, seg0, seg1):
+
+    if width == 2 or width == 3:
+        # The deprecated 160 and 80+80 MHz widths.
+        return 160
+    if seg1:
+        return 160
+
+    return 80
+
+
+def _suite_name(suite, names):
+
+    if bytes(suite[:3]) == _RSN_OUI and suite[3] in names:
+        return names[suite[3]]
+
+    return '{}:{}'.format(join_hex(suite[:3], '-'), suite[3])
+
+
+def _parse_rsn(body):
+
+    rsn = RsnInfo()
+    size = len(body)
+    if size < 2:
+        return rsn
+
+    rsn.version = _u16.unpack_from(body, 0)[0]
+    offset = 2
+    if size >= offset + 4:
+        rsn.group_cipher = _suite_name(body[offset:offset + 4],
+                                       rsn_cipher_suites)
+        offset += 4
+
+    for names, suites in ((rsn_cipher_suites, rsn.pairwise_ciphers),
+                          (rsn_akm_suites, rsn.akm_suites)):
+        if size < offset + 2:
+            return rsn
+        count = _u16.unpack_from(body, offset)[0]
+        offset += 2
+        for _ in range(count):
+            if size < offset + 4:
+                return rsn
+            suites.append(_suite_name(body[offset:offset + 4], names))
+            offset += 4
+
+    if size >= offset + 2:
+        rsn.capabilities = _u16.unpack_from(body, offset)[0]
+        rsn.mfp_required = bool(rsn.capabilities & (1 << 6))
+        rsn.mfp_capable = bool(rsn.capabilities & (1 << 7))
+
+    return rsn
@@ -3,16 +3,45 @@
 
 """Implement Interface for manipulating wifi devies."""
 
-import platform
 import logging
+import time
 
+from .const import *
+from . import _backend
+from . import metrics
+from . import tracing
 
-if platform.system().lower() == 'windows':
-    from . import _wifiutil_win as wifiutil
-elif platform.system().lower() == 'linux':
-    from . import _wifiutil_linux as wifiutil
-else:
-    raise NotImplementedError
+# Seconds between real status queries when the status is tracked locally.
+STATUS_RESYNC_INTERVAL = 5
+# Seconds to wait for each candidate of connect_any().
+CONNECT_TIMEOUT = 15
+# Seconds between the checks for cancellation while waiting for events.
+EVENT_POLL_INTERVAL = 0.2
+# Seconds between the status queries while waiting for an association.
+STATUS_POLL_INTERVAL = 1
+
+
+def rank_profiles(profiles, bsses):
+    """Order the profiles by the best signal of their SSID in the scan.
+
+    Profiles whose SSID is not in the scan results keep their order after
+    the visible ones, since they may belong to hidden networks.
+    """
+
+    signals = {}
+    for bss in bsses:
+        if bss.ssid not in signals or bss.signal > signals[bss.ssid]:
+            signals[bss.ssid] = bss.signal
+
+    visible = [p for p in profiles if p.ssid in signals]
+    visible.sort(key=lambda p: signals[p.ssid], reverse=True)
+
+    return visible + [p for p in profiles if p.ssid not in signals]
+
+
+def _span_attributes(iface, *args, **kwargs):
+
+    return {'iface': iface.name()}
 
 
 class Interface:
@@ -26,18 +55,31 @@ class Interface:
     _raw_obj = {}
     _wifi_ctrl = {}
     _logger = None
+    _resync_interval = None
+    _tracked_status = None
+    _status_synced_at = 0
 
-    def __init__(self, raw_obj):
+    def __init__(self, raw_obj, wifi_ctrl=None):
 
         self._raw_obj = raw_obj
-        self._wifi_ctrl = wifiutil.WifiUtil()
+        if wifi_ctrl is None:
+            wifi_ctrl = _backend.wifiutil().WifiUtil()
+        self._wifi_ctrl = wifi_ctrl
         self._logger = logging.getLogger('pywifi')
 
+    @property
+    def tracer(self):
+        """The tracer of the backend, or None to use the global tracer."""
+
+        return getattr(self._wifi_ctrl, 'tracer', None)
+
     def name(self):
         """"Get the name of the wifi interfacce."""
 
         return self._raw_obj['name']
 
+    @metrics.timed('scan')
+    @tracing.traced('scan', _span_attributes)
     def scan(self):
         """Trigger the wifi interface to scan."""
 
@@ -45,61 +87,199 @@ class Interface:
 
         self._wifi_ctrl.scan(self._raw_obj)
 
-    def scan_results(self):
-        """Return the scan result."""
-        
-        bsses = self._wifi_ctrl.scan_results(self._raw_obj)
-
-        if self._logger.isEnabledFor(logging.INFO):
-            for bss in bsses:
-                self._logger.info("Find bss:")
-                self._logger.info("\tbssid: %s", bss.bssid)
-                self._logger.info("\tssid: %s", bss.ssid)
-                self._logger.info("\tfreq: %d", bss.freq)
-                self._logger.info("\tauth: %s", bss.auth)
-                self._logger.info("\takm: %s", bss.akm)
-                self._logger.info("\tsignal: %d", bss.signal)
+    @metrics.timed('scan_results')
+    @tracing.traced('scan_results', _span_attributes)
+    def scan_results(self, ies=False):
+        """Return the scan result.
+
+        With ies, the information elements of the APs are fetched too and
+        parsed into the ies of each result when first read.
+        """
+
+        if ies:
+            bsses = self._wifi_ctrl.scan_results(self._raw_obj, ies=True)
+        else:
+            bsses = self._wifi_ctrl.scan_results(self._raw_obj)
+        self._logger.info("iface '%s' finds %d bsses", self.name(), len(bsses))
 
         return bsses
 
+    @metrics.timed('add_network_profile')
+    @tracing.traced('add_network_profile', _span_attributes)
     def add_network_profile(self, params):
         """Add the info of the AP for connecting afterward."""
 
         return self._wifi_ctrl.add_network_profile(self._raw_obj, params)
 
+    @metrics.timed('remove_network_profile')
+    @tracing.traced('remove_network_profile', _span_attributes)
     def remove_network_profile(self, params):
         """Remove the specified AP settings."""
 
         self._wifi_ctrl.remove_network_profile(self._raw_obj, params)
 
+    @metrics.timed('remove_all_network_profiles')
+    @tracing.traced('remove_all_network_profiles', _span_attributes)
     def remove_all_network_profiles(self):
         """Remove all the AP settings."""
 
         self._wifi_ctrl.remove_all_network_profiles(self._raw_obj)
 
+    @metrics.timed('network_profiles')
+    @tracing.traced('network_profiles', _span_attributes)
     def network_profiles(self):
         """Get all the AP profiles."""
 
         profiles = self._wifi_ctrl.network_profiles(self._raw_obj)
-
-        if self._logger.isEnabledFor(logging.INFO):
-            for profile in profiles:
-                self._logger.info("Get profile:")
-                self._logger.info("\tssid: %s", profile.ssid)
-                self._logger.info("\tauth: %s", profile.auth)
-                self._logger.info("\takm: %s", profile.akm)
-                self._logger.info("\tcipher: %s", profile.cipher)
+        self._logger.info("iface '%s' has %d profiles",
+                          self.name(), len(profiles))
 
         return profiles
 
-    def connect(self, params):
+    @metrics.timed('connect')
+    @tracing.traced('connect', _span_attributes)
+    def connect(self, params, fast=False):
         """Connect to the specified AP."""
 
         self._logger.info("iface '%s' connects to AP: '%s'",
                           self.name(), params.ssid)
 
-        self._wifi_ctrl.connect(self._raw_obj, params)
-
+        self._wifi_ctrl.connect(self._raw_obj, params, fast)
+
+    @metrics.timed('connect_any')
+    @tracing.traced('connect_any', _span_attributes)
+    def connect_any(self, profiles, per_attempt_timeout=CONNECT_TIMEOUT):
+        """Connect to the first AP of the profiles which can be connected.
+
+        Return the connected profile, or None, and the attempts made.
+        """
+
+        attempts = []
+        error = None
+        for profile in rank_profiles(profiles, self.scan_results()):
+            try:
+                if self.attempt_connect(profile, per_attempt_timeout,
+                                        attempts):
+                    return profile, attempts
+            except Exception as err:
+                self._logger.error("iface '%s' connecting to AP '%s': %s",
+                                   self.name(), profile.ssid, err)
+                error = error or err
+
+        # Report the failure of an attempt when none of them succeeded.
+        if error is not None:
+            raise error
+
+        return None, attempts
+
+    @metrics.timed('attempt_connect')
+    @tracing.traced('attempt_connect', _span_attributes)
+    def attempt_connect(self, params, timeout=CONNECT_TIMEOUT,
+                        attempts=None, cancel=None):
+        """Connect to the AP and wait until it succeeds, fails or times out."""
+
+        tracked = self._resync_interval is not None
+        if not tracked:
+            self._wifi_ctrl.attach(self._raw_obj)
+        try:
+            # Drop the events from before this attempt.
+            self._poll_events()
+
+            start = time.monotonic()
+            result = self._wait_connect(params, start + timeout, cancel)
+            if result == 'cancelled':
+                self.disconnect()
+        finally:
+            if not tracked:
+                self._wifi_ctrl.detach(self._raw_obj)
+
+        elapsed = time.monotonic() - start
+        self._logger.info("iface '%s' connecting to AP '%s': %s in %.3fs",
+                          self.name(), params.ssid, result, elapsed)
+        if attempts is not None:
+            attempts.append({
+                'iface': self.name(),
+                'profile': params,
+                'result': result,
+                'elapsed': elapsed
+            })
+
+        return result == 'connected'
+
+    def _wait_connect(self, params, deadline, cancel):
+
+        result = 'timeout'
+        self.connect(params)
+
+        span = tracing.start_span('association_wait', self,
+                                  iface=self.name(), ssid=params.ssid)
+        error = None
+        status_at = time.monotonic() + STATUS_POLL_INTERVAL
+        try:
+            while result == 'timeout':
+                polled_at = time.monotonic()
+                remaining = deadline - polled_at
+                if remaining <= 0:
+                    break
+                if cancel is not None and cancel.is_set():
+                    result = 'cancelled'
+                    break
+
+                wait = min(remaining, EVENT_POLL_INTERVAL)
+                events = self._poll_events(wait)
+                for event in events:
+                    if self._wifi_ctrl.connect_failed(event):
+                        result = 'failed'
+                        break
+                    elif self._wifi_ctrl.event_status(event) == \
+                            IFACE_CONNECTED:
+                        result = 'connected'
+                        break
+                if result != 'timeout':
+                    break
+
+                # The backend may deliver no events, or have lost its
+                # monitor, so ask for the status now and then.
+                now = time.monotonic()
+                if now >= status_at:
+                    status_at = now + STATUS_POLL_INTERVAL
+                    if self._wifi_ctrl.status(self._raw_obj) == \
+                            IFACE_CONNECTED:
+                        result = 'connected'
+                        break
+                if not events and now - polled_at < wait:
+                    # A poll returning at once would spin.
+                    time.sleep(polled_at + wait - now)
+
+            # The events may have been missed, so ask before giving up.
+            if result == 'timeout' and \
+                    self._wifi_ctrl.status(self._raw_obj) == IFACE_CONNECTED:
+                result = 'connected'
+        except Exception as err:
+            error = err
+            raise
+        finally:
+            tracing.end_span(span, error, result=result)
+
+        return result
+
+    def flight_records(self):
+        """Get the recent commands, replies and events of the interface."""
+
+        return self._wifi_ctrl.flight_records(self._raw_obj)
+
+    def dump_flight_records(self, stream=None):
+        """Write the recent commands, replies and events to the stream."""
+
+        self._wifi_ctrl.dump_flight_records(self._raw_obj, stream)
+
+    def last_association(self, params):
+        """Get the BSSID and frequency of the last association to the AP."""
+
+        return self._wifi_ctrl.last_association(self._raw_obj, params)
+
+    @metrics.timed('disconnect')
+    @tracing.traced('disconnect', _span_attributes)
     def disconnect(self):
         """Disconnect from the specified AP."""
 
@@ -107,7 +287,90 @@ class Interface:
 
         self._wifi_ctrl.disconnect(self._raw_obj)
 
+    @metrics.timed('roam')
+    @tracing.traced('roam', _span_attributes)
+    def roam(self, bssid):
+        """Roam to the specified BSS of the current network.
+
+        Only supported on Linux, NotImplementedError is raised on Windows.
+        """
+
+        self._logger.info("iface '%s' roams to BSS: '%s'", self.name(), bssid)
+
+        self._wifi_ctrl.roam(self._raw_obj, bssid)
+
+    @metrics.timed('pmksa')
+    @tracing.traced('pmksa', _span_attributes)
+    def pmksa(self):
+        """Get the cached PMKSA entries of the wifi interface.
+
+        Only supported on Linux: the WLAN API of Windows does not expose
+        the PMKSA cache, so NotImplementedError is raised there.
+        """
+
+        return self._wifi_ctrl.pmksa(self._raw_obj)
+
+    @metrics.timed('pmksa_flush')
+    @tracing.traced('pmksa_flush', _span_attributes)
+    def pmksa_flush(self):
+        """Flush the PMKSA cache of the wifi interface.
+
+        Only supported on Linux, NotImplementedError is raised on Windows.
+        """
+
+        self._logger.info("iface '%s' flushes PMKSA cache", self.name())
+
+        self._wifi_ctrl.pmksa_flush(self._raw_obj)
+
+    @metrics.timed('status')
+    @tracing.traced('status', _span_attributes)
     def status(self):
         """Get the status of the wifi interface."""
 
-        return self._wifi_ctrl.status(self._raw_obj)
+        if self._resync_interval is None:
+            return self._wifi_ctrl.status(self._raw_obj)
+
+        self._poll_events()
+        if time.monotonic() - self._status_synced_at >= self._resync_interval:
+            self._resync_status()
+
+        return self._tracked_status
+
+    def track_status(self, resync_interval=STATUS_RESYNC_INTERVAL):
+        """Answer status() from the interface events instead of a query."""
+
+        self._wifi_ctrl.attach(self._raw_obj)
+        self._resync_interval = resync_interval
+        self._resync_status()
+
+    def untrack_status(self):
+        """Query the interface again on every status() call."""
+
+        self._resync_interval = None
+        self._wifi_ctrl.detach(self._raw_obj)
+
+    def _resync_status(self):
+
+        self._tracked_status = self._wifi_ctrl.status(self._raw_obj)
+        self._status_synced_at = time.monotonic()
+
+    def _poll_events(self, timeout=0):
+
+        events = self._wifi_ctrl.events(self._raw_obj, timeout)
+        for event in events:
+            self._handle_event(event)
+
+        return events
+
+    def _handle_event(self, event):
+
+        status = self._wifi_ctrl.event_status(event)
+        if status is None:
+            return
+
+        if status == IFACE_CONNECTED and \
+                self._tracked_status != IFACE_CONNECTED:
+            # Query once so the new association gets recorded.
+            self._resync_status()
+        else:
+            self._tracked_status = status
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+# vim: set fileencoding=utf-8
+
+"""Share the BSSID and SSID values of the APs seen across scans."""
+
+import collections
+import threading
+
+# Number of distinct BSSIDs and SSIDs kept by the shared tables.
+BSSID_INTERN_SIZE = 4096
+SSID_INTERN_SIZE = 4096
+
+
+class InternTable:
+    """InternTable maps raw values to shared values, evicting the LRU."""
+
+    """
+    The value of a raw key is made once by the given function and then
+    returned as the same object until the key is evicted, so the repeated
+    scans of an unchanged AP reuse the strings of the previous scans.
+    """
+    _entries = None
+
+    def __init__(self, size):
+
+        self._size = size
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+
+        return len(self._entries)
+
+    def __contains__(self, key):
+
+        return key in self._entries
+
+    def get(self, key, make):
+        """Get the shared value of the key, made by make(key) on a miss."""
+
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+
+        value = make(key)
+        with self._lock:
+            value = self._entries.setdefault(key, value)
+            self.misses += 1
+            if len(self._entries) > self._size:
+                self._entries.popitem(last=False)
+
+        return value
+
+    def clear(self):
+        """Drop all the entries."""
+
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+bssids = InternTable(BSSID_INTERN_SIZE)
+ssids = InternTable(SSID_INTERN_SIZE)
+
+
+def bssid_to_int(bssid):
+    """Get the 48-bit integer of a BSSID given as text or 6 bytes."""
+
+    if isinstance(bssid, str):
+        bssid = bytes.fromhex(bssid.replace(':', '').replace('-', ''))
+    if len(bssid) != 6:
+        raise ValueError('Invalid BSSID: {!r}'.format(bssid))
+
+    return int.from_bytes(bssid, 'big')
+
+
+def format_bssid(bssid):
+    """Format a BSSID given as a 48-bit integer or 6 bytes as text."""
+
+    if isinstance(bssid, int):
+        bssid = bssid.to_bytes(6, 'big')
+
+    return join_hex(bssid)
+
+
+def join_hex(data, sep=':'):
+    """Format bytes as hex pairs joined by sep, like 'aa:bb:cc'."""
+
+    # bytes.hex() only takes a separator from Python 3.8.
+    return sep.join('{:02x}'.format(b) for b in bytes(data))
+
+
+def intern_bssid(bssid):
+    """Get the shared lowercase text of a BSSID given as text or 6 bytes.
+
+    The text of a 6 bytes BSSID is only formatted the first time it is
+    seen.
+    """
+
+    if not isinstance(bssid, (str, bytes)):
+        bssid = bytes(bssid)
+
+    return bssids.get(bssid, _canonical_bssid)
+
+
+def intern_ssid(ssid, decode=None):
+    """Get the shared SSID of a raw SSID, decoded by decode(ssid) once."""
+
+    return ssids.get(ssid, decode or str)
+
+
+def _canonical_bssid(bssid):
+
+    if isinstance(bssid, bytes):
+        return format_bssid(bssid)
+
+    return bssid.lower()
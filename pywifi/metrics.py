@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+# vim: set fileencoding=utf-8
+
+"""Collect counters and latencies of the commands and operations.
+
+The collection is disabled by default, and then each instrumented call
+only checks the enabled flag.
+"""
+
+import bisect
+import functools
+import threading
+import time
+
+# Upper bounds in seconds of the latency histogram buckets.
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+enabled = False
+
+_lock = threading.Lock()
+_local = threading.local()
+_commands = {}
+_operations = {}
+_events = {}
+# The perf_counter() times of the scans waiting for their results.
+_scans = {}
+
+
+def enable():
+    """Start collecting metrics."""
+
+    global enabled
+    enabled = True
+
+
+def disable():
+    """Stop collecting metrics."""
+
+    global enabled
+    enabled = False
+
+
+def reset():
+    """Clear the collected metrics."""
+
+    with _lock:
+        _commands.clear()
+        _operations.clear()
+        _events.clear()
+        _scans.clear()
+
+
+def record_command(name, sent, received, latency, error):
+    """Record a command sent to the wifi interface."""
+
+    with _lock:
+        entry = _commands.get(name)
+        if entry is None:
+            entry = _commands[name] = _new_entry()
+            entry['bytes_sent'] = 0
+            entry['bytes_received'] = 0
+        _observe(entry, latency, error)
+        entry['bytes_sent'] += sent
+        entry['bytes_received'] += received
+
+        # Attribute the command to the operation running in this thread.
+        operation = getattr(_local, 'operation', None)
+        if operation is not None:
+            operation['commands'] += 1
+
+
+def record_operation(name, latency, error, commands=0):
+    """Record a high-level operation of an interface."""
+
+    with _lock:
+        entry = _operations.get(name)
+        if entry is None:
+            entry = _operations[name] = _new_entry()
+            entry['commands'] = 0
+        _observe(entry, latency, error)
+        entry['commands'] += commands
+
+
+def record_event(name, latency):
+    """Record the time from a command to the event completing it."""
+
+    with _lock:
+        entry = _events.get(name)
+        if entry is None:
+            entry = _events[name] = _new_entry()
+        _observe(entry, latency, False)
+
+
+def scan_started(iface):
+    """Note the time a scan of the interface was triggered."""
+
+    with _lock:
+        _scans[iface] = time.perf_counter()
+
+
+def scan_completed(iface):
+    """Record the scan_complete latency of the interface's last scan."""
+
+    with _lock:
+        start = _scans.pop(iface, None)
+    if start is not None:
+        record_event('scan_complete', time.perf_counter() - start)
+
+
+def timed(name):
+    """Decorate a method to be recorded as the named operation."""
+
+    def decorator(func):
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+
+            if not enabled:
+                return func(*args, **kwargs)
+
+            parent = getattr(_local, 'operation', None)
+            operation = {'commands': 0}
+            _local.operation = operation
+            start = time.perf_counter()
+            error = True
+            try:
+                result = func(*args, **kwargs)
+                error = False
+                return result
+            finally:
+                _local.operation = parent
+                if parent is not None:
+                    parent['commands'] += operation['commands']
+                record_operation(name, time.perf_counter() - start, error,
+                                 operation['commands'])
+
+        return wrapper
+
+    return decorator
+
+
+def stats():
+    """Get a snapshot of the collected metrics."""
+
+    with _lock:
+        return {
+            'commands': _snapshot(_commands),
+            'operations': _snapshot(_operations),
+            'events': _snapshot(_events)
+        }
+
+
+def prometheus_text():
+    """Format the collected metrics in the Prometheus text format."""
+
+    snapshot = stats()
+    lines = []
+
+    commands = snapshot['commands']
+    _counter(lines, 'pywifi_commands_total',
+             'Commands sent to the wifi interface.',
+             'command', commands, 'count')
+    _counter(lines, 'pywifi_command_errors_total',
+             'Commands which failed or were answered with FAIL.',
+             'command', commands, 'errors')
+    _counter(lines, 'pywifi_command_sent_bytes_total',
+             'Bytes of the commands.',
+             'command', commands, 'bytes_sent')
+    _counter(lines, 'pywifi_command_received_bytes_total',
+             'Bytes of the replies.',
+             'command', commands, 'bytes_received')
+    _histogram(lines, 'pywifi_command_latency_seconds',
+               'Roundtrip time of the commands.',
+               'command', commands)
+
+    operations = snapshot['operations']
+    _counter(lines, 'pywifi_operations_total',
+             'Operations of the interfaces.',
+             'operation', operations, 'count')
+    _counter(lines, 'pywifi_operation_errors_total',
+             'Operations which raised an exception.',
+             'operation', operations, 'errors')
+    _counter(lines, 'pywifi_operation_commands_total',
+             'Commands issued by the operations.',
+             'operation', operations, 'commands')
+    _histogram(lines, 'pywifi_operation_latency_seconds',
+               'Duration of the operations.',
+               'operation', operations)
+
+    _histogram(lines, 'pywifi_event_latency_seconds',
+               'Time from the commands to the events completing them.',
+               'event', snapshot['events'])
+
+    return '\n'.join(lines) + '\n'
+
+
+def _new_entry():
+
+    return {
+        'count': 0,
+        'errors': 0,
+        'latency_sum': 0.0,
+        'latency_buckets': [0] * (len(LATENCY_BUCKETS) + 1)
+    }
+
+
+def _observe(entry, latency, error):
+
+    entry['count'] += 1
+    if error:
+        entry['errors'] += 1
+    entry['latency_sum'] += latency
+    entry['latency_buckets'][bisect.bisect_left(LATENCY_BUCKETS, latency)] += 1
+
+
+def _snapshot(entries):
+
+    snapshot = {}
+    for name, entry in entries.items():
+        snapshot[name] = dict(entry)
+        snapshot[name]['latency_buckets'] = list(entry['latency_buckets'])
+
+    return snapshot
+
+
+def _counter(lines, metric, help_text, label, entries, field):
+
+    lines.append('# HELP {} {}'.format(metric, help_text))
+    lines.append('# TYPE {} counter'.format(metric))
+    for name in sorted(entries):
+        lines.append('{}{{{}="{}"}} {}'.format(
+            metric, label, _escape(name), entries[name][field]))
+
+
+def _histogram(lines, metric, help_text, label, entries):
+
+    lines.append('# HELP {} {}'.format(metric, help_text))
+    lines.append('# TYPE {} histogram'.format(metric))
+    for name in sorted(entries):
+        entry = entries[name]
+        value = _escape(name)
+        cumulative = 0
+        bounds = [repr(float(b)) for b in LATENCY_BUCKETS] + ['+Inf']
+        for bound, count in zip(bounds, entry['latency_buckets']):
+            cumulative += count
+            lines.append('{}_bucket{{{}="{}",le="{}"}} {}'.format(
+                metric, label, value, bound, cumulative))
+        lines.append('{}_sum{{{}="{}"}} {}'.format(
+            metric, label, value, repr(entry['latency_sum'])))
+        lines.append('{}_count{{{}="{}"}} {}'.format(
+            metric, label, value, entry['count']))
+
+
+def _escape(value):
+
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
@@ -4,9 +4,23 @@
 """Define WiFi Profile."""
 
 from .const import *
+from .interning import bssid_to_int
 
 
 class Profile():
+    """Profile describes an AP or a network profile."""
+
+    """
+    akm and cipher hold the single strongest AKM_TYPE_* and CIPHER_TYPE_*
+    value. akm_flags and cipher_flags are the bitmasks of all the types
+    the AP offers, and follow akm and cipher unless set explicitly. ies
+    holds the InformationElements of a scanned AP when they were asked for.
+    The fields are slots, and the other attributes set by the callers go
+    to the __dict__ as before.
+    """
+    __slots__ = ('id', 'auth', 'akm', 'cipher', 'ssid', 'bssid', 'key', 'ft',
+                 'proactive_key_caching', 'pmf', 'freq', 'signal', 'ies',
+                 '_akm_flags', '_cipher_flags', '__dict__')
 
     def __init__(self):
 
@@ -17,36 +31,201 @@ class Profile():
         self.ssid = None
         self.bssid = None
         self.key = None
+        self.ft = False
+        self.proactive_key_caching = False
+        self.pmf = None
+        self.freq = None
+        self.signal = None
+        self.ies = None
+        self._akm_flags = None
+        self._cipher_flags = None
 
-    # def process_akm(self):
+    @property
+    def akm_flags(self):
+        """Get the AkmFlag of all the key management types."""
 
-    #     if len(self.akm) > 1:
-    #         self.akm = self.akm[-1:]
+        if self._akm_flags is None:
+            return akm_flags(self.akm)
 
-    def __eq__(self, profile):
+        return self._akm_flags
+
+    @akm_flags.setter
+    def akm_flags(self, flags):
+
+        self._akm_flags = AkmFlag(flags)
+
+    @property
+    def cipher_flags(self):
+        """Get the CipherFlag of all the cipher types."""
+
+        if self._cipher_flags is None:
+            return cipher_flags(self.cipher)
+
+        return self._cipher_flags
 
-        if profile.ssid:
-            if profile.ssid != self.ssid:
+    @cipher_flags.setter
+    def cipher_flags(self, flags):
+
+        self._cipher_flags = CipherFlag(flags)
+
+    def canonical_key(self):
+        """Get the canonical key of the AP settings."""
+
+        return (self.ssid, self.bssid, self.auth, self.akm, self.cipher)
+
+    def matches(self, pattern):
+        """Check the profile against a pattern profile.
+
+        The falsy ssid, bssid, auth, cipher and akm of the pattern match
+        anything.
+        """
+
+        if pattern.ssid:
+            if pattern.ssid != self.ssid:
                 return False
 
-        if profile.bssid:
-            if profile.bssid != self.bssid:
+        if pattern.bssid:
+            if pattern.bssid != self.bssid:
                 return False
 
-        if profile.auth:
-            if profile.auth!= self.auth:
+        if pattern.auth:
+            if pattern.auth != self.auth:
                 return False
 
-        if profile.cipher:
-            if profile.cipher != self.cipher:
+        if pattern.cipher:
+            if pattern.cipher != self.cipher:
                 return False
 
-        if profile.akm:
-            if profile.akm != self.akm:
+        if pattern.akm:
+            if pattern.akm != self.akm:
                 return False
-        
-        # if profile.akm:
-        #     if set(profile.akm).isdisjoint(set(self.akm)):
-        #         return False
 
         return True
+
+    def __hash__(self):
+
+        # A profile whose fields are all falsy equals every profile, so
+        # only a constant hash agrees with ==. ProfileStore indexes the
+        # profiles for the lookups instead.
+        return hash(Profile)
+
+    def __eq__(self, profile):
+
+        if not isinstance(profile, Profile):
+            return NotImplemented
+
+        return self.matches(profile)
+
+
+class ProfileStore:
+    """ProfileStore keeps profiles indexed for matching."""
+
+    """
+    match() returns the stored profiles matching the pattern, with the
+    falsy fields of the pattern as wildcards just like Profile.matches(). The
+    candidates are taken from the index of (ssid, akm, cipher), BSSID or
+    SSID, whichever the pattern allows, so a lookup does not scan all the
+    profiles. A stored profile has to be removed and added again after its
+    fields change.
+    """
+    _profiles = {}
+    _by_ssid = {}
+    _by_bssid = {}
+    _by_security = {}
+
+    def __init__(self, profiles=()):
+
+        self._profiles = {}
+        self._by_ssid = {}
+        self._by_bssid = {}
+        self._by_security = {}
+        for profile in profiles:
+            self.add(profile)
+
+    def __len__(self):
+
+        return len(self._profiles)
+
+    def __iter__(self):
+
+        return iter(list(self._profiles.values()))
+
+    def __contains__(self, pattern):
+
+        return self.find(pattern) is not None
+
+    def add(self, profile):
+        """Add a profile to the store."""
+
+        slot = id(profile)
+        if slot in self._profiles:
+            return
+
+        self._profiles[slot] = profile
+        self._by_ssid.setdefault(profile.ssid, {})[slot] = profile
+        self._by_bssid.setdefault(
+            _bssid_key(profile.bssid), {})[slot] = profile
+        self._by_security.setdefault(
+            _security_key(profile), {})[slot] = profile
+
+    def remove(self, profile):
+        """Remove a stored profile."""
+
+        slot = id(profile)
+        if slot not in self._profiles:
+            raise KeyError(profile)
+
+        del self._profiles[slot]
+        _unindex(self._by_ssid, profile.ssid, slot)
+        _unindex(self._by_bssid, _bssid_key(profile.bssid), slot)
+        _unindex(self._by_security, _security_key(profile), slot)
+
+    def discard(self, profile):
+        """Remove a stored profile if it is in the store."""
+
+        if id(profile) in self._profiles:
+            self.remove(profile)
+
+    def match(self, pattern):
+        """Get the stored profiles matching the pattern."""
+
+        if pattern.ssid and pattern.akm and pattern.cipher:
+            candidates = self._by_security.get(_security_key(pattern), {})
+        elif pattern.bssid:
+            candidates = self._by_bssid.get(_bssid_key(pattern.bssid), {})
+        elif pattern.ssid:
+            candidates = self._by_ssid.get(pattern.ssid, {})
+        else:
+            candidates = self._profiles
+
+        return [profile for profile in candidates.values()
+                if profile.matches(pattern)]
+
+    def find(self, pattern):
+        """Get the first stored profile matching the pattern, or None."""
+
+        matches = self.match(pattern)
+
+        return matches[0] if matches else None
+
+
+def _bssid_key(bssid):
+
+    # BSSIDs are indexed by their 48-bit integer, which hashes cheaper.
+    try:
+        return bssid_to_int(bssid)
+    except (TypeError, ValueError):
+        return bssid
+
+
+def _security_key(profile):
+
+    return (profile.ssid, profile.akm, profile.cipher)
+
+
+def _unindex(index, key, slot):
+
+    entries = index[key]
+    del entries[slot]
+    if not entries:
+        del index[key]
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# vim: set fileencoding=utf-8
+
+"""Replay the traffic with wpa_supplicant recorded by the Linux backend."""
+
+import collections
+import logging
+import time
+
+from ._wifiutil_linux import WifiUtil
+from .flightrecorder import redact
+from .traffic import read_traffic, RECORD_EXCHANGE, RECORD_EVENT, \
+    RECORD_INTERFACES
+
+
+class ReplayWifiUtil(WifiUtil):
+    """ReplayWifiUtil serves the interfaces from a traffic recording."""
+
+    """
+    The replies are looked up by command in the order they were recorded
+    for each interface. The replay keeps a clock in recorded time: it runs
+    at speed times the real time, and jumps forward to the end of each
+    replayed exchange. An event is delivered once the clock has passed the
+    time it was recorded at. With speed 0 the replay never sleeps, and the
+    clock only moves with the exchanges and the waits for events.
+    """
+
+    def __init__(self, path, speed=1.0):
+
+        super().__init__()
+        self._speed = speed
+        self._exchanges = collections.defaultdict(collections.deque)
+        self._events = collections.defaultdict(collections.deque)
+        self._recorded_ifaces = []
+        self._clock = 0.0
+        self._started = None
+        self._logger = logging.getLogger('pywifi')
+
+        for kind, at, duration, iface, first, second in read_traffic(path):
+            if kind == RECORD_EXCHANGE:
+                self._exchanges[iface].append(
+                    (at, duration, first.decode('utf-8'), second))
+            elif kind == RECORD_EVENT:
+                self._events[iface].append((at, first.decode('utf-8')))
+            elif kind == RECORD_INTERFACES and not self._recorded_ifaces:
+                self._recorded_ifaces = first.decode('utf-8').split('\n')
+
+    def interfaces(self, refresh=False):
+        """Get the recorded wifi interfaces."""
+
+        return [{'name': name} for name in self._recorded_ifaces if name]
+
+    def attach(self, obj):
+        """Subscribe to the recorded events of the wifi interface."""
+
+        pass
+
+    def detach(self, obj):
+        """Stop receiving the recorded events of the wifi interface."""
+
+        pass
+
+    def events(self, obj, timeout=0):
+        """Get the recorded events due, waiting up to timeout for the first."""
+
+        queue = self._events.get(obj['name'])
+        now = self._now()
+        if queue and queue[0][0] > now and timeout > 0:
+            wait = (queue[0][0] - now) / self._speed if self._speed else 0
+            if wait <= timeout:
+                time.sleep(wait)
+                self._clock = max(self._clock, queue[0][0])
+                now = self._now()
+            else:
+                time.sleep(timeout)
+        elif not queue:
+            if self._speed:
+                time.sleep(timeout)
+            else:
+                self._clock += timeout
+
+        events = []
+        while queue and queue[0][0] <= now:
+            events.append(queue.popleft()[1])
+
+        return events
+
+    def _now(self):
+
+        if self._started is None:
+            self._started = time.monotonic()
+        if self._speed:
+            self._clock = max(self._clock,
+                              (time.monotonic() - self._started) * self._speed)
+
+        return self._clock
+
+    def _roundtrip(self, iface, cmd, timeout):
+
+        self._now()
+        if cmd.startswith('SET_NETWORK'):
+            # The secrets are redacted in the recording.
+            cmd = redact(cmd)
+        queue = self._exchanges.get(iface, ())
+        for i, (at, duration, recorded_cmd, reply) in enumerate(queue):
+            if recorded_cmd == cmd:
+                del queue[i]
+                break
+        else:
+            self._logger.error("Command '%s' to '%s' is not in the recording",
+                               cmd, iface)
+            return b'FAIL\n'
+
+        if self._speed:
+            time.sleep(duration / self._speed)
+        self._clock = max(self._clock, at + duration)
+
+        return reply
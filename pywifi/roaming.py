@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# vim: set fileencoding=utf-8
+
+"""Select the BSS to roam to from successive scan results."""
+
+import heapq
+import logging
+import time
+
+from .const import *
+from .analytics import freq_band, freq_mhz
+
+# Weight of a new RSSI sample in the smoothed RSSI.
+RSSI_EWMA_ALPHA = 0.3
+# dB by which a candidate must beat the current BSS before roaming.
+ROAM_HYSTERESIS = 8
+# Seconds after which a BSS missing from the scans is forgotten.
+BSS_EXPIRY = 30
+
+# dB added to the smoothed RSSI of a BSS for its band.
+band_preference = {
+    BAND_2GHZ: 0,
+    BAND_5GHZ: 5,
+    BAND_6GHZ: 5,
+}
+
+
+class RoamingEngine:
+    """RoamingEngine ranks the BSSes of every SSID by smoothed RSSI."""
+
+    """
+    The BSSes of each SSID are kept in a heap ordered by score. An update
+    pushes a new heap entry instead of re-sorting, and the superseded
+    entries are skipped when the best BSS is looked up.
+    """
+    _iface = None
+    _bsses = {}
+    _members = {}
+    _heaps = {}
+    _logger = None
+
+    def __init__(self, iface=None, alpha=RSSI_EWMA_ALPHA,
+                 hysteresis=ROAM_HYSTERESIS, expiry=BSS_EXPIRY,
+                 preference=None):
+
+        self._iface = iface
+        self._alpha = alpha
+        self._hysteresis = hysteresis
+        self._expiry = expiry
+        self._preference = band_preference if preference is None \
+            else preference
+        self._bsses = {}
+        self._members = {}
+        self._heaps = {}
+        self._version = 0
+        self._logger = logging.getLogger('pywifi')
+
+    def update(self, bsses, now=None):
+        """Feed the BSSes of a scan result."""
+
+        if now is None:
+            now = time.monotonic()
+
+        for bss in bsses:
+            self.update_bss(bss.ssid, bss.bssid, bss.freq, bss.signal, now)
+
+    def update_bss(self, ssid, bssid, freq, signal, now=None):
+        """Feed a single RSSI sample of a BSS."""
+
+        if now is None:
+            now = time.monotonic()
+
+        entry = self._bsses.get(bssid)
+        if entry is None or entry['ssid'] != ssid:
+            if entry is not None:
+                self._members[entry['ssid']].discard(bssid)
+            self._members.setdefault(ssid, set()).add(bssid)
+            rssi = float(signal)
+        else:
+            rssi = self._alpha * signal + (1 - self._alpha) * entry['rssi']
+
+        # Windows reports the frequencies in kHz.
+        freq = freq_mhz(freq or 0)
+        self._version += 1
+        score = rssi + self._preference.get(freq_band(freq), 0)
+        self._bsses[bssid] = {
+            'ssid': ssid,
+            'freq': freq,
+            'rssi': rssi,
+            'score': score,
+            'seen_at': now,
+            'version': self._version
+        }
+
+        heap = self._heaps.setdefault(ssid, [])
+        heapq.heappush(heap, (-score, self._version, bssid))
+        if len(heap) > 4 * len(self._members[ssid]) + 16:
+            self._compact(ssid)
+
+    def best(self, ssid, now=None):
+        """Get the BSSID with the highest score of the SSID, or None."""
+
+        if now is None:
+            now = time.monotonic()
+
+        heap = self._heaps.get(ssid)
+        while heap:
+            _, version, bssid = heap[0]
+            entry = self._bsses.get(bssid)
+            if entry is None or entry['version'] != version:
+                heapq.heappop(heap)
+            elif now - entry['seen_at'] > self._expiry:
+                heapq.heappop(heap)
+                del self._bsses[bssid]
+                self._members[ssid].discard(bssid)
+            else:
+                return bssid
+
+        return None
+
+    def candidates(self, ssid, now=None):
+        """Get the BSSIDs of the SSID ordered by score."""
+
+        if now is None:
+            now = time.monotonic()
+
+        entries = []
+        for bssid in self._members.get(ssid, ()):
+            entry = self._bsses[bssid]
+            if now - entry['seen_at'] <= self._expiry:
+                entries.append((entry['score'], bssid))
+
+        return [bssid for _, bssid in sorted(entries, reverse=True)]
+
+    def bss(self, bssid):
+        """Get the smoothed state of a BSS, or None."""
+
+        return self._bsses.get(bssid)
+
+    def roam_target(self, ssid, current_bssid, now=None):
+        """Get the BSSID worth roaming to from the current BSS, or None."""
+
+        bssid = self.best(ssid, now)
+        if bssid is None or bssid == current_bssid:
+            return None
+
+        current = self._bsses.get(current_bssid)
+        if current is not None and \
+                self._bsses[bssid]['score'] < current['score'] + \
+                self._hysteresis:
+            return None
+
+        return bssid
+
+    def roam(self, ssid, current_bssid, now=None):
+        """Roam the interface to a better BSS of the SSID if there is one."""
+
+        bssid = self.roam_target(ssid, current_bssid, now)
+        if bssid is not None:
+            self._logger.info("Roam from '%s' to '%s' for '%s'",
+                              current_bssid, bssid, ssid)
+            self._iface.roam(bssid)
+
+        return bssid
+
+    def _compact(self, ssid):
+
+        heap = []
+        for bssid in self._members[ssid]:
+            entry = self._bsses[bssid]
+            heap.append((-entry['score'], entry['version'], bssid))
+        heapq.heapify(heap)
+        self._heaps[ssid] = heap
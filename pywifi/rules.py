@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+# vim: set fileencoding=utf-8
+
+"""Raise alerts on suspicious changes in successive scan results."""
+
+import collections
+import logging
+import threading
+import time
+
+from .const import *
+from .roaming import BSS_EXPIRY
+
+RULE_UNKNOWN_BSSID = 'unknown_bssid'
+RULE_SECURITY_DOWNGRADE = 'security_downgrade'
+RULE_RSSI_JUMP = 'rssi_jump'
+
+# dB between two successive samples of a BSS raising an RSSI jump.
+RSSI_JUMP = 20
+# Number of alerts kept for events(), dropping the oldest.
+ALERT_QUEUE_SIZE = 1024
+
+# The security level of each key management type, where a BSS with a
+# lower level than another BSS of its SSID is a downgrade.
+security_levels = {
+    AKM_TYPE_NONE: 0,
+    AKM_TYPE_OPEN: 0,
+    AKM_TYPE_SHARED: 1,
+    AKM_TYPE_WPANONE: 1,
+    AKM_TYPE_WPA: 2,
+    AKM_TYPE_WPAPSK: 2,
+    AKM_TYPE_WPA2: 3,
+    AKM_TYPE_WPA2PSK: 3,
+    AKM_TYPE_OWE: 3,
+    AKM_TYPE_WPA3: 4,
+    AKM_TYPE_WPA3SAE: 4,
+    AKM_TYPE_WPA3ENT: 4,
+}
+
+
+class RuleEngine:
+    """RuleEngine checks every scan against the BSSes seen before."""
+
+    """
+    The last sample of each BSS is kept by BSSID, and the BSSIDs and the
+    highest security level of each SSID by SSID. A BSS whose SSID, signal
+    and security are unchanged since the last scan is skipped, so a scan
+    only costs a lookup for each BSS besides the rules on the changed
+    ones. Each alert is raised once until its BSS is forgotten, except
+    for the RSSI jumps, and is queued for events(). Once the queue is
+    full, the oldest alerts are dropped for the new ones.
+    """
+    _bsses = {}
+    _ssids = {}
+    _logger = None
+
+    def __init__(self, known=None, rules=None, rssi_jump=RSSI_JUMP,
+                 expiry=BSS_EXPIRY, queue_size=ALERT_QUEUE_SIZE):
+
+        self._rules = set(rules) if rules is not None else {
+            RULE_UNKNOWN_BSSID, RULE_SECURITY_DOWNGRADE, RULE_RSSI_JUMP}
+        self._rssi_jump = rssi_jump
+        self._expiry = expiry
+        self._bsses = {}
+        self._ssids = {}
+        self._known = {}
+        self._alerts = collections.deque(maxlen=queue_size)
+        self._queued = threading.Condition()
+        self._pruned_at = None
+        self._logger = logging.getLogger('pywifi')
+        for ssid, bssids in (known or {}).items():
+            self.trust(ssid, bssids)
+
+    def trust(self, ssid, bssids):
+        """Add BSSIDs to the known ones of an SSID.
+
+        Once an SSID has known BSSIDs, any other BSSID of it is an alert.
+        """
+
+        self._known.setdefault(ssid, set()).update(
+            bssid.lower() for bssid in bssids)
+
+    def update(self, bsses, now=None):
+        """Feed the BSSes of a scan result and get the raised alerts."""
+
+        if now is None:
+            now = time.monotonic()
+
+        alerts = []
+        for bss in bsses:
+            level = security_levels.get(bss.akm, 0)
+            entry = self._bsses.get(bss.bssid)
+            if entry is not None and now - entry['seen_at'] > self._expiry:
+                self._forget(bss.bssid, entry)
+                entry = None
+
+            if entry is not None and entry['ssid'] == bss.ssid and \
+                    entry['signal'] == bss.signal and \
+                    entry['level'] == level:
+                entry['seen_at'] = now
+                continue
+
+            self._check(bss, level, entry, now, alerts)
+
+        # The BSSes gone from the scans are dropped once per expiry.
+        if self._pruned_at is None:
+            self._pruned_at = now
+        elif now - self._pruned_at > self._expiry:
+            self._pruned_at = now
+            for bssid, entry in list(self._bsses.items()):
+                if now - entry['seen_at'] > self._expiry:
+                    self._forget(bssid, entry)
+
+        for alert in alerts:
+            self._logger.warning("Alert %s for '%s' from '%s'",
+                                 alert['rule'], alert['ssid'],
+                                 alert['bssid'])
+        if alerts:
+            with self._queued:
+                self._alerts.extend(alerts)
+                self._queued.notify_all()
+
+        return alerts
+
+    def events(self, timeout=0):
+        """Get the alerts raised, waiting up to timeout for the first."""
+
+        with self._queued:
+            if timeout > 0:
+                self._queued.wait_for(lambda: self._alerts, timeout)
+            alerts = list(self._alerts)
+            self._alerts.clear()
+
+        return alerts
+
+    def bss(self, bssid):
+        """Get the last sample of a BSS, or None."""
+
+        return self._bsses.get(bssid)
+
+    def _check(self, bss, level, entry, now, alerts):
+
+        ssid = self._ssids.get(bss.ssid)
+        if ssid is None:
+            ssid = self._ssids[bss.ssid] = {'bssids': set(), 'level': level}
+        if entry is not None and entry['ssid'] != bss.ssid:
+            self._forget(bss.bssid, entry)
+            entry = None
+
+        raised = entry['raised'] if entry is not None else set()
+        known = self._known.get(bss.ssid)
+        if RULE_UNKNOWN_BSSID in self._rules and known and \
+                RULE_UNKNOWN_BSSID not in raised and \
+                bss.bssid.lower() not in known:
+            raised.add(RULE_UNKNOWN_BSSID)
+            alerts.append(self._alert(RULE_UNKNOWN_BSSID, bss.bssid,
+                                      bss.ssid, now))
+
+        if RULE_SECURITY_DOWNGRADE in self._rules and \
+                level < ssid['level'] and \
+                RULE_SECURITY_DOWNGRADE not in raised:
+            raised.add(RULE_SECURITY_DOWNGRADE)
+            alerts.append(self._alert(RULE_SECURITY_DOWNGRADE, bss.bssid,
+                                      bss.ssid, now, level=level,
+                                      expected=ssid['level']))
+
+        if RULE_RSSI_JUMP in self._rules and entry is not None and \
+                abs(bss.signal - entry['signal']) >= self._rssi_jump:
+            alerts.append(self._alert(RULE_RSSI_JUMP, bss.bssid, bss.ssid,
+                                      now, signal=bss.signal,
+                                      previous=entry['signal']))
+
+        self._bsses[bss.bssid] = {
+            'ssid': bss.ssid,
+            'signal': bss.signal,
+            'level': level,
+            'seen_at': now,
+            'raised': raised
+        }
+        ssid['bssids'].add(bss.bssid)
+        if level > ssid['level']:
+            ssid['level'] = level
+            # The BSSes seen before the stronger one are downgrades now.
+            if RULE_SECURITY_DOWNGRADE in self._rules:
+                for bssid in ssid['bssids']:
+                    other = self._bsses[bssid]
+                    if other['level'] < level and \
+                            RULE_SECURITY_DOWNGRADE not in other['raised']:
+                        other['raised'].add(RULE_SECURITY_DOWNGRADE)
+                        alerts.append(self._alert(
+                            RULE_SECURITY_DOWNGRADE, bssid, other['ssid'],
+                            now, level=other['level'], expected=level))
+
+    def _forget(self, bssid, entry):
+
+        del self._bsses[bssid]
+        ssid = self._ssids[entry['ssid']]
+        ssid['bssids'].discard(bssid)
+        if not ssid['bssids']:
+            del self._ssids[entry['ssid']]
+
+    def _alert(self, rule, bssid, ssid, now, **details):
+
+        alert = {
+            'rule': rule,
+            'ssid': ssid,
+            'bssid': bssid,
+            'time': now
+        }
+        alert.update(details)
+
+        return alert
@@ -0,0 +1,583 @@
+#!/usr/bin/env python3
+# vim: set fileencoding=utf-8
+
+"""Record site surveys to an append-only binary log and query them."""
+
+import array
+import bisect
+import csv
+import heapq
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+
+from .analytics import freq_mhz
+from .interning import bssid_to_int, format_bssid
+
+SURVEY_MAGIC = b'PWSV\x01'
+SURVEY_INDEX_MAGIC = b'PWSVIDX\x01'
+# Number of scans recorded between two writes of the index file.
+SURVEY_INDEX_INTERVAL = 256
+
+RECORD_SSID = 1
+RECORD_SCAN = 2
+
+# Kind and the length of the payload.
+_record_header = struct.Struct('<BI')
+# Time, length of the iface name and number of observations.
+_scan_header = struct.Struct('<dHI')
+# BSSID, frequency in MHz, signal, SSID id, AKM and cipher.
+_observation = struct.Struct('<QHhIBB')
+# Log size covered, numbers of scans and observations, and the length of
+# the SSIDs in JSON. The header keeps the arrays after it 8-byte aligned.
+_index_header = struct.Struct('<QQQQ')
+_index_time = struct.Struct('<d')
+_index_offset = struct.Struct('<Q')
+
+SURVEY_FIELDS = ['time', 'iface', 'bssid', 'ssid', 'freq', 'signal', 'akm',
+                 'cipher']
+
+
+def index_path(path):
+    """Get the path of the index file of a survey log."""
+
+    return path + '.idx'
+
+
+def _iter_records(data, pos):
+
+    size = len(data)
+    while pos + _record_header.size <= size:
+        kind, length = _record_header.unpack_from(data, pos)
+        start = pos + _record_header.size
+        if start + length > size:
+            # A record still being written.
+            return
+        yield kind, start, start + length
+        pos = start + length
+
+
+def _scan_bssids(data, start, end):
+
+    # The BSSIDs of a scan record with the offsets of their observations.
+    _, iface_len, _ = _scan_header.unpack_from(data, start)
+    first = start + _scan_header.size + iface_len
+    return [(bssid, first + i * _observation.size) for i, (bssid, *_) in
+            enumerate(_observation.iter_unpack(data[first:end]))]
+
+
+def _index_sections(header):
+
+    # The (struct, start, count) of the arrays and the start of the SSIDs.
+    _, scans, observations, _ = header
+    sections = []
+    pos = len(SURVEY_INDEX_MAGIC) + _index_header.size
+    for fmt, count in [(_index_time, scans), (_index_offset, scans),
+                       (_index_offset, observations),
+                       (_index_offset, observations)]:
+        sections.append((fmt, pos, count))
+        pos += fmt.size * count
+
+    return sections, pos
+
+
+def _read_index_header(f, log_size):
+
+    # Get the header of an index file, or None if it does not match the
+    # log.
+    magic = f.read(len(SURVEY_INDEX_MAGIC))
+    data = f.read(_index_header.size)
+    if magic != SURVEY_INDEX_MAGIC or len(data) < _index_header.size:
+        return None
+    header = _index_header.unpack(data)
+    _, end = _index_sections(header)
+    if header[0] > log_size or \
+            os.fstat(f.fileno()).st_size != end + header[3]:
+        return None
+
+    return header
+
+
+class _MappedArray:
+    """_MappedArray reads the numbers of an array in a memory map."""
+
+    __slots__ = ('_map', '_start', '_count', '_format')
+
+    def __init__(self, data, start, count, fmt):
+
+        self._map = data
+        self._start = start
+        self._count = count
+        self._format = fmt
+
+    def __len__(self):
+
+        return self._count
+
+    def __getitem__(self, i):
+
+        if isinstance(i, slice):
+            start, stop, _ = i.indices(self._count)
+            return _MappedArray(self._map,
+                                self._start + start * self._format.size,
+                                max(stop - start, 0), self._format)
+        if i < 0:
+            i += self._count
+        if not 0 <= i < self._count:
+            raise IndexError(i)
+
+        return self._format.unpack_from(
+            self._map, self._start + i * self._format.size)[0]
+
+
+class _Column:
+    """_Column is an indexed array followed by the values appended since."""
+
+    __slots__ = ('_indexed', '_tail')
+
+    def __init__(self, indexed=(), tail=None):
+
+        self._indexed = indexed
+        self._tail = [] if tail is None else tail
+
+    def __len__(self):
+
+        return len(self._indexed) + len(self._tail)
+
+    def __getitem__(self, i):
+
+        if i < 0:
+            i += len(self)
+        if i < len(self._indexed):
+            return self._indexed[i]
+
+        return self._tail[i - len(self._indexed)]
+
+    def append(self, value):
+
+        self._tail.append(value)
+
+
+class SurveyRecorder:
+    """SurveyRecorder appends timestamped scan results to a survey log."""
+
+    """
+    Each scan is one record of fixed size observations, with the BSSID as
+    a 48-bit integer and the SSID as the id of an SSID record written the
+    first time the SSID is seen. An existing log is appended to, after
+    dropping a record left incomplete by a crash. The scans are expected
+    in the order of their times, which the time queries rely on.
+
+    The scans and the observations recorded are also indexed in an index
+    file next to the log, with the observations sorted by BSSID. The new
+    entries are kept in memory and merged into the index file every
+    index_interval scans and on close(), so opening the log only has to
+    read the records appended after the index.
+    """
+    _file = None
+    _ssids = {}
+
+    def __init__(self, path, index_interval=SURVEY_INDEX_INTERVAL):
+
+        self._path = path
+        self._index_interval = index_interval
+        self._ssids = {}
+        self._scans = []
+        self._observations = []
+        self._indexed = False
+        self._lock = threading.Lock()
+        if os.path.exists(path) and os.path.getsize(path):
+            self._open_log(path)
+        else:
+            self._file = open(path, 'wb')
+            self._file.write(SURVEY_MAGIC)
+            self._file.flush()
+            # An index left by an earlier log with the same name.
+            self._write_index()
+
+    def __enter__(self):
+
+        return self
+
+    def __exit__(self, *exc_info):
+
+        self.close()
+
+    def record(self, bsses, at=None, iface=''):
+        """Append the scan results, taken at the time at or now."""
+
+        if at is None:
+            at = time.time()
+        iface = iface.encode('utf-8')
+
+        with self._lock:
+            chunks = []
+            observations = []
+            bssids = []
+            for bss in bsses:
+                ssid = bss.ssid or ''
+                ssid_id = self._ssids.get(ssid)
+                if ssid_id is None:
+                    ssid_id = self._ssids[ssid] = len(self._ssids)
+                    encoded = ssid.encode('utf-8')
+                    chunks.append(_record_header.pack(RECORD_SSID,
+                                                      len(encoded)))
+                    chunks.append(encoded)
+                bssids.append(bssid_to_int(bss.bssid))
+                observations.append(_observation.pack(
+                    bssids[-1], freq_mhz(bss.freq or 0),
+                    bss.signal or 0, ssid_id, bss.akm, bss.cipher))
+
+            start = self._file.tell() + sum(map(len, chunks)) + \
+                _record_header.size
+            first = start + _scan_header.size + len(iface)
+            payload = _scan_header.pack(at, len(iface), len(observations))
+            chunks.append(_record_header.pack(
+                RECORD_SCAN, len(payload) + len(iface) +
+                _observation.size * len(observations)))
+            chunks.append(payload)
+            chunks.append(iface)
+            chunks.extend(observations)
+            # Readers only see whole records once they are flushed.
+            self._file.write(b''.join(chunks))
+            self._file.flush()
+
+            self._scans.append((at, start))
+            self._observations.extend(
+                (bssid, first + i * _observation.size)
+                for i, bssid in enumerate(bssids))
+            if len(self._scans) >= self._index_interval:
+                self._write_index()
+
+    def close(self):
+        """Write the index, flush and close the log."""
+
+        with self._lock:
+            if self._file.closed:
+                return
+            self._write_index()
+            self._file.close()
+
+    def _open_log(self, path):
+
+        start = len(SURVEY_MAGIC)
+        try:
+            with open(index_path(path), 'rb') as f:
+                header = _read_index_header(f, os.path.getsize(path))
+                if header is not None:
+                    _, ssids_start = _index_sections(header)
+                    f.seek(ssids_start)
+                    ssids = json.loads(f.read(header[3]).decode('utf-8'))
+                    self._ssids = {ssid: i for i, ssid in enumerate(ssids)}
+                    self._indexed = True
+                    start = header[0]
+        except (OSError, ValueError):
+            pass
+
+        # Only the records after the index are read.
+        with open(path, 'rb') as f:
+            if f.read(len(SURVEY_MAGIC)) != SURVEY_MAGIC:
+                raise ValueError("'{}' is not a survey log".format(path))
+            f.seek(start)
+            data = f.read()
+
+        end = 0
+        for kind, record_start, end in _iter_records(data, 0):
+            if kind == RECORD_SSID:
+                self._ssids[data[record_start:end].decode('utf-8')] = \
+                    len(self._ssids)
+            elif kind == RECORD_SCAN:
+                self._scans.append((
+                    _scan_header.unpack_from(data, record_start)[0],
+                    start + record_start))
+                self._observations.extend(
+                    (bssid, start + offset) for bssid, offset in
+                    _scan_bssids(data, record_start, end))
+        self._file = open(path, 'r+b')
+        self._file.truncate(start + end)
+        self._file.seek(start + end)
+
+    def _write_index(self):
+
+        times = array.array('d')
+        scan_offsets = array.array('Q')
+        bssids = array.array('Q')
+        offsets = array.array('Q')
+        path = index_path(self._path)
+        if self._indexed:
+            with open(path, 'rb') as f:
+                header = _read_index_header(f, self._file.tell())
+                for values, count in [(times, header[1]),
+                                      (scan_offsets, header[1]),
+                                      (bssids, header[2]),
+                                      (offsets, header[2])]:
+                    values.fromfile(f, count)
+                    if sys.byteorder == 'big':
+                        values.byteswap()
+
+        for at, offset in self._scans:
+            times.append(at)
+            scan_offsets.append(offset)
+        self._observations.sort()
+        merged_bssids = array.array('Q')
+        merged_offsets = array.array('Q')
+        for bssid, offset in heapq.merge(zip(bssids, offsets),
+                                         self._observations):
+            merged_bssids.append(bssid)
+            merged_offsets.append(offset)
+        ssids = json.dumps(sorted(self._ssids, key=self._ssids.get))
+        ssids = ssids.encode('utf-8')
+
+        # The index is replaced at once, so readers never see it partly
+        # written.
+        with open(path + '.tmp', 'wb') as f:
+            f.write(SURVEY_INDEX_MAGIC)
+            f.write(_index_header.pack(self._file.tell(), len(times),
+                                       len(merged_bssids), len(ssids)))
+            for values in (times, scan_offsets, merged_bssids,
+                           merged_offsets):
+                if sys.byteorder == 'big':
+                    values.byteswap()
+                values.tofile(f)
+            f.write(ssids)
+        try:
+            os.replace(path + '.tmp', path)
+        except OSError:
+            # The index is mapped by a reader on Windows, so keep the new
+            # entries for the next write.
+            os.remove(path + '.tmp')
+            return
+
+        self._scans = []
+        self._observations = []
+        self._indexed = True
+
+
+class SurveyLog:
+    """SurveyLog queries a survey log through a memory map."""
+
+    """
+    The scans by time and the observations by BSSID are looked up by
+    bisecting the arrays of the index file through a memory map, and only
+    the records appended after the index are walked, when the log is
+    opened and by refresh(). The queries then only unpack the
+    observations they return.
+    """
+    _file = None
+    _map = None
+    _index_map = None
+
+    def __init__(self, path):
+
+        self._path = path
+        self._file = open(path, 'rb')
+        self._map = None
+        self._index_map = None
+        self._index_stamp = None
+        if self._file.read(len(SURVEY_MAGIC)) != SURVEY_MAGIC:
+            self._file.close()
+            raise ValueError("'{}' is not a survey log".format(path))
+        self.refresh()
+
+    def __enter__(self):
+
+        return self
+
+    def __exit__(self, *exc_info):
+
+        self.close()
+
+    def __len__(self):
+
+        return len(self._scan_offsets)
+
+    def refresh(self):
+        """Index the records appended since the log was last indexed."""
+
+        size = os.fstat(self._file.fileno()).st_size
+        stamp = self._get_index_stamp()
+        if self._map is not None and size == len(self._map) and \
+                stamp == self._index_stamp:
+            return
+        if self._map is not None:
+            self._map.close()
+        self._map = mmap.mmap(self._file.fileno(), size,
+                              access=mmap.ACCESS_READ)
+        if self._index_map is None or stamp != self._index_stamp:
+            self._load_index(size)
+
+        for kind, start, end in _iter_records(self._map, self._indexed):
+            if kind == RECORD_SSID:
+                self._ssids.append(self._map[start:end].decode('utf-8'))
+            elif kind == RECORD_SCAN:
+                self._scan_times.append(
+                    _scan_header.unpack_from(self._map, start)[0])
+                self._scan_offsets.append(start)
+                for bssid, offset in _scan_bssids(self._map, start, end):
+                    self._bssids.setdefault(bssid, []).append(offset)
+            self._indexed = end
+
+    def close(self):
+        """Unmap and close the log."""
+
+        if self._map is not None:
+            self._map.close()
+        self._close_index()
+        self._file.close()
+
+    def bssids(self):
+        """Get the BSSIDs seen in the survey."""
+
+        bssids = []
+        previous = None
+        for bssid in self._index_bssids:
+            if bssid != previous:
+                bssids.append(bssid)
+                previous = bssid
+        indexed = set(bssids)
+        bssids.extend(b for b in self._bssids if b not in indexed)
+
+        return [format_bssid(bssid) for bssid in bssids]
+
+    def history(self, bssid, since=None, until=None):
+        """Get the (time, signal) of a BSSID between since and until."""
+
+        offsets = self._offsets(bssid_to_int(bssid))
+        first, last = self._scan_range(since, until)
+        if first == last:
+            return []
+
+        # The observations of a BSSID are in the order of their scans.
+        lower = bisect.bisect_left(offsets, self._scan_offsets[first])
+        upper = len(offsets) if last == len(self._scan_offsets) else \
+            bisect.bisect_left(offsets, self._scan_offsets[last])
+        history = []
+        for i in range(lower, upper):
+            offset = offsets[i]
+            scan = bisect.bisect_right(self._scan_offsets, offset) - 1
+            history.append((self._scan_times[scan],
+                            _observation.unpack_from(self._map, offset)[2]))
+
+        return history
+
+    def scans(self, since=None, until=None):
+        """Iterate the (time, iface, observations) of the scans."""
+
+        first, last = self._scan_range(since, until)
+        for scan in range(first, last):
+            start = self._scan_offsets[scan]
+            at, iface_len, count = _scan_header.unpack_from(self._map, start)
+            pos = start + _scan_header.size
+            iface = self._map[pos:pos + iface_len].decode('utf-8')
+            pos += iface_len
+            observations = []
+            for bssid, freq, signal, ssid_id, akm, cipher in \
+                    _observation.iter_unpack(
+                        self._map[pos:pos + count * _observation.size]):
+                observations.append({
+                    'bssid': format_bssid(bssid),
+                    'ssid': self._ssids[ssid_id],
+                    'freq': freq,
+                    'signal': signal,
+                    'akm': akm,
+                    'cipher': cipher
+                })
+            yield at, iface, observations
+
+    def observations(self, since=None, until=None):
+        """Iterate the observations of the scans as flat dicts."""
+
+        for at, iface, observations in self.scans(since, until):
+            for observation in observations:
+                observation['time'] = at
+                observation['iface'] = iface
+                yield observation
+
+    def export_csv(self, stream, since=None, until=None):
+        """Write the observations to the stream as CSV."""
+
+        writer = csv.DictWriter(stream, SURVEY_FIELDS)
+        writer.writeheader()
+        for observation in self.observations(since, until):
+            writer.writerow(observation)
+
+    def export_jsonl(self, stream, since=None, until=None):
+        """Write the observations to the stream as JSON lines."""
+
+        for observation in self.observations(since, until):
+            stream.write(json.dumps(observation, sort_keys=True) + '\n')
+
+    def _get_index_stamp(self):
+
+        try:
+            st = os.stat(index_path(self._path))
+        except OSError:
+            return None
+
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def _load_index(self, size):
+
+        self._close_index()
+        self._index_stamp = self._get_index_stamp()
+        self._indexed = len(SURVEY_MAGIC)
+        self._ssids = []
+        self._scan_times = _Column()
+        self._scan_offsets = _Column()
+        self._index_bssids = ()
+        self._index_offsets = ()
+        self._bssids = {}
+        try:
+            f = open(index_path(self._path), 'rb')
+        except OSError:
+            return
+        try:
+            header = _read_index_header(f, size)
+            if header is None:
+                return
+            sections, ssids_start = _index_sections(header)
+            f.seek(ssids_start)
+            self._ssids = json.loads(f.read(header[3]).decode('utf-8'))
+            self._index_map = mmap.mmap(f.fileno(), 0,
+                                        access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            self._ssids = []
+            f.close()
+            return
+        self._index_file = f
+        times, scan_offsets, bssids, offsets = [
+            _MappedArray(self._index_map, start, count, fmt)
+            for fmt, start, count in sections]
+        self._scan_times = _Column(times)
+        self._scan_offsets = _Column(scan_offsets)
+        self._index_bssids = bssids
+        self._index_offsets = offsets
+        self._indexed = header[0]
+
+    def _close_index(self):
+
+        if self._index_map is not None:
+            self._index_map.close()
+            self._index_file.close()
+            self._index_map = None
+
+    def _offsets(self, bssid):
+
+        lower = bisect.bisect_left(self._index_bssids, bssid)
+        upper = bisect.bisect_right(self._index_bssids, bssid)
+
+        return _Column(self._index_offsets[lower:upper],
+                       self._bssids.get(bssid, []))
+
+    def _scan_range(self, since, until):
+
+        first = 0 if since is None else \
+            bisect.bisect_left(self._scan_times, since)
+        last = len(self._scan_times) if until is None else \
+            bisect.bisect_right(self._scan_times, until)
+
+        return first, max(first, last)
@@ -0,0 +1,924 @@
+#!/usr/bin/env python3
+# vim: set fileencoding=utf-8
+
+"""Simulate the control interface of wpa_supplicant for tests."""
+
+import heapq
+import logging
+import os
+import random
+import select
+import socket
+import threading
+import time
+
+from .analytics import freq_channel
+
+# Bytes of the reply buffer of wpa_supplicant.
+SIM_REPLY_SIZE = 4096
+# Seconds from SCAN to CTRL-EVENT-SCAN-RESULTS.
+SIM_SCAN_DELAY = 0.05
+# Seconds from SELECT_NETWORK to the end of the association.
+SIM_ASSOC_DELAY = 0.05
+# Level prefixed to the unsolicited events (MSG_INFO).
+SIM_EVENT_LEVEL = 3
+
+WPA_BSS_MASK_ID = 1 << 0
+WPA_BSS_MASK_BSSID = 1 << 1
+WPA_BSS_MASK_FREQ = 1 << 2
+WPA_BSS_MASK_BEACON_INT = 1 << 3
+WPA_BSS_MASK_CAPABILITIES = 1 << 4
+WPA_BSS_MASK_QUAL = 1 << 5
+WPA_BSS_MASK_NOISE = 1 << 6
+WPA_BSS_MASK_LEVEL = 1 << 7
+WPA_BSS_MASK_TSF = 1 << 8
+WPA_BSS_MASK_AGE = 1 << 9
+WPA_BSS_MASK_IE = 1 << 10
+WPA_BSS_MASK_FLAGS = 1 << 11
+WPA_BSS_MASK_SSID = 1 << 12
+WPA_BSS_MASK_DELIM = 1 << 17
+WPA_BSS_MASK_BEACON_IE = 1 << 23
+WPA_BSS_MASK_ALL = 0xFFFDFFFF
+
+# Indexed by the wpa_states enum.
+wpa_states = [
+    'DISCONNECTED',
+    'INTERFACE_DISABLED',
+    'INACTIVE',
+    'SCANNING',
+    'AUTHENTICATING',
+    'ASSOCIATING',
+    'ASSOCIATED',
+    '4WAY_HANDSHAKE',
+    'GROUP_HANDSHAKE',
+    'COMPLETED'
+]
+
+WPA_DISCONNECTED = 0
+WPA_INACTIVE = 2
+WPA_ASSOCIATING = 5
+WPA_COMPLETED = 9
+
+# Flags of the generated BSSes.
+sim_bss_flags = [
+    '[WPA2-PSK-CCMP][ESS]',
+    '[WPA2-PSK-CCMP][WPS][ESS]',
+    '[WPA-PSK-CCMP+TKIP][WPA2-PSK-CCMP+TKIP][ESS]',
+    '[WPA2-SAE-CCMP][ESS]',
+    '[WPA2-EAP-CCMP][ESS]',
+    '[ESS]',
+]
+
+# Channel center frequencies of the generated BSSes.
+sim_freqs = [2412, 2437, 2462, 5180, 5200, 5220, 5240, 5745, 5785, 5955, 6035]
+
+# Defaults of GET_NETWORK for the fields never set.
+network_defaults = {
+    'key_mgmt': 'WPA-PSK WPA-EAP',
+    'proto': 'WPA RSN',
+    'pairwise': 'CCMP TKIP',
+    'group': 'CCMP TKIP',
+    'disabled': '0',
+}
+
+
+def encode_ssid(ssid):
+    """Escape an SSID the way wpa_supplicant prints it."""
+
+    if isinstance(ssid, str):
+        ssid = ssid.encode('utf-8')
+
+    chars = []
+    for c in ssid:
+        if c == 0x22:
+            chars.append('\\"')
+        elif c == 0x5c:
+            chars.append('\\\\')
+        elif c == 0x1b:
+            chars.append('\\e')
+        elif c == 0x0a:
+            chars.append('\\n')
+        elif c == 0x0d:
+            chars.append('\\r')
+        elif c == 0x09:
+            chars.append('\\t')
+        elif 32 <= c <= 126:
+            chars.append(chr(c))
+        else:
+            chars.append('\\x{:02x}'.format(c))
+
+    return ''.join(chars)
+
+
+def _network_ssid(network):
+
+    ssid = network.get('ssid', '""')
+    if ssid.startswith('"'):
+        return ssid[1:-1]
+
+    try:
+        return bytes.fromhex(ssid).decode('utf-8', 'replace')
+    except ValueError:
+        return ssid
+
+
+class SimulatedBss:
+    """SimulatedBss is an entry of the scan results."""
+
+    __slots__ = ('id', 'bssid', 'ssid', 'freq', 'signal', 'flags', 'ie',
+                 'beacon_ie', 'tsf')
+
+    def __init__(self, bss_id, bssid, ssid, freq, signal, flags, ie=None,
+                 beacon_ie=None):
+
+        self.id = bss_id
+        self.bssid = bssid
+        self.ssid = ssid
+        self.freq = freq
+        self.signal = signal
+        self.flags = flags
+        self.ie = ie
+        self.beacon_ie = beacon_ie
+        self.tsf = 0
+
+    def ie_hex(self):
+        """Get the information elements of the probe response in hex."""
+
+        if self.ie is None:
+            ssid = self.ssid.encode('utf-8')
+            ie = bytearray([0, len(ssid)]) + ssid
+            # Supported rates and DS parameter set.
+            ie += bytes([1, 4, 0x82, 0x84, 0x8b, 0x96])
+            if self.freq < 5000:
+                ie += bytes([3, 1, freq_channel(self.freq)])
+            if 'WPA2-' in self.flags:
+                akm = 8 if 'SAE' in self.flags else \
+                    1 if 'EAP' in self.flags else 2
+                ie += bytes([48, 20, 1, 0, 0x00, 0x0f, 0xac, 4, 1, 0,
+                             0x00, 0x0f, 0xac, 4, 1, 0,
+                             0x00, 0x0f, 0xac, akm, 0, 0])
+            self.ie = ie.hex()
+
+        return self.ie
+
+
+class SimulatedInterface:
+    """SimulatedInterface keeps the state of one wifi interface."""
+
+    def __init__(self, name, address):
+
+        self.name = name
+        self.address = address
+        self.bsses = []
+        self.bss_index = {}
+        self.next_bss_id = 0
+        self.networks = {}
+        self.next_network_id = 0
+        self.state = WPA_DISCONNECTED
+        self.current = None
+        self.bssid = None
+        self.freq = None
+        self.scanning = False
+        self.pmksa = []
+        self.monitors = set()
+        # Bumped to cancel a pending association.
+        self.generation = 0
+
+
+class WpaSupplicantSimulator:
+    """WpaSupplicantSimulator serves the control sockets of interfaces."""
+
+    """
+    Each interface gets a datagram socket in ctrl_dir, and the global
+    control interface is served as well if its path is given. All the
+    sockets are served by one thread, which also runs the delayed replies
+    and the steps of the scans and the associations from a timer heap.
+    """
+
+    def __init__(self, ctrl_dir, ifaces=('wlan0',), global_ctrl_iface=None,
+                 reply_size=SIM_REPLY_SIZE, scan_delay=SIM_SCAN_DELAY,
+                 assoc_delay=SIM_ASSOC_DELAY):
+
+        self.ctrl_dir = ctrl_dir
+        self.global_ctrl_iface = global_ctrl_iface
+        self.reply_size = reply_size
+        self.scan_delay = scan_delay
+        self.assoc_delay = assoc_delay
+        self.command_counts = {}
+        self._ifaces = {}
+        for i, name in enumerate(ifaces):
+            self._ifaces[name] = SimulatedInterface(
+                name, '02:00:00:00:{:02x}:{:02x}'.format(i >> 8, i & 0xff))
+        self._global_monitors = set()
+        self._latency = {}
+        self._busy = {}
+        self._rejects = {}
+        self._socks = {}
+        self._timers = []
+        self._timer_seq = 0
+        self._lock = threading.RLock()
+        self._thread = None
+        self._running = False
+        self._wakeup = None
+        self._logger = logging.getLogger('pywifi')
+
+    def __enter__(self):
+
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+
+        self.stop()
+
+    def start(self):
+        """Bind the control sockets and start serving them."""
+
+        os.makedirs(self.ctrl_dir, exist_ok=True)
+        self._bind_socks()
+        self._wakeup = socket.socketpair()
+        self._running = True
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+
+        return self
+
+    def stop(self):
+        """Stop serving and remove the control sockets."""
+
+        if not self._running:
+            return
+
+        self._running = False
+        self._wakeup[1].send(b'\0')
+        self._thread.join()
+        self._wakeup[0].close()
+        self._wakeup[1].close()
+        self._close_socks()
+
+    def restart(self):
+        """Recreate the control sockets, dropping the attached monitors."""
+
+        with self._lock:
+            self._close_socks()
+            self._global_monitors.clear()
+            for iface in self._ifaces.values():
+                iface.monitors.clear()
+            self._bind_socks()
+        self._wakeup[1].send(b'\0')
+
+    def iface(self, name):
+        """Get the simulated state of an interface."""
+
+        return self._ifaces[name]
+
+    def add_bss(self, bssid, ssid, freq, signal, flags='[ESS]', ie=None,
+                beacon_ie=None, iface=None):
+        """Add a BSS to the scan results of the interfaces."""
+
+        with self._lock:
+            for sim_iface in self._target_ifaces(iface):
+                bss = sim_iface.bss_index.get(bssid)
+                if bss is not None:
+                    sim_iface.bsses.remove(bss)
+                bss = SimulatedBss(sim_iface.next_bss_id, bssid, ssid, freq,
+                                   signal, flags, ie, beacon_ie)
+                sim_iface.next_bss_id += 1
+                sim_iface.bsses.append(bss)
+                sim_iface.bss_index[bssid] = bss
+
+    def remove_bss(self, bssid, iface=None):
+        """Remove a BSS from the scan results of the interfaces."""
+
+        with self._lock:
+            for sim_iface in self._target_ifaces(iface):
+                bss = sim_iface.bss_index.pop(bssid, None)
+                if bss is not None:
+                    sim_iface.bsses.remove(bss)
+
+    def clear_bsses(self, iface=None):
+        """Empty the scan results of the interfaces."""
+
+        with self._lock:
+            for sim_iface in self._target_ifaces(iface):
+                sim_iface.bsses = []
+                sim_iface.bss_index = {}
+
+    def populate(self, count, ssids=None, seed=0, iface=None):
+        """Add count generated BSSes spread over the SSIDs."""
+
+        rng = random.Random(seed)
+        if ssids is None:
+            ssids = ['sim-{}'.format(i) for i in range(max(count // 4, 1))]
+
+        with self._lock:
+            for i in range(count):
+                ssid = ssids[i % len(ssids)]
+                bssid = '02:{:02x}:{:02x}:{:02x}:{:02x}:{:02x}'.format(
+                    (i >> 32) & 0xff, (i >> 24) & 0xff, (i >> 16) & 0xff,
+                    (i >> 8) & 0xff, i & 0xff)
+                self.add_bss(bssid, ssid, rng.choice(sim_freqs),
+                             rng.randint(-95, -30), rng.choice(sim_bss_flags),
+                             iface=iface)
+
+    def set_latency(self, seconds, command=None):
+        """Delay the replies to a command type, or to all commands."""
+
+        with self._lock:
+            if seconds:
+                self._latency[command] = seconds
+            else:
+                self._latency.pop(command, None)
+
+    def inject_busy(self, count=1, command=None):
+        """Answer the next count commands of a type with FAIL-BUSY."""
+
+        with self._lock:
+            self._busy[command] = self._busy.get(command, 0) + count
+
+    def reject(self, ssid, event='CTRL-EVENT-ASSOC-REJECT status_code=1'):
+        """Fail the associations to the SSID with the event."""
+
+        with self._lock:
+            if event is None:
+                self._rejects.pop(ssid, None)
+            else:
+                self._rejects[ssid] = event
+
+    def send_event(self, iface, event, level=SIM_EVENT_LEVEL):
+        """Send an unsolicited event of the interface to its monitors."""
+
+        with self._lock:
+            self._send_event(self._ifaces[iface], event, level)
+
+    def reply(self, iface, cmd):
+        """Get the reply to a command of the interface without sockets."""
+
+        with self._lock:
+            return self._handle_iface(self._ifaces[iface], cmd, None)
+
+    def _target_ifaces(self, iface):
+
+        if iface is None:
+            return list(self._ifaces.values())
+
+        return [self._ifaces[iface]]
+
+    def _bind_socks(self):
+
+        paths = [(name, os.path.join(self.ctrl_dir, name))
+                 for name in self._ifaces]
+        if self.global_ctrl_iface:
+            paths.append((None, self.global_ctrl_iface))
+
+        for name, path in paths:
+            if os.path.exists(path):
+                os.remove(path)
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            sock.bind(path)
+            sock.setblocking(False)
+            self._socks[sock] = (name, path)
+
+    def _close_socks(self):
+
+        for sock, (_, path) in self._socks.items():
+            sock.close()
+            if os.path.exists(path):
+                os.remove(path)
+        self._socks = {}
+
+    def _schedule(self, delay, func, *args):
+
+        self._timer_seq += 1
+        heapq.heappush(self._timers,
+                       (time.monotonic() + delay, self._timer_seq, func, args))
+        if threading.current_thread() is not self._thread and self._wakeup:
+            self._wakeup[1].send(b'\0')
+
+    def _serve(self):
+
+        while self._running:
+            with self._lock:
+                socks = list(self._socks)
+                timeout = None
+                if self._timers:
+                    timeout = max(self._timers[0][0] - time.monotonic(), 0)
+
+            try:
+                readable = select.select(
+                    socks + [self._wakeup[0]], [], [], timeout)[0]
+            except (OSError, ValueError):
+                # A socket has been closed by restart().
+                continue
+
+            with self._lock:
+                for sock in readable:
+                    if sock is self._wakeup[0]:
+                        sock.recv(4096)
+                    elif sock in self._socks:
+                        self._receive(sock)
+
+                now = time.monotonic()
+                while self._timers and self._timers[0][0] <= now:
+                    _, _, func, args = heapq.heappop(self._timers)
+                    func(*args)
+
+    def _receive(self, sock):
+
+        while True:
+            try:
+                data, addr = sock.recvfrom(65536)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                return
+
+            reply = self._handle(sock, data.decode('utf-8', 'replace'), addr)
+            if not addr or reply is None:
+                continue
+
+            name = data.split(b' ', 1)[0].decode('utf-8', 'replace')
+            latency = self._latency.get(name, self._latency.get(None))
+            if latency:
+                self._schedule(latency, self._reply, sock, reply, addr)
+            else:
+                self._reply(sock, reply, addr)
+
+    def _reply(self, sock, reply, addr):
+
+        try:
+            sock.sendto(reply.encode('utf-8'), addr)
+        except OSError:
+            # The client has gone away.
+            pass
+
+    def _handle(self, sock, cmd, addr):
+
+        name = self._socks[sock][0]
+        if name is None:
+            if not cmd.startswith('IFNAME='):
+                return self._handle_global(cmd, addr)
+            name, _, cmd = cmd[len('IFNAME='):].partition(' ')
+            if name not in self._ifaces:
+                return 'FAIL\n'
+
+        return self._handle_iface(self._ifaces[name], cmd, addr)
+
+    def _handle_iface(self, iface, cmd, addr):
+
+        command = cmd.split(' ', 1)[0]
+        self.command_counts[command] = self.command_counts.get(command, 0) + 1
+
+        for key in (command, None):
+            if self._busy.get(key) and command not in ('PING', 'ATTACH',
+                                                       'DETACH'):
+                self._busy[key] -= 1
+                return 'FAIL-BUSY\n'
+
+        handler = getattr(self, '_cmd_' + command.lower(), None)
+        if handler is None:
+            return 'UNKNOWN COMMAND\n'
+
+        return handler(iface, cmd[len(command) + 1:], addr)
+
+    def _handle_global(self, cmd, addr):
+
+        command = cmd.split(' ', 1)[0]
+        self.command_counts[command] = self.command_counts.get(command, 0) + 1
+
+        if command == 'PING':
+            return 'PONG\n'
+        elif command == 'INTERFACES':
+            return ''.join(name + '\n' for name in self._ifaces)
+        elif command == 'ATTACH':
+            self._global_monitors.add(addr)
+            return 'OK\n'
+        elif command == 'DETACH':
+            if addr not in self._global_monitors:
+                return 'FAIL\n'
+            self._global_monitors.discard(addr)
+            return 'OK\n'
+
+        return 'UNKNOWN COMMAND\n'
+
+    def _send_event(self, iface, event, level=SIM_EVENT_LEVEL):
+
+        msg = '<{}>{}'.format(level, event)
+        for sock, (name, _) in list(self._socks.items()):
+            if name == iface.name:
+                self._send_to_monitors(sock, iface.monitors, msg)
+            elif name is None:
+                self._send_to_monitors(
+                    sock, self._global_monitors,
+                    'IFNAME={} {}'.format(iface.name, msg))
+
+    def _send_to_monitors(self, sock, monitors, msg):
+
+        for addr in list(monitors):
+            try:
+                sock.sendto(msg.encode('utf-8'), addr)
+            except OSError:
+                # wpa_supplicant drops the monitors it can't reach.
+                monitors.discard(addr)
+
+    def _set_state(self, iface, state):
+
+        if iface.state == state:
+            return
+
+        iface.state = state
+        event = 'CTRL-EVENT-STATE-CHANGE id={} state={}'.format(
+            -1 if iface.current is None else iface.current, state)
+        if iface.bssid is not None:
+            event += ' BSSID={}'.format(iface.bssid)
+        self._send_event(iface, event)
+
+    def _disconnect(self, iface, reason=3):
+
+        iface.generation += 1
+        if iface.state == WPA_COMPLETED:
+            self._send_event(
+                iface,
+                'CTRL-EVENT-DISCONNECTED bssid={} reason={} '
+                'locally_generated=1'.format(iface.bssid, reason))
+        iface.bssid = None
+        iface.freq = None
+        self._set_state(iface, WPA_DISCONNECTED)
+
+    def _associate(self, iface, network_id, freq=None, bssid=None):
+
+        if bssid is None:
+            self._disconnect(iface)
+        else:
+            # Roaming keeps the association until the new one completes.
+            iface.generation += 1
+        iface.current = network_id
+        network = iface.networks[network_id]
+        ssid = _network_ssid(network)
+
+        if bssid is None:
+            hint = network.get('bssid_hint', network.get('bssid'))
+            candidates = [b for b in iface.bsses if b.ssid == ssid]
+            preferred = [b for b in candidates
+                         if b.bssid == hint or b.freq == freq]
+            candidates = preferred or candidates
+            bss = max(candidates, key=lambda b: b.signal) \
+                if candidates else None
+        else:
+            bss = iface.bss_index.get(bssid)
+
+        if bssid is None:
+            self._set_state(iface, WPA_ASSOCIATING)
+        self._schedule(self.assoc_delay, self._complete_association,
+                       iface, iface.generation, network_id, ssid, bss)
+
+    def _complete_association(self, iface, generation, network_id, ssid, bss):
+
+        if iface.generation != generation:
+            return
+
+        if bss is None:
+            self._send_event(iface, 'CTRL-EVENT-NETWORK-NOT-FOUND')
+            self._set_state(iface, WPA_DISCONNECTED)
+            return
+
+        if ssid in self._rejects:
+            self._send_event(iface, '{} bssid={}'.format(
+                self._rejects[ssid], bss.bssid))
+            self._set_state(iface, WPA_DISCONNECTED)
+            return
+
+        iface.bssid = bss.bssid
+        iface.freq = bss.freq
+        key_mgmt = iface.networks[network_id].get(
+            'key_mgmt', network_defaults['key_mgmt'])
+        if 'SAE' in key_mgmt or 'EAP' in key_mgmt:
+            iface.pmksa = [e for e in iface.pmksa if e['bssid'] != bss.bssid]
+            iface.pmksa.append({
+                'bssid': bss.bssid,
+                'pmkid': os.urandom(16).hex(),
+                'expiration': 43200,
+                'opportunistic': 0
+            })
+        self._set_state(iface, WPA_COMPLETED)
+        self._send_event(
+            iface,
+            'CTRL-EVENT-CONNECTED - Connection to {} completed '
+            '[id={} id_str=]'.format(bss.bssid, network_id))
+
+    def _complete_scan(self, iface):
+
+        iface.scanning = False
+        self._send_event(iface, 'CTRL-EVENT-SCAN-RESULTS ')
+
+    def _network(self, iface, arg):
+
+        try:
+            return iface.networks.get(int(arg))
+        except ValueError:
+            return None
+
+    def _cmd_ping(self, iface, args, addr):
+
+        return 'PONG\n'
+
+    def _cmd_attach(self, iface, args, addr):
+
+        iface.monitors.add(addr)
+
+        return 'OK\n'
+
+    def _cmd_detach(self, iface, args, addr):
+
+        if addr not in iface.monitors:
+            return 'FAIL\n'
+        iface.monitors.discard(addr)
+
+        return 'OK\n'
+
+    def _cmd_level(self, iface, args, addr):
+
+        return 'OK\n'
+
+    def _cmd_status(self, iface, args, addr):
+
+        lines = []
+        if iface.state == WPA_COMPLETED:
+            network = iface.networks[iface.current]
+            ssid = _network_ssid(network)
+            lines.append('bssid={}'.format(iface.bssid))
+            lines.append('freq={}'.format(iface.freq))
+            lines.append('ssid={}'.format(encode_ssid(ssid)))
+            lines.append('id={}'.format(iface.current))
+            lines.append('mode=station')
+            lines.append('pairwise_cipher=CCMP')
+            lines.append('group_cipher=CCMP')
+            lines.append('key_mgmt={}'.format(
+                network.get('key_mgmt', 'NONE').split(' ')[0]))
+        lines.append('wpa_state={}'.format(wpa_states[iface.state]))
+        lines.append('address={}'.format(iface.address))
+
+        return '\n'.join(lines) + '\n'
+
+    def _cmd_scan(self, iface, args, addr):
+
+        if iface.scanning:
+            return 'FAIL-BUSY\n'
+
+        iface.scanning = True
+        self._send_event(iface, 'CTRL-EVENT-SCAN-STARTED ')
+        self._schedule(self.scan_delay, self._complete_scan, iface)
+
+        return 'OK\n'
+
+    def _cmd_scan_results(self, iface, args, addr):
+
+        # wpa_supplicant leaves out the entries not fitting in the reply.
+        reply = ['bssid / frequency / signal level / flags / ssid\n']
+        size = len(reply[0])
+        for bss in iface.bsses:
+            line = '{}\t{}\t{}\t{}\t{}\n'.format(
+                bss.bssid, bss.freq, bss.signal, bss.flags,
+                encode_ssid(bss.ssid))
+            size += len(line)
+            if size >= self.reply_size:
+                break
+            reply.append(line)
+
+        return ''.join(reply)
+
+    def _cmd_bss(self, iface, args, addr):
+
+        args = args.split(' ')
+        mask = WPA_BSS_MASK_ALL
+        for arg in args[1:]:
+            if arg.startswith('MASK='):
+                mask = int(arg[len('MASK='):], 16)
+
+        target = args[0]
+        if target.startswith('RANGE='):
+            first, sep, last = target[len('RANGE='):].partition('-')
+            if first == 'ALL':
+                bsses = iface.bsses
+            else:
+                first = int(first) if first else 0
+                last = int(last) if sep and last else \
+                    first if not sep else float('inf')
+                bsses = [b for b in iface.bsses if first <= b.id <= last]
+        elif target == 'FIRST':
+            bsses = iface.bsses[:1]
+        elif target.startswith('NEXT-'):
+            bss_id = int(target[len('NEXT-'):])
+            bsses = [b for b in iface.bsses if b.id > bss_id][:1]
+        elif ':' in target:
+            bsses = [iface.bss_index[target]] \
+                if target in iface.bss_index else []
+        else:
+            bss_id = int(target) if target.isdigit() else -1
+            bsses = [b for b in iface.bsses if b.id == bss_id]
+
+        reply = []
+        size = 0
+        for bss in bsses:
+            entry = self._format_bss(bss, mask)
+            size += len(entry)
+            if size >= self.reply_size:
+                break
+            reply.append(entry)
+
+        return ''.join(reply)
+
+    def _format_bss(self, bss, mask):
+
+        fields = []
+        if mask & WPA_BSS_MASK_ID:
+            fields.append('id={}'.format(bss.id))
+        if mask & WPA_BSS_MASK_BSSID:
+            fields.append('bssid={}'.format(bss.bssid))
+        if mask & WPA_BSS_MASK_FREQ:
+            fields.append('freq={}'.format(bss.freq))
+        if mask & WPA_BSS_MASK_BEACON_INT:
+            fields.append('beacon_int=100')
+        if mask & WPA_BSS_MASK_CAPABILITIES:
+            fields.append('capabilities=0x{:04x}'.format(
+                0x0411 if bss.flags != '[ESS]' else 0x0401))
+        if mask & WPA_BSS_MASK_QUAL:
+            fields.append('qual=0')
+        if mask & WPA_BSS_MASK_NOISE:
+            fields.append('noise=-89')
+        if mask & WPA_BSS_MASK_LEVEL:
+            fields.append('level={}'.format(bss.signal))
+        if mask & WPA_BSS_MASK_TSF:
+            fields.append('tsf={:016d}'.format(bss.tsf))
+        if mask & WPA_BSS_MASK_AGE:
+            fields.append('age=0')
+        if mask & WPA_BSS_MASK_IE:
+            fields.append('ie={}'.format(bss.ie_hex()))
+        if mask & WPA_BSS_MASK_FLAGS:
+            fields.append('flags={}'.format(bss.flags))
+        if mask & WPA_BSS_MASK_SSID:
+            fields.append('ssid={}'.format(encode_ssid(bss.ssid)))
+        if mask & WPA_BSS_MASK_BEACON_IE and bss.beacon_ie is not None:
+            fields.append('beacon_ie={}'.format(bss.beacon_ie))
+        if mask & WPA_BSS_MASK_DELIM:
+            fields.append('====')
+
+        return '\n'.join(fields) + '\n'
+
+    def _cmd_list_networks(self, iface, args, addr):
+
+        reply = ['network id / ssid / bssid / flags\n']
+        for network_id in sorted(iface.networks):
+            network = iface.networks[network_id]
+            flags = ''
+            if network_id == iface.current and iface.state == WPA_COMPLETED:
+                flags = '[CURRENT]'
+            elif network.get('disabled') == '1':
+                flags = '[DISABLED]'
+            reply.append('{}\t{}\t{}\t{}\n'.format(
+                network_id, _network_ssid(network),
+                network.get('bssid', 'any'), flags))
+
+        return ''.join(reply)
+
+    def _cmd_add_network(self, iface, args, addr):
+
+        network_id = iface.next_network_id
+        iface.next_network_id += 1
+        iface.networks[network_id] = {'disabled': '1'}
+
+        return '{}\n'.format(network_id)
+
+    def _cmd_set_network(self, iface, args, addr):
+
+        args = args.split(' ', 2)
+        network = self._network(iface, args[0])
+        if network is None or len(args) < 3:
+            return 'FAIL\n'
+        network[args[1]] = args[2]
+
+        return 'OK\n'
+
+    def _cmd_get_network(self, iface, args, addr):
+
+        args = args.split(' ')
+        network = self._network(iface, args[0])
+        if network is None or len(args) < 2:
+            return 'FAIL\n'
+
+        field = args[1]
+        if field in ('psk', 'password', 'sae_password'):
+            return '*' if field in network else 'FAIL\n'
+        if field in network:
+            return network[field]
+
+        return network_defaults.get(field, 'FAIL\n')
+
+    def _cmd_remove_network(self, iface, args, addr):
+
+        if args == 'all':
+            ids = list(iface.networks)
+        elif self._network(iface, args) is not None:
+            ids = [int(args)]
+        else:
+            return 'FAIL\n'
+
+        for network_id in ids:
+            if network_id == iface.current:
+                self._disconnect(iface)
+                iface.current = None
+            del iface.networks[network_id]
+
+        return 'OK\n'
+
+    def _cmd_select_network(self, iface, args, addr):
+
+        args = args.split(' ')
+        network = self._network(iface, args[0])
+        if network is None:
+            return 'FAIL\n'
+
+        freq = None
+        for arg in args[1:]:
+            if arg.startswith('freq='):
+                freq = int(arg[len('freq='):].split(',')[0])
+
+        network_id = int(args[0])
+        for other_id, other in iface.networks.items():
+            other['disabled'] = '0' if other_id == network_id else '1'
+        self._associate(iface, network_id, freq)
+
+        return 'OK\n'
+
+    def _cmd_enable_network(self, iface, args, addr):
+
+        return self._set_disabled(iface, args, '0')
+
+    def _cmd_disable_network(self, iface, args, addr):
+
+        return self._set_disabled(iface, args, '1')
+
+    def _set_disabled(self, iface, args, disabled):
+
+        if args == 'all':
+            networks = list(iface.networks.values())
+        else:
+            network = self._network(iface, args)
+            if network is None:
+                return 'FAIL\n'
+            networks = [network]
+
+        for network in networks:
+            network['disabled'] = disabled
+
+        return 'OK\n'
+
+    def _cmd_disconnect(self, iface, args, addr):
+
+        self._disconnect(iface)
+
+        return 'OK\n'
+
+    def _cmd_reconnect(self, iface, args, addr):
+
+        if iface.state == WPA_DISCONNECTED and iface.current in iface.networks:
+            self._associate(iface, iface.current)
+
+        return 'OK\n'
+
+    def _cmd_reassociate(self, iface, args, addr):
+
+        if iface.current not in iface.networks:
+            return 'FAIL\n'
+        self._associate(iface, iface.current)
+
+        return 'OK\n'
+
+    def _cmd_roam(self, iface, args, addr):
+
+        bss = iface.bss_index.get(args)
+        if iface.state != WPA_COMPLETED or bss is None:
+            return 'FAIL\n'
+
+        network = iface.networks[iface.current]
+        if bss.ssid != _network_ssid(network):
+            return 'FAIL\n'
+        self._associate(iface, iface.current, bssid=bss.bssid)
+
+        return 'OK\n'
+
+    def _cmd_pmksa(self, iface, args, addr):
+
+        reply = ['Index / AA / PMKID / expiration (in seconds) / '
+                 'opportunistic\n']
+        for i, entry in enumerate(iface.pmksa):
+            reply.append('{} {} {} {} {}\n'.format(
+                i, entry['bssid'], entry['pmkid'], entry['expiration'],
+                entry['opportunistic']))
+
+        return ''.join(reply)
+
+    def _cmd_pmksa_flush(self, iface, args, addr):
+
+        iface.pmksa = []
+
+        return 'OK\n'
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+# vim: set fileencoding=utf-8
+
+"""Report the operations and commands as nested spans to a tracer.
+
+No tracer is set by default, and then each traced call only checks for
+the tracer. The global tracer receives the spans of every PyWiFi, unless
+the backend of a PyWiFi has a tracer of its own.
+"""
+
+import functools
+import threading
+import time
+
+tracer = None
+
+_local = threading.local()
+
+
+class Span:
+    """Span is a timed operation within its parent span."""
+
+    __slots__ = ('name', 'attributes', 'parent', 'start', 'end', 'error',
+                 'tracer')
+
+    def __init__(self, name, attributes, parent, tracer=None):
+
+        self.name = name
+        self.attributes = attributes
+        self.parent = parent
+        self.tracer = tracer
+        self.start = time.monotonic()
+        self.end = None
+        self.error = None
+
+    def duration(self):
+        """Get the seconds the span took, or None if it is running."""
+
+        if self.end is None:
+            return None
+
+        return self.end - self.start
+
+    def __repr__(self):
+
+        return 'Span({!r}, {!r})'.format(self.name, self.attributes)
+
+
+class Tracer:
+    """Tracer receives the start and the end of every span."""
+
+    def span_started(self, span):
+        """Called when a span starts."""
+
+        pass
+
+    def span_ended(self, span):
+        """Called when a span ends."""
+
+        pass
+
+
+class RecordingTracer(Tracer):
+    """RecordingTracer keeps the ended spans in order of their end."""
+
+    spans = []
+
+    def __init__(self):
+
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def span_ended(self, span):
+
+        with self._lock:
+            self.spans.append(span)
+
+    def children(self, span):
+        """Get the recorded spans whose parent is the span."""
+
+        return [s for s in self.spans if s.parent is span]
+
+
+def set_tracer(new_tracer):
+    """Set the tracer receiving the spans, or None to stop tracing."""
+
+    global tracer
+    tracer = new_tracer
+
+
+def get_tracer(owner=None):
+    """Get the tracer of the owner, or the global tracer if it has none."""
+
+    owner_tracer = getattr(owner, 'tracer', None)
+    if owner_tracer is not None:
+        return owner_tracer
+
+    return tracer
+
+
+def start_span(name, owner=None, **attributes):
+    """Start a span within the current span of this thread.
+
+    The span goes to the tracer of the owner, see get_tracer(). Return
+    None if there is no tracer.
+    """
+
+    current_tracer = get_tracer(owner)
+    if current_tracer is None:
+        return None
+
+    span = Span(name, attributes, getattr(_local, 'span', None),
+                current_tracer)
+    _local.span = span
+    current_tracer.span_started(span)
+
+    return span
+
+
+def end_span(span, error=None, **attributes):
+    """End the span with extra attributes."""
+
+    if span is None:
+        return
+
+    span.end = time.monotonic()
+    span.error = error
+    span.attributes.update(attributes)
+    _local.span = span.parent
+    span.tracer.span_ended(span)
+
+
+def traced(name, attributes=None):
+    """Decorate a function to be traced as the named span.
+
+    attributes is called with the arguments of the function to get the
+    attributes of the span. The first argument, the instance of a method,
+    is the owner of the span.
+    """
+
+    def decorator(func):
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+
+            owner = args[0] if args else None
+            if get_tracer(owner) is None:
+                return func(*args, **kwargs)
+
+            span = start_span(
+                name, owner,
+                **(attributes(*args, **kwargs) if attributes else {}))
+            error = None
+            try:
+                return func(*args, **kwargs)
+            except Exception as err:
+                error = err
+                raise
+            finally:
+                end_span(span, error)
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# vim: set fileencoding=utf-8
+
+"""Store the traffic with wpa_supplicant in a compact binary file."""
+
+import struct
+import threading
+import time
+
+from .flightrecorder import redact
+
+TRAFFIC_MAGIC = b'PWTR\x01'
+
+RECORD_EXCHANGE = 1
+RECORD_EVENT = 2
+RECORD_INTERFACES = 3
+
+# Kind, seconds since the start, duration and the lengths of the iface
+# name and of the two payloads.
+_record_header = struct.Struct('<BddHII')
+
+
+class TrafficRecorder:
+    """TrafficRecorder appends the traffic to a file in a binary format."""
+
+    """
+    Each record is a fixed header followed by the iface name and two
+    payloads: the command and the raw reply of an exchange, the event, or
+    the newline separated names of the interfaces.
+    """
+    _file = None
+
+    def __init__(self, path):
+
+        self._file = open(path, 'wb')
+        self._file.write(TRAFFIC_MAGIC)
+        self._start = time.monotonic()
+        self._lock = threading.Lock()
+
+    def record_exchange(self, iface, cmd, reply, started, ended):
+        """Record a command and its reply."""
+
+        if cmd.startswith('SET_NETWORK'):
+            cmd = redact(cmd)
+        self._write(RECORD_EXCHANGE, started - self._start, ended - started,
+                    iface, cmd.encode('utf-8'), reply)
+
+    def record_event(self, iface, event):
+        """Record an event of the interface."""
+
+        self._write(RECORD_EVENT, time.monotonic() - self._start, 0,
+                    iface, event.encode('utf-8'), b'')
+
+    def record_interfaces(self, names):
+        """Record the names of the discovered interfaces."""
+
+        self._write(RECORD_INTERFACES, time.monotonic() - self._start, 0,
+                    '', '\n'.join(names).encode('utf-8'), b'')
+
+    def close(self):
+        """Flush and close the file."""
+
+        with self._lock:
+            self._file.close()
+
+    def _write(self, kind, at, duration, iface, first, second):
+
+        iface = iface.encode('utf-8')
+        with self._lock:
+            if self._file.closed:
+                return
+            self._file.write(_record_header.pack(
+                kind, at, duration, len(iface), len(first), len(second)))
+            self._file.write(iface)
+            self._file.write(first)
+            self._file.write(second)
+
+
+def read_traffic(path):
+    """Iterate the (kind, at, duration, iface, first, second) records."""
+
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    if not data.startswith(TRAFFIC_MAGIC):
+        raise ValueError("'{}' is not a traffic recording".format(path))
+
+    view = memoryview(data)
+    pos = len(TRAFFIC_MAGIC)
+    while pos + _record_header.size <= len(data):
+        kind, at, duration, iface_len, first_len, second_len = \
+            _record_header.unpack_from(data, pos)
+        pos += _record_header.size
+        iface = bytes(view[pos:pos + iface_len]).decode('utf-8')
+        pos += iface_len
+        first = bytes(view[pos:pos + first_len])
+        pos += first_len
+        second = bytes(view[pos:pos + second_len])
+        pos += second_len
+        yield kind, at, duration, iface, first, second
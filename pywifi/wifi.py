@@ -9,42 +9,149 @@ folder (e.g. linux, win, and osx). So, PyWiFi class is just the
 entry point to manipulate wifi devices.
 """
 
-import platform
 import logging
+import threading
 
-from .iface import Interface
-
-
-if platform.system().lower() == 'windows':
-    from . import _wifiutil_win as wifiutil
-elif platform.system().lower() == 'linux':
-    from . import _wifiutil_linux as wifiutil
-else:
-    raise NotImplementedError
+from . import _backend
+from .iface import Interface, rank_profiles, CONNECT_TIMEOUT
 
 
 class PyWiFi:
     """PyWiFi provides operations to manipulate wifi devices."""
 
+    """
+    PyWiFi owns the connections to the platform, which are shared by the
+    interfaces it returns. Use it as a context manager, or call close(),
+    to release them.
+    """
+
     _ifaces = []
+    _wifi_ctrl = None
     _logger = None
 
-    def __init__(self):
-        
+    def __init__(self, wifi_ctrl=None):
+
+        self._ifaces = []
+        if wifi_ctrl is None:
+            wifi_ctrl = _backend.wifiutil().WifiUtil()
+        self._wifi_ctrl = wifi_ctrl
         self._logger = logging.getLogger('pywifi')
 
-    def interfaces(self):
-        """Collect the available wlan interfaces."""
+    def __enter__(self):
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+
+        self.close()
+
+    def close(self):
+        """Close the connections of all the interfaces."""
+
+        self._ifaces = []
+        self._wifi_ctrl.close()
+
+    def set_tracer(self, tracer):
+        """Set the tracer of the spans of this PyWiFi.
+
+        None sends them to the global tracer again.
+        """
+
+        self._wifi_ctrl.tracer = tracer
+
+    def start_recording(self, path):
+        """Record the traffic of all the interfaces to a file.
+
+        Only supported on Linux, NotImplementedError is raised on Windows.
+        """
 
+        self._wifi_ctrl.start_recording(path)
+
+    def stop_recording(self):
+        """Stop recording the traffic."""
+
+        self._wifi_ctrl.stop_recording()
+
+    def interfaces(self, refresh=False):
+        """Collect the available wlan interfaces.
+
+        The interfaces are cached and only discovered again when the
+        platform reports a change, or when refresh is set.
+        """
+
+        known = dict((iface.name(), iface) for iface in self._ifaces)
         self._ifaces = []
-        wifi_ctrl = wifiutil.WifiUtil()
 
-        for interface in wifi_ctrl.interfaces():
-            iface = Interface(interface)
+        for interface in self._wifi_ctrl.interfaces(refresh):
+            iface = known.get(interface['name'])
+            if iface is None:
+                iface = Interface(interface, self._wifi_ctrl)
+                self._logger.info("Get interface: %s", iface.name())
             self._ifaces.append(iface)
-            self._logger.info("Get interface: %s", iface.name())
 
         if not self._ifaces:
             self._logger.error("Can't get wifi interface")
 
         return self._ifaces
+
+    def connect_any(self, profiles, per_attempt_timeout=CONNECT_TIMEOUT,
+                    ifaces=None):
+        """Try the profiles on all the interfaces in parallel.
+
+        Return the interface and the profile of the first connection,
+        or None for both, and the attempts made.
+        """
+
+        if ifaces is None:
+            ifaces = self._ifaces or self.interfaces()
+
+        bsses = []
+        for iface in ifaces:
+            bsses.extend(iface.scan_results())
+        candidates = rank_profiles(profiles, bsses)
+
+        lock = threading.Lock()
+        connected = threading.Event()
+        attempts = []
+        winner = []
+        errors = []
+
+        def worker(iface):
+            while not connected.is_set():
+                with lock:
+                    if not candidates:
+                        return
+                    profile = candidates.pop(0)
+
+                try:
+                    succeeded = iface.attempt_connect(
+                        profile, per_attempt_timeout, attempts, connected)
+                except Exception as err:
+                    self._logger.error(
+                        "iface '%s' connecting to AP '%s': %s",
+                        iface.name(), profile.ssid, err)
+                    with lock:
+                        errors.append(err)
+                    continue
+
+                if succeeded:
+                    with lock:
+                        if not winner:
+                            winner.append((iface, profile))
+                    connected.set()
+
+        threads = [threading.Thread(target=worker, args=(iface,))
+                   for iface in ifaces]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        if not winner:
+            # The failure of an attempt is raised once every thread is done.
+            if errors:
+                raise errors[0]
+            self._logger.error("Can't connect to any of the profiles")
+            return None, None, attempts
+
+        return winner[0][0], winner[0][1], attempts
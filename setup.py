@@ -38,7 +38,7 @@ setup(
     long_description_content_type="text/markdown",
     packages=find_packages(),
     install_requires=requires,
-    python_requires=">=2.7, !=3.0.*, !=3.1.*, !=3.2.*, !=3.3.*",
+    python_requires=">=3.6",
     url='https://github.com/awkman/pywifi', 
     license='MIT',
     download_url='https://github.com/awkman/pywifi/archive/master.zip', 
@@ -46,11 +46,14 @@ setup(
         'Intended Audience :: Developers',
         'Topic :: Utilities',
         'License :: OSI Approved :: MIT License',
-        'Programming Language :: Python :: 2.7',
-        'Programming Language :: Python :: 3.4',
-        'Programming Language :: Python :: 3.5',
+        'Programming Language :: Python :: 3',
+        'Programming Language :: Python :: 3 :: Only',
         'Programming Language :: Python :: 3.6',
         'Programming Language :: Python :: 3.7',
+        'Programming Language :: Python :: 3.8',
+        'Programming Language :: Python :: 3.9',
+        'Programming Language :: Python :: 3.10',
+        'Programming Language :: Python :: 3.11',
     ],
     keywords=['wifi', 'wireless', 'Linux', 'Windows'], 
 )
@@ -13,178 +13,69 @@ import logging
 
 # For mocking
 import os
-import stat
 import socket
+import threading
+import io
+import json
+import math
+import subprocess
 
 import pywifi
 from pywifi import const
+from pywifi import fingerprint
+from pywifi import _wifiutil_linux
+from pywifi import analytics
+from pywifi import interning
+from pywifi import metrics
+from pywifi import rules
+from pywifi import tracing
+from pywifi.fingerprint import FingerprintDB
+from pywifi.ie import InformationElements
+from pywifi.iface import Interface
+from pywifi.roaming import RoamingEngine
+from pywifi.rules import RuleEngine
+from pywifi.survey import SurveyLog, SurveyRecorder
+from pywifi.replay import ReplayWifiUtil
+from pywifi.testing import WpaSupplicantSimulator
 
 pywifi.set_loglevel(logging.INFO)
 
 
-class SockMock:
+SIM_IFACE = 'wlx000c433243ce'
 
-    default_scan_results =\
-        "bssid / frequency / signal level / flags / ssid\n"\
-        "14:4d:67:14:1e:44\t2412\t-67\t[WPA2-PSK-CCMP][WPS][ESS]\tTOTOLINK N302RE\n"\
-        "ac:9e:17:31:85:fc\t2437\t-63\t[WPA2-PSK-CCMP][WPS][ESS]\tEvan\n"\
-        "0c:80:63:2b:0d:a8\t2417\t-79\t[WPA2-PSK-CCMP][WPS][ESS]\tKevin_H2\n"\
-        "78:32:1b:63:96:05\t2422\t-91\t[WPA-PSK-CCMP][WPA2-PSK-CCMP][ESS]\tjoyfulness\n"
 
-    def __init__(self):
-        self._last_cmd = None
-        self._last_state = None
-        self._network_profiles = []
-
-    def bind(self, *args, **kwargs):
-        pass
-
-    def connect(self, *args, **kwargs):
-        pass
-
-    def recv(self, *args, **kwargs):
-
-        if 'SCAN' == self._last_cmd:
-            #print('mock sock get scan cmd')
-
-            return b'OK\n'
-        elif 'PING' == self._last_cmd:
-            #print('mock sock get ping  cmd')
-
-            return b'PONG'
-        elif 'SCAN_RESULTS' == self._last_cmd:
-            #print('mock sock get scan_result cmd')
-
-            return bytearray(self.default_scan_results, 'utf-8')
-        elif 'DISCONNECT' == self._last_cmd:
-            #print('mock sock get scan_result cmd')
-
-            self._last_state = 0
-
-            return b'OK\n'
-        elif 'SELECT_NETWORK' == self._last_cmd[0:len('SELECT_NETWORK')]:
-            #print('mock sock get scan_result cmd')
-
-            self._last_state = 1
-
-            return b'OK\n'
-        elif 'STATUS' == self._last_cmd:
-            #print('mock sock get scan_result cmd')
-
-            if self._last_state == 0:
-                status = 'wpa_state=DISCONNECTED'
-            elif self._last_state == 1:
-                status = 'wpa_state=COMPLETED'
-
-            return bytearray(status, 'utf-8')
-        elif 'REMOVE_NETWORK all' == self._last_cmd:
-            #print('mock sock get remove_network_all cmd')
-
-            self._network_profiles = self._network_profiles[:]
-
-            return b'OK\n'
-        elif 'REMOVE_NETWORK' == self._last_cmd[:len('REMOVE_NETWORK')]:
-            #print('mock sock get remove_network cmd')
-
-            network_id = int(self._last_cmd.split(' ')[1])
-
-            for idx, network in enumerate(self._network_profiles):
-                if network['id'] == network_id:
-                    del self._network_profiles[idx]
-                    break
-
-            return b'OK\n'
-        elif 'LIST_NETWORKS' == self._last_cmd:
-            #print('mock sock get list_network cmd')
-
-            networks = 'network id / ssid / bssid / flag\n'
-
-            for network in self._network_profiles:
-                networks += "{}\t{}\t{}\t[DISABLED]\n".format(
-                    network['id'], network['ssid'], network.get('bssid', 'None'))
-
-            return bytearray(networks, 'utf-8')
-        elif 'ADD_NETWORK' == self._last_cmd:
-
-            if self._network_profiles:
-                self._network_profiles.sort(key=lambda obj: obj['id'])
-                network_id = self._network_profiles[-1]['id'] + 1
-            else:
-                network_id = 0
-
-            network = {}
-            network['id'] = network_id
-            self._network_profiles.append(network)
-
-            return bytearray(str(network_id), 'utf-8')
-        elif 'SET_NETWORK' == self._last_cmd[:len('SET_NETWORK')]:
-
-            network_id = int(self._last_cmd.split(' ')[1])
-            field_name = self._last_cmd.split(' ')[2]
-            val = self._last_cmd.split(' ')[3]
-
-            for profile in self._network_profiles:
-                if profile['id'] == network_id:
-                    network = profile
-
-            if field_name == 'ssid':
-                val = val[1:-1]
-
-            network[field_name] = val
-
-            return b'OK\n'
-        elif 'GET_NETWORK' == self._last_cmd[:len('GET_NETWORK')]:
-
-            network_id = int(self._last_cmd.split(' ')[1])
-            field_name = self._last_cmd.split(' ')[2]
-
-            for profile in self._network_profiles:
-                if profile['id'] == network_id:
-                    network = profile
-
-            if field_name == 'pairwise':
-                val = 'CCMP TKIP'
-            elif field_name == 'ssid':
-                val = '"' + network[field_name] + '"'
-            else:
-                val = network[field_name]
-
-            return bytearray(val, 'utf-8')
-
-    def send(self, *args, **kwargs):
-
-        self._last_cmd = args[0].decode('utf-8')
-
-
-class Mock:
-
-
-    def __init__(self):
+@pytest.fixture
+def wpas(tmp_path, monkeypatch):
 
-        self._dict = {}
+    ctrl_dir = str(tmp_path / 'wpa_supplicant')
+    monkeypatch.setattr(_wifiutil_linux, 'CTRL_IFACE_DIR', ctrl_dir)
+    monkeypatch.setattr(_wifiutil_linux, 'CTRL_GLOBAL_IFACE',
+                        str(tmp_path / 'wpa_supplicant-global'))
 
-    def __getattr__(self, field):
+    sim = WpaSupplicantSimulator(ctrl_dir, [SIM_IFACE])
+    sim.add_bss('14:4d:67:14:1e:44', 'TOTOLINK N302RE', 2412, -67,
+                '[WPA2-PSK-CCMP][WPS][ESS]')
+    sim.add_bss('ac:9e:17:31:85:fc', 'Evan', 2437, -63,
+                '[WPA2-PSK-CCMP][WPS][ESS]')
+    sim.add_bss('0c:80:63:2b:0d:a8', 'Kevin_H2', 2417, -79,
+                '[WPA2-PSK-CCMP][WPS][ESS]')
+    sim.add_bss('78:32:1b:63:96:05', 'joyfulness', 2422, -91,
+                '[WPA-PSK-CCMP][WPA2-PSK-CCMP][ESS]')
+    sim.add_bss('00:11:22:33:44:55', 'testap', 5180, -50,
+                '[WPA2-PSK-CCMP][ESS]')
 
-        return self._dict.get(field, None)
+    with sim:
+        yield sim
 
 
-def pywifi_test_patch(test_func):
+@pytest.fixture
+def wifi(wpas):
 
-    def core_patch(*args, **kwargs):
-        os.stat = lambda *args: Mock()
-        os.listdir = lambda *args: ['wlx000c433243ce']
-        stat.S_ISSOCK = lambda *args: True
-        socket.socket = lambda *args: SockMock()
-        os.remove = lambda *args: True
+    with pywifi.PyWiFi() as wifi:
+        yield wifi
 
-        test_func(*args, **kwargs)
 
-    return core_patch
-
-@pywifi_test_patch
-def test_interfaces():
-
-    wifi = pywifi.PyWiFi()
+def test_interfaces(wifi):
 
     assert wifi.interfaces()
 
@@ -194,14 +85,11 @@ def test_interfaces():
     elif platform.system().lower() == 'linux':
         assert wifi.interfaces()[0].name() == 'wlx000c433243ce'
 
-@pywifi_test_patch
-def test_scan():
-
-    wifi = pywifi.PyWiFi()
+def test_scan(wifi):
 
     iface = wifi.interfaces()[0]
     iface.scan()
-    time.sleep(5)
+    time.sleep(0.5)
     bsses = iface.scan_results()
     assert bsses
 
@@ -210,14 +98,14 @@ def test_profile_comparison():
     profile1 = pywifi.Profile()
     profile1.ssid = 'testap'
     profile1.auth = const.AUTH_ALG_OPEN
-    profile1.akm.append(const.AKM_TYPE_WPA2PSK)
+    profile1.akm = const.AKM_TYPE_WPA2PSK
     profile1.cipher = const.CIPHER_TYPE_CCMP
     profile1.key = '12345678'
 
     profile2 = pywifi.Profile()
     profile2.ssid = 'testap'
     profile2.auth = const.AUTH_ALG_OPEN
-    profile2.akm.append(const.AKM_TYPE_WPA2PSK)
+    profile2.akm = const.AKM_TYPE_WPA2PSK
     profile2.cipher = const.CIPHER_TYPE_CCMP
     profile2.key = '12345678'
 
@@ -226,23 +114,31 @@ def test_profile_comparison():
     profile3 = pywifi.Profile()
     profile3.ssid = 'testap'
     profile3.auth = const.AUTH_ALG_OPEN
-    profile3.akm.append(const.AKM_TYPE_WPAPSK)
+    profile3.akm = const.AKM_TYPE_WPAPSK
     profile3.cipher = const.CIPHER_TYPE_CCMP
     profile3.key = '12345678'
 
-    assert profile1 == profile3
+    assert profile1 != profile3
+    assert hash(profile1) == hash(profile2)
 
-@pywifi_test_patch
-def test_add_network_profile():
+    # Only a pattern has wildcards.
+    pattern = pywifi.Profile()
+    pattern.ssid = 'testap'
+    assert profile1.matches(pattern) and profile3.matches(pattern)
+    assert profile1 == pattern and pattern != profile1
+    assert pattern in {profile1}
 
-    wifi = pywifi.PyWiFi()
+    assert profile1.akm_flags & const.AkmFlag.PSK
+    assert profile3.akm_flags & const.AkmFlag.PSK
+
+def test_add_network_profile(wifi):
 
     iface = wifi.interfaces()[0]
 
     profile = pywifi.Profile()
     profile.ssid = 'testap'
     profile.auth = const.AUTH_ALG_OPEN
-    profile.akm.append(const.AKM_TYPE_WPA2PSK)
+    profile.akm = const.AKM_TYPE_WPA2PSK
     profile.cipher = const.CIPHER_TYPE_CCMP
     profile.key = '12345678'
 
@@ -255,13 +151,10 @@ def test_add_network_profile():
 
     assert profiles is not None
     assert profiles[0].ssid == "testap"
-    assert const.AKM_TYPE_WPA2PSK in profiles[0].akm
+    assert profiles[0].akm == const.AKM_TYPE_WPA2PSK
     assert const.AUTH_ALG_OPEN == profiles[0].auth
 
-@pywifi_test_patch
-def test_remove_network_profile():
-
-    wifi = pywifi.PyWiFi()
+def test_remove_network_profile(wifi):
 
     iface = wifi.interfaces()[0]
     iface.remove_all_network_profiles()
@@ -271,7 +164,7 @@ def test_remove_network_profile():
     profile1 = pywifi.Profile()
     profile1.ssid = 'testap'
     profile1.auth = const.AUTH_ALG_OPEN
-    profile1.akm.append(const.AKM_TYPE_WPA2PSK)
+    profile1.akm = const.AKM_TYPE_WPA2PSK
     profile1.cipher = const.CIPHER_TYPE_CCMP
     profile1.key = '12345678'
     iface.add_network_profile(profile1)
@@ -279,7 +172,7 @@ def test_remove_network_profile():
     profile2 = pywifi.Profile()
     profile2.ssid = 'testap2'
     profile2.auth = const.AUTH_ALG_OPEN
-    profile2.akm.append(const.AKM_TYPE_WPA2PSK)
+    profile2.akm = const.AKM_TYPE_WPA2PSK
     profile2.cipher = const.CIPHER_TYPE_CCMP
     profile2.key = '12345678'
     iface.add_network_profile(profile2)
@@ -287,7 +180,7 @@ def test_remove_network_profile():
     profile3 = pywifi.Profile()
     profile3.ssid = 'testap3'
     profile3.auth = const.AUTH_ALG_OPEN
-    profile3.akm.append(const.AKM_TYPE_WPAPSK)
+    profile3.akm = const.AKM_TYPE_WPAPSK
     profile3.cipher = const.CIPHER_TYPE_TKIP
     profile3.key = '12345678'
     iface.add_network_profile(profile3)
@@ -303,32 +196,26 @@ def test_remove_network_profile():
     assert len(profiles) == 2
     assert profile2 not in profiles
 
-@pywifi_test_patch
-def test_status():
-
-    wifi = pywifi.PyWiFi()
+def test_status(wifi):
 
     iface = wifi.interfaces()[0]
     iface.disconnect()
     assert iface.status() in\
         [const.IFACE_DISCONNECTED, const.IFACE_INACTIVE]
 
-@pywifi_test_patch
-def test_connect():
-
-    wifi = pywifi.PyWiFi()
+def test_connect(wifi):
 
     iface = wifi.interfaces()[0]
 
     iface.disconnect()
-    time.sleep(1)
+    time.sleep(0.2)
     assert iface.status() in\
         [const.IFACE_DISCONNECTED, const.IFACE_INACTIVE]
 
     profile = pywifi.Profile()
     profile.ssid = 'testap'
     profile.auth = const.AUTH_ALG_OPEN
-    profile.akm.append(const.AKM_TYPE_WPA2PSK)
+    profile.akm = const.AKM_TYPE_WPA2PSK
     profile.cipher = const.CIPHER_TYPE_CCMP
     profile.key = '12345678'
 
@@ -336,50 +223,1365 @@ def test_connect():
     tmp_profile = iface.add_network_profile(profile)
 
     iface.connect(tmp_profile)
-    time.sleep(5)
+    time.sleep(0.5)
     assert iface.status() == const.IFACE_CONNECTED
 
     iface.disconnect()
-    time.sleep(1)
+    time.sleep(0.2)
     assert iface.status() in\
         [const.IFACE_DISCONNECTED, const.IFACE_INACTIVE]
 
-@pywifi_test_patch
-def test_connect_open():
-
-    wifi = pywifi.PyWiFi()
+def test_connect_open(wifi):
 
     iface = wifi.interfaces()[0]
 
     iface.disconnect()
-    time.sleep(1)
+    time.sleep(0.2)
     assert iface.status() in\
         [const.IFACE_DISCONNECTED, const.IFACE_INACTIVE]
 
     profile = pywifi.Profile()
     profile.ssid = 'testap'
     profile.auth = const.AUTH_ALG_OPEN
-    profile.akm.append(const.AKM_TYPE_NONE)
+    profile.akm = const.AKM_TYPE_NONE
 
     iface.remove_all_network_profiles()
     tmp_profile = iface.add_network_profile(profile)
 
     iface.connect(tmp_profile)
-    time.sleep(5)
+    time.sleep(0.5)
     assert iface.status() == const.IFACE_CONNECTED
 
     iface.disconnect()
-    time.sleep(1)
+    time.sleep(0.2)
     assert iface.status() in\
         [const.IFACE_DISCONNECTED, const.IFACE_INACTIVE]
 
-@pywifi_test_patch
-def test_disconnect():
-
-    wifi = pywifi.PyWiFi()
+def test_disconnect(wifi):
 
     iface = wifi.interfaces()[0]
     iface.disconnect()
 
     assert iface.status() in\
         [const.IFACE_DISCONNECTED, const.IFACE_INACTIVE]
+
+class EventCtrlMock:
+
+    def __init__(self):
+        self.events_queue = []
+        self.state = const.IFACE_DISCONNECTED
+        self.status_calls = 0
+        self.bsses = []
+        self.replies = {}
+        self.connected_to = []
+        self._linux_util = _wifiutil_linux.WifiUtil()
+
+    def attach(self, obj):
+        pass
+
+    def detach(self, obj):
+        pass
+
+    def events(self, obj, timeout=0):
+        events, self.events_queue = self.events_queue, []
+        return events
+
+    def event_status(self, event):
+        return self._linux_util.event_status(event)
+
+    def connect_failed(self, event):
+        return self._linux_util.connect_failed(event)
+
+    def scan_results(self, obj):
+        return self.bsses
+
+    def connect(self, obj, params, fast=False):
+        self.connected_to.append(params.ssid)
+        self.events_queue.append(self.replies[params.ssid])
+
+    def disconnect(self, obj):
+        pass
+
+    def status(self, obj):
+        self.status_calls += 1
+        return self.state
+
+    def close(self):
+        self._linux_util.close()
+
+def test_tracked_status():
+
+    iface = Interface({'name': 'wlan0'})
+    ctrl = EventCtrlMock()
+    iface._wifi_ctrl = ctrl
+
+    iface.track_status(resync_interval=60)
+    assert ctrl.status_calls == 1
+    assert iface.status() == const.IFACE_DISCONNECTED
+
+    ctrl.events_queue.append(
+        'CTRL-EVENT-STATE-CHANGE id=0 state=5 BSSID=00:11:22:33:44:55')
+    assert iface.status() == const.IFACE_CONNECTING
+
+    # Connecting is resynced once to record the association.
+    ctrl.state = const.IFACE_CONNECTED
+    ctrl.events_queue.append(
+        'CTRL-EVENT-CONNECTED - Connection to 00:11:22:33:44:55 completed')
+    assert iface.status() == const.IFACE_CONNECTED
+    assert iface.status() == const.IFACE_CONNECTED
+    assert ctrl.status_calls == 2
+
+    # A missed event is repaired by the periodic resync.
+    ctrl.state = const.IFACE_DISCONNECTED
+    iface._status_synced_at -= 60
+    assert iface.status() == const.IFACE_DISCONNECTED
+    assert ctrl.status_calls == 3
+
+    iface.untrack_status()
+    iface.status()
+    assert ctrl.status_calls == 4
+
+def wpas_cmd_mock(replies):
+
+    sent = []
+
+    def send_cmd(iface, cmd, get_reply=False):
+        sent.append(cmd)
+        return replies.get(cmd, 'OK\n')
+
+    return sent, send_cmd
+
+def test_fast_connect():
+
+    util = _wifiutil_linux.WifiUtil()
+    sent, util._send_cmd_to_wpas = wpas_cmd_mock({
+        'LIST_NETWORKS': 'network id / ssid / bssid / flags\n'
+                         '0\ttestap\tany\t[CURRENT]\n',
+        'STATUS': 'bssid=00:11:22:33:44:55\nfreq=5180\nssid=testap\n'
+                  'id=0\nwpa_state=COMPLETED\n'})
+    obj = {'name': 'wlan_fast'}
+
+    profile = pywifi.Profile()
+    profile.ssid = 'testap'
+
+    assert util.last_association(obj, profile) is None
+    util.connect(obj, profile, fast=True)
+    assert sent[-1] == 'SELECT_NETWORK 0'
+
+    assert util.status(obj) == const.IFACE_CONNECTED
+    assert util.last_association(obj, profile) ==\
+        {'bssid': '00:11:22:33:44:55', 'freq': 5180}
+
+    util.connect(obj, profile, fast=True)
+    assert sent[-2] == 'SET_NETWORK 0 bssid_hint 00:11:22:33:44:55'
+    assert sent[-1] == 'SELECT_NETWORK 0 freq=5180'
+
+def test_fast_transition_profile():
+
+    util = _wifiutil_linux.WifiUtil()
+    sent, util._send_cmd_to_wpas = wpas_cmd_mock({
+        'ADD_NETWORK': '3\n',
+        'PMKSA': 'Index / AA / PMKID / expiration (in seconds) / '
+                 'opportunistic\n'
+                 '1 00:11:22:33:44:55 000102030405060708090a0b0c0d0e0f '
+                 '43170 0\n'})
+    obj = {'name': 'wlan0'}
+
+    profile = pywifi.Profile()
+    profile.ssid = 'testap'
+    profile.akm = const.AKM_TYPE_WPA3SAE
+    profile.key = '12345678'
+    profile.ft = True
+    profile.proactive_key_caching = True
+    profile.pmf = const.PMF_REQUIRED
+    util.add_network_profile(obj, profile)
+
+    assert 'SET_NETWORK 3 key_mgmt SAE FT-SAE' in sent
+    assert 'SET_NETWORK 3 proactive_key_caching 1' in sent
+    assert 'SET_NETWORK 3 ieee80211w 2' in sent
+
+    entries = util.pmksa(obj)
+    assert len(entries) == 1
+    assert entries[0]['bssid'] == '00:11:22:33:44:55'
+    assert entries[0]['expiration'] == 43170
+    assert not entries[0]['opportunistic']
+
+def test_roaming_engine():
+
+    engine = RoamingEngine(alpha=0.5, hysteresis=8)
+
+    engine.update_bss('corp', 'aa:aa:aa:aa:aa:01', 2412, -60, now=0)
+    engine.update_bss('corp', 'aa:aa:aa:aa:aa:02', 5180, -62, now=0)
+    engine.update_bss('guest', 'aa:aa:aa:aa:aa:03', 2437, -40, now=0)
+
+    # The 5 GHz band preference outweighs the 2 dB difference.
+    assert engine.best('corp', now=0) == 'aa:aa:aa:aa:aa:02'
+    assert engine.best('guest', now=0) == 'aa:aa:aa:aa:aa:03'
+    assert engine.roam_target('corp', 'aa:aa:aa:aa:aa:01', now=0) is None
+
+    # The RSSI is smoothed, so one bad sample does not flip the order.
+    engine.update_bss('corp', 'aa:aa:aa:aa:aa:02', 5180, -80, now=1)
+    assert engine.bss('aa:aa:aa:aa:aa:02')['rssi'] == -71
+    assert engine.best('corp', now=1) == 'aa:aa:aa:aa:aa:01'
+    assert engine.candidates('corp', now=1) ==\
+        ['aa:aa:aa:aa:aa:01', 'aa:aa:aa:aa:aa:02']
+
+    for _ in range(4):
+        engine.update_bss('corp', 'aa:aa:aa:aa:aa:02', 5180, -50, now=2)
+    assert engine.roam_target('corp', 'aa:aa:aa:aa:aa:01', now=2) ==\
+        'aa:aa:aa:aa:aa:02'
+
+    # Expired BSSes are dropped.
+    assert engine.best('corp', now=100) is None
+
+def test_connect_any():
+
+    iface = Interface({'name': 'wlan0'})
+    ctrl = EventCtrlMock()
+    iface._wifi_ctrl = ctrl
+
+    for ssid, signal in [('weak', -80), ('strong', -50), ('wrongkey', -40)]:
+        bss = pywifi.Profile()
+        bss.ssid = ssid
+        bss.freq = 2412
+        bss.signal = signal
+        ctrl.bsses.append(bss)
+    ctrl.replies = {
+        'wrongkey': 'CTRL-EVENT-SSID-TEMP-DISABLED id=2 ssid="wrongkey" '
+                    'auth_failures=1 duration=10 reason=WRONG_KEY',
+        'strong': 'CTRL-EVENT-CONNECTED - Connection to '
+                  '00:11:22:33:44:55 completed [id=1 id_str=]',
+        'weak': 'CTRL-EVENT-CONNECTED - Connection to '
+                '00:11:22:33:44:66 completed [id=0 id_str=]',
+    }
+
+    profiles = []
+    for ssid in ['hidden', 'weak', 'strong', 'wrongkey']:
+        profile = pywifi.Profile()
+        profile.ssid = ssid
+        profiles.append(profile)
+
+    profile, attempts = iface.connect_any(profiles, per_attempt_timeout=5)
+
+    assert profile.ssid == 'strong'
+    assert ctrl.connected_to == ['wrongkey', 'strong']
+    assert [a['result'] for a in attempts] == ['failed', 'connected']
+    assert all(a['elapsed'] < 5 for a in attempts)
+
+def test_cached_interfaces(tmp_path, monkeypatch):
+
+    monkeypatch.setattr(_wifiutil_linux, 'CTRL_IFACE_DIR', str(tmp_path))
+    monkeypatch.setattr(_wifiutil_linux, 'CTRL_GLOBAL_IFACE',
+                        str(tmp_path / 'global'))
+
+    util = _wifiutil_linux.WifiUtil()
+    connected = []
+    def connect_to_wpa_s(iface):
+        connected.append(iface)
+        util._connections[iface] = {}
+    util._connect_to_wpa_s = connect_to_wpa_s
+
+    socks = []
+    def add_ctrl_sock(name, mtime):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        sock.bind(str(tmp_path / name))
+        socks.append(sock)
+        os.utime(str(tmp_path), (mtime, mtime))
+
+    add_ctrl_sock('wlan0', 1000)
+    assert [i['name'] for i in util.interfaces()] == ['wlan0']
+    assert [i['name'] for i in util.interfaces()] == ['wlan0']
+    assert connected == ['wlan0']
+
+    # A hotplugged interface changes the directory mtime.
+    add_ctrl_sock('wlan1', 2000)
+    assert [i['name'] for i in util.interfaces()] == ['wlan0', 'wlan1']
+    assert connected == ['wlan0', 'wlan1']
+
+    for sock in socks:
+        sock.close()
+
+class BackendMock:
+
+    def __init__(self):
+        self.closed = False
+
+    def interfaces(self, refresh=False):
+        return [{'name': 'wlan0'}, {'name': 'wlan1'}]
+
+    def close(self):
+        self.closed = True
+
+def test_shared_backend_close(monkeypatch):
+
+    monkeypatch.setattr(pywifi._backend.wifiutil(), 'WifiUtil', BackendMock)
+
+    with pywifi.PyWiFi() as wifi:
+        ifaces = wifi.interfaces()
+        assert ifaces[0]._wifi_ctrl is ifaces[1]._wifi_ctrl
+        assert wifi.interfaces()[0] is ifaces[0]
+
+    assert ifaces[0]._wifi_ctrl.closed
+
+def ctrl_sock_echo_server(path, replies=None):
+
+    srv = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    srv.bind(path)
+
+    def serve():
+        while True:
+            try:
+                cmd, addr = srv.recvfrom(4096)
+            except OSError:
+                return
+            if cmd.startswith(b'SLEEP '):
+                time.sleep(float(cmd.split()[1]))
+            reply = b'PONG\n' if cmd == b'PING' else cmd
+            if replies and cmd in replies:
+                reply = replies[cmd]
+            try:
+                srv.sendto(reply, addr)
+            except OSError:
+                pass
+
+    threading.Thread(target=serve, daemon=True).start()
+
+    return srv
+
+def test_client_sockets_unique(tmp_path, monkeypatch):
+
+    monkeypatch.setattr(_wifiutil_linux, 'CTRL_IFACE_DIR', str(tmp_path))
+    srv = ctrl_sock_echo_server(str(tmp_path / 'wlan0'))
+
+    util1 = _wifiutil_linux.WifiUtil()
+    util2 = _wifiutil_linux.WifiUtil()
+    util1._connect_to_wpa_s('wlan0')
+    util2._connect_to_wpa_s('wlan0')
+
+    assert util1._send_cmd_to_wpas('wlan0', 'STATUS 1', True) == 'STATUS 1'
+    assert util2._send_cmd_to_wpas('wlan0', 'STATUS 2', True) == 'STATUS 2'
+    assert util1._send_cmd_to_wpas('wlan0', 'STATUS 3', True) == 'STATUS 3'
+
+    util1.close()
+    util2.close()
+    srv.close()
+
+def test_cmd_timeout_and_reconnect(tmp_path, monkeypatch):
+
+    monkeypatch.setattr(_wifiutil_linux, 'CTRL_IFACE_DIR', str(tmp_path))
+    srv = ctrl_sock_echo_server(str(tmp_path / 'wlan0'))
+
+    util = _wifiutil_linux.WifiUtil(timeout=0.2)
+
+    with pytest.raises(socket.timeout):
+        util._send_cmd_to_wpas('wlan0', 'SLEEP 0.4', True)
+    time.sleep(0.3)
+    # The late reply of the timed out command is dropped.
+    assert util._send_cmd_to_wpas('wlan0', 'STATUS', True) == 'STATUS'
+
+    # wpa_supplicant restarts and recreates its control socket.
+    srv.close()
+    os.remove(str(tmp_path / 'wlan0'))
+    srv = ctrl_sock_echo_server(str(tmp_path / 'wlan0'))
+    assert util._send_cmd_to_wpas('wlan0', 'STATUS', True) == 'STATUS'
+
+    # wpa_supplicant is gone for longer than the deadline.
+    srv.close()
+    os.remove(str(tmp_path / 'wlan0'))
+    with pytest.raises(socket.timeout):
+        util._send_cmd_to_wpas('wlan0', 'STATUS', True)
+
+    util.close()
+
+def test_metrics(tmp_path, monkeypatch):
+
+    monkeypatch.setattr(_wifiutil_linux, 'CTRL_IFACE_DIR', str(tmp_path))
+    srv = ctrl_sock_echo_server(str(tmp_path / 'wlan0'))
+
+    util = _wifiutil_linux.WifiUtil()
+    iface = Interface({'name': 'wlan0'}, util)
+
+    # Nothing is collected while the metrics are disabled.
+    metrics.reset()
+    iface.scan()
+    assert metrics.stats() == {'commands': {}, 'operations': {},
+                               'events': {}}
+
+    metrics.enable()
+    try:
+        iface.scan()
+        util._send_cmd_to_wpas('wlan0', 'FAIL', True)
+    finally:
+        metrics.disable()
+
+    stats = metrics.stats()
+    assert stats['commands']['SCAN']['count'] == 1
+    assert stats['commands']['SCAN']['errors'] == 0
+    assert stats['commands']['SCAN']['bytes_sent'] == 4
+    assert stats['commands']['SCAN']['bytes_received'] == 4
+    assert sum(stats['commands']['SCAN']['latency_buckets']) == 1
+    assert stats['commands']['FAIL']['errors'] == 1
+    assert stats['operations']['scan']['count'] == 1
+    assert stats['operations']['scan']['commands'] == 1
+
+    text = metrics.prometheus_text()
+    assert 'pywifi_commands_total{command="SCAN"} 1\n' in text
+    assert 'pywifi_command_errors_total{command="FAIL"} 1\n' in text
+    assert 'pywifi_operation_latency_seconds_bucket' \
+        '{operation="scan",le="+Inf"} 1\n' in text
+
+    metrics.reset()
+    util.close()
+    srv.close()
+
+def test_tracing(tmp_path, monkeypatch):
+
+    monkeypatch.setattr(_wifiutil_linux, 'CTRL_IFACE_DIR', str(tmp_path))
+    srv = ctrl_sock_echo_server(str(tmp_path / 'wlan0'), {
+        b'LIST_NETWORKS':
+            b'network id / ssid / bssid / flags\n0\ttestap\tany\t\n',
+        b'SELECT_NETWORK 0': b'OK\n'
+    })
+
+    util = _wifiutil_linux.WifiUtil()
+    iface = Interface({'name': 'wlan0'}, util)
+    profile = pywifi.Profile()
+    profile.ssid = 'testap'
+
+    tracer = tracing.RecordingTracer()
+    tracing.set_tracer(tracer)
+    try:
+        iface.connect(profile)
+
+        ctrl = EventCtrlMock()
+        ctrl.replies['testap'] = \
+            'CTRL-EVENT-CONNECTED - Connection to 00:11:22:33:44:55 completed'
+        Interface({'name': 'wlan1'}, ctrl).attempt_connect(profile, 1)
+    finally:
+        tracing.set_tracer(None)
+
+    connect = tracer.spans[2]
+    assert connect.name == 'connect'
+    assert connect.attributes == {'iface': 'wlan0'}
+    assert connect.parent is None
+    assert [s.name for s in tracer.children(connect)] == \
+        ['LIST_NETWORKS', 'SELECT_NETWORK']
+    assert tracer.children(connect)[1].attributes['failed'] is False
+
+    attempt = tracer.spans[-1]
+    assert attempt.name == 'attempt_connect'
+    assert [s.name for s in tracer.children(attempt)] == \
+        ['connect', 'association_wait']
+    assert tracer.children(attempt)[1].attributes['result'] == 'connected'
+    assert attempt.duration() >= 0
+
+    util.close()
+    srv.close()
+
+def test_flight_recorder(tmp_path, monkeypatch):
+
+    monkeypatch.setattr(_wifiutil_linux, 'CTRL_IFACE_DIR', str(tmp_path))
+    srv = ctrl_sock_echo_server(str(tmp_path / 'wlan0'), {
+        b'SET_NETWORK 0 psk "12345678"': b'OK\n'
+    })
+
+    util = _wifiutil_linux.WifiUtil(flight_size=3)
+    iface = Interface({'name': 'wlan0'}, util)
+
+    util._send_cmd_to_wpas('wlan0', 'PING', True)
+    util._send_cmd_to_wpas('wlan0', 'SET_NETWORK 0 psk "12345678"')
+    util._send_cmd_to_wpas('wlan0', 'STATUS', True)
+
+    # Only the last records are kept.
+    records = iface.flight_records()
+    assert [(kind, data) for _, kind, _, data in records] == [
+        ('reply', b'OK\n'), ('cmd', 'STATUS'), ('reply', b'STATUS')]
+
+    util._send_cmd_to_wpas('wlan0', 'SET_NETWORK 0 psk "12345678"')
+    stream = io.StringIO()
+    iface.dump_flight_records(stream)
+    assert 'SET_NETWORK 0 psk [REDACTED]' in stream.getvalue()
+    assert '12345678' not in stream.getvalue()
+
+    util.close()
+    srv.close()
+
+def test_simulator(wpas):
+
+    util = _wifiutil_linux.WifiUtil(timeout=1)
+    iface = Interface(util.interfaces()[0], util)
+
+    # Only the entries fitting in the reply are listed, like wpa_supplicant.
+    wpas.populate(10000)
+    bsses = iface.scan_results()
+    assert 0 < len(bsses) < 10000
+    assert bsses[0].ssid == 'TOTOLINK N302RE'
+
+    wpas.inject_busy(1, 'SCAN')
+    assert util._send_cmd_to_wpas(SIM_IFACE, 'SCAN', True) == 'FAIL-BUSY\n'
+    assert util._send_cmd_to_wpas(SIM_IFACE, 'SCAN', True) == 'OK\n'
+
+    wpas.set_latency(0.3, 'PING')
+    start = time.monotonic()
+    assert util._send_cmd_to_wpas(SIM_IFACE, 'PING', True) == 'PONG\n'
+    assert time.monotonic() - start >= 0.3
+    wpas.set_latency(0, 'PING')
+
+    profile = pywifi.Profile()
+    profile.ssid = 'testap'
+    profile.akm = const.AKM_TYPE_WPA2PSK
+    profile.key = '12345678'
+    iface.add_network_profile(profile)
+
+    wpas.reject('testap')
+    attempts = []
+    assert not iface.attempt_connect(profile, 1, attempts)
+    assert attempts[0]['result'] == 'failed'
+
+    wpas.reject('testap', None)
+    assert iface.attempt_connect(profile, 1)
+    assert iface.status() == const.IFACE_CONNECTED
+    assert iface.last_association(profile) == {
+        'bssid': '00:11:22:33:44:55', 'freq': 5180}
+
+    util.close()
+
+def test_simulator_global_iface(tmp_path, monkeypatch):
+
+    global_iface = str(tmp_path / 'wpa_supplicant-global')
+    monkeypatch.setattr(_wifiutil_linux, 'CTRL_IFACE_DIR', str(tmp_path))
+    monkeypatch.setattr(_wifiutil_linux, 'CTRL_GLOBAL_IFACE', global_iface)
+
+    with WpaSupplicantSimulator(str(tmp_path / 'ifaces'), ['wlan0', 'wlan1'],
+                                global_iface) as sim:
+        sim.add_bss('00:11:22:33:44:55', 'testap', 2412, -50, iface='wlan1')
+
+        with pywifi.PyWiFi() as wifi:
+            ifaces = wifi.interfaces()
+            assert [i.name() for i in ifaces] == ['wlan0', 'wlan1']
+            assert ifaces[0].scan_results() == []
+            assert [b.ssid for b in ifaces[1].scan_results()] == ['testap']
+
+            ifaces[1].track_status(60)
+            sim.send_event('wlan1',
+                           'CTRL-EVENT-STATE-CHANGE id=0 state=5 '
+                           'BSSID=00:11:22:33:44:55')
+            time.sleep(0.1)
+            assert ifaces[1].status() == const.IFACE_CONNECTING
+            ifaces[1].untrack_status()
+
+def test_record_replay(wpas, tmp_path):
+
+    recording = str(tmp_path / 'traffic.bin')
+
+    profile = pywifi.Profile()
+    profile.ssid = 'testap'
+    profile.akm = const.AKM_TYPE_WPA2PSK
+    profile.key = '12345678'
+
+    with pywifi.PyWiFi() as wifi:
+        wifi.start_recording(recording)
+        iface = wifi.interfaces()[0]
+        recorded_bsses = [b.bssid for b in iface.scan_results()]
+        iface.add_network_profile(profile)
+        assert iface.attempt_connect(profile, 2)
+        wifi.stop_recording()
+
+    with open(recording, 'rb') as f:
+        assert b'12345678' not in f.read()
+
+    # The simulator is gone, so everything is served from the recording.
+    wpas.stop()
+    with pywifi.PyWiFi(ReplayWifiUtil(recording, speed=0)) as wifi:
+        iface = wifi.interfaces()[0]
+        assert iface.name() == SIM_IFACE
+        assert [b.bssid for b in iface.scan_results()] == recorded_bsses
+        iface.add_network_profile(profile)
+        start = time.monotonic()
+        assert iface.attempt_connect(profile, 2)
+        assert time.monotonic() - start < 1
+
+    # Waiting past the recorded events moves the clock without sleeping.
+    util = ReplayWifiUtil(recording, speed=0)
+    start = time.monotonic()
+    assert util.events({'name': SIM_IFACE}, 5) != []
+    assert util.events({'name': 'wlan9'}, 5) == []
+    assert time.monotonic() - start < 1
+    assert util._clock >= 5
+
+def test_import_side_effects():
+
+    # Importing pywifi loads no backend and configures no logging.
+    subprocess.check_call([sys.executable, '-c', '''if True:
+        import logging
+        import sys
+        import pywifi
+        assert not logging.getLogger().handlers
+        assert 'pywifi._wifiutil_linux' not in sys.modules
+        assert 'pywifi._wifiutil_win' not in sys.modules
+    '''])
+
+def test_profile_store():
+
+    profiles = []
+    for ssid, bssid, akm in [('home', None, const.AKM_TYPE_WPA2PSK),
+                             ('home', '00:11:22:33:44:55',
+                              const.AKM_TYPE_WPA3SAE),
+                             ('office', None, const.AKM_TYPE_WPA2)]:
+        profile = pywifi.Profile()
+        profile.ssid = ssid
+        profile.bssid = bssid
+        profile.akm = akm
+        profile.cipher = const.CIPHER_TYPE_CCMP
+        profiles.append(profile)
+    store = pywifi.ProfileStore(profiles)
+
+    patterns = []
+    for ssid, bssid, akm, cipher in [
+            ('home', None, const.AKM_TYPE_NONE, const.CIPHER_TYPE_NONE),
+            ('home', None, const.AKM_TYPE_WPA2PSK, const.CIPHER_TYPE_CCMP),
+            (None, '00:11:22:33:44:55', const.AKM_TYPE_NONE,
+             const.CIPHER_TYPE_NONE),
+            (None, None, const.AKM_TYPE_WPA2, const.CIPHER_TYPE_NONE),
+            (None, None, const.AKM_TYPE_NONE, const.CIPHER_TYPE_NONE),
+            ('guest', None, const.AKM_TYPE_NONE, const.CIPHER_TYPE_NONE)]:
+        pattern = pywifi.Profile()
+        pattern.ssid = ssid
+        pattern.bssid = bssid
+        pattern.akm = akm
+        pattern.cipher = cipher
+        patterns.append(pattern)
+
+    # The matches are the same as comparing with every profile.
+    for pattern in patterns:
+        assert store.match(pattern) == \
+            [p for p in profiles if p.matches(pattern)]
+        assert (pattern in store) == \
+            any(p.matches(pattern) for p in profiles)
+
+    store.remove(profiles[0])
+    assert store.match(patterns[0]) == [profiles[1]]
+    assert len(store) == 2
+
+    assert profiles[1].canonical_key() == ('home', '00:11:22:33:44:55',
+                                 const.AUTH_ALG_OPEN,
+                                 const.AKM_TYPE_WPA3SAE,
+                                 const.CIPHER_TYPE_CCMP)
+    assert len(set(profiles)) == 3
+    # Extra attributes still work.
+    profiles[0].note = 'primary'
+    assert profiles[0].note == 'primary'
+
+def test_connect_any_errors():
+
+    iface = Interface({'name': 'wlan0'})
+    ctrl = EventCtrlMock()
+    iface._wifi_ctrl = ctrl
+    detached = []
+    ctrl.detach = detached.append
+
+    for ssid, signal in [('weak', -80), ('broken', -40)]:
+        bss = pywifi.Profile()
+        bss.ssid = ssid
+        bss.freq = 2412
+        bss.signal = signal
+        ctrl.bsses.append(bss)
+    # Connecting to 'broken' raises a KeyError without a reply.
+    ctrl.replies = {
+        'weak': 'CTRL-EVENT-CONNECTED - Connection to '
+                '00:11:22:33:44:66 completed [id=0 id_str=]',
+    }
+
+    profiles = []
+    for ssid in ['weak', 'broken']:
+        profile = pywifi.Profile()
+        profile.ssid = ssid
+        profiles.append(profile)
+
+    # A failed attempt does not stop the next ones.
+    profile, attempts = iface.connect_any(profiles, per_attempt_timeout=5)
+    assert profile.ssid == 'weak'
+    assert ctrl.connected_to == ['broken', 'weak']
+    assert len(detached) == 2
+
+    # It is raised when no attempt succeeded.
+    with pytest.raises(KeyError):
+        iface.connect_any(profiles[1:], per_attempt_timeout=5)
+    assert len(detached) == 3
+
+    with pywifi.PyWiFi(ctrl) as wifi:
+        with pytest.raises(KeyError):
+            wifi.connect_any(profiles[1:], per_attempt_timeout=5,
+                             ifaces=[iface, iface])
+
+def test_concurrent_attach(tmp_path, monkeypatch):
+
+    global_iface = str(tmp_path / 'wpa_supplicant-global')
+    monkeypatch.setattr(_wifiutil_linux, 'CTRL_IFACE_DIR', str(tmp_path))
+    monkeypatch.setattr(_wifiutil_linux, 'CTRL_GLOBAL_IFACE', global_iface)
+
+    names = ['wlan{}'.format(i) for i in range(4)]
+    with WpaSupplicantSimulator(str(tmp_path / 'ifaces'), names,
+                                global_iface):
+        with pywifi.PyWiFi() as wifi:
+            ifaces = wifi.interfaces()
+            util = wifi._wifi_ctrl
+            barrier = threading.Barrier(len(ifaces))
+
+            def attach(iface):
+                barrier.wait()
+                util.attach(iface._raw_obj)
+
+            threads = [threading.Thread(target=attach, args=(iface,))
+                       for iface in ifaces]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            # The interfaces share a single monitor of the global iface.
+            monitor = util._monitors[_wifiutil_linux.CTRL_GLOBAL_IFACE]
+            assert all(util._monitors[name] is monitor for name in names)
+            assert sorted(monitor['queues']) == names
+
+def test_monitor_slow_poller(wpas, monkeypatch):
+
+    monkeypatch.setattr(_wifiutil_linux, 'KEEPALIVE_INTERVAL', 0.05)
+    wpas.set_latency(0.1, 'PING')
+    util = _wifiutil_linux.WifiUtil(timeout=0.2)
+    obj = {'name': SIM_IFACE}
+    try:
+        util.attach(obj)
+        monitor = util._monitors[SIM_IFACE]
+        sock = monitor['sock']
+
+        time.sleep(0.1)
+        assert util.events(obj) == []
+        assert monitor['ping_at'] is not None
+
+        # The PONG and the event wait longer than the timeout to be read.
+        wpas.send_event(SIM_IFACE, 'CTRL-EVENT-SCAN-RESULTS ')
+        time.sleep(0.3)
+        assert util.events(obj) == ['CTRL-EVENT-SCAN-RESULTS ']
+        assert monitor['sock'] is sock
+        assert monitor['ping_at'] is None
+    finally:
+        util.close()
+
+def test_tracer_per_backend(wpas):
+
+    def operations(tracer):
+        return [s.name for s in tracer.spans if s.parent is None]
+
+    tracer = tracing.RecordingTracer()
+    other = tracing.RecordingTracer()
+    with pywifi.PyWiFi() as traced, pywifi.PyWiFi() as untraced:
+        traced.set_tracer(tracer)
+        traced.interfaces()[0].scan_results()
+        untraced.interfaces()[0].scan_results()
+        assert operations(tracer) == ['scan_results']
+
+        # The global tracer only gets the spans of the other backend.
+        tracing.set_tracer(other)
+        try:
+            untraced.interfaces()[0].status()
+            traced.interfaces()[0].status()
+        finally:
+            tracing.set_tracer(None)
+
+    assert operations(other) == ['status']
+    assert operations(tracer) == ['scan_results', 'status']
+    assert [s.name for s in tracer.children(tracer.spans[-1])] == ['STATUS']
+
+def test_traced_command_error(tmp_path, monkeypatch):
+
+    monkeypatch.setattr(_wifiutil_linux, 'CTRL_IFACE_DIR', str(tmp_path))
+    util = _wifiutil_linux.WifiUtil(timeout=0.1)
+    util.tracer = tracing.RecordingTracer()
+
+    def fail(iface, cmd, timeout):
+        raise ValueError(cmd)
+
+    monkeypatch.setattr(util, '_roundtrip', fail)
+    with pytest.raises(ValueError):
+        util._send_cmd_to_wpas('wlan0', 'STATUS', True)
+
+    span, = util.tracer.spans
+    assert span.name == 'STATUS'
+    assert isinstance(span.error, ValueError)
+    assert span.end is not None
+    # The failed span is no longer the current one.
+    span = tracing.start_span('next', util)
+    assert span.parent is None
+    tracing.end_span(span)
+
+def test_rule_engine_queue_size():
+
+    engine = RuleEngine(rules=[rules.RULE_RSSI_JUMP], queue_size=2)
+    bss = pywifi.Profile()
+    bss.ssid = 'testap'
+    bss.bssid = '00:11:22:33:44:55'
+    for now, signal in enumerate([-90, -50, -90, -50, -90]):
+        bss.signal = signal
+        assert len(engine.update([bss], now=now)) == (1 if now else 0)
+
+    # Only the newest alerts are kept.
+    assert [a['time'] for a in engine.events()] == [3, 4]
+    assert engine.events() == []
+
+    start = time.monotonic()
+    assert engine.events(timeout=0.1) == []
+    assert time.monotonic() - start >= 0.1
+
+    def update():
+        time.sleep(0.05)
+        bss.signal = -50
+        engine.update([bss], now=5)
+
+    thread = threading.Thread(target=update)
+    thread.start()
+    assert [a['time'] for a in engine.events(timeout=5)] == [5]
+    thread.join()
+
+def test_survey_khz(tmp_path):
+
+    # Windows reports the frequencies in kHz.
+    bss = pywifi.Profile()
+    bss.ssid = 'testap'
+    bss.bssid = '00:11:22:33:44:55'
+    bss.freq = 5180000
+    bss.signal = -50
+
+    path = str(tmp_path / 'survey.log')
+    with SurveyRecorder(path) as recorder:
+        recorder.record([bss], at=1000.0)
+        bss.freq = 2412
+        recorder.record([bss], at=1001.0)
+
+    with SurveyLog(path) as log:
+        assert [o['freq'] for o in log.observations()] == [5180, 2412]
+
+def test_global_iface_commands(tmp_path, monkeypatch):
+
+    global_iface = str(tmp_path / 'wpa_supplicant-global')
+    monkeypatch.setattr(_wifiutil_linux, 'CTRL_IFACE_DIR',
+                        str(tmp_path / 'ifaces'))
+    monkeypatch.setattr(_wifiutil_linux, 'CTRL_GLOBAL_IFACE', global_iface)
+    srv = ctrl_sock_echo_server(global_iface, {
+        b'INTERFACES': b'wlan1\nwlan0\n'
+    })
+
+    util = _wifiutil_linux.WifiUtil()
+    try:
+        assert util.interfaces() == [{'name': 'wlan0'}, {'name': 'wlan1'}]
+
+        # Every interface is driven through the one global socket.
+        socks = set(id(util._connections[name]['sock'])
+                    for name in (global_iface, 'wlan0', 'wlan1'))
+        assert len(socks) == 1
+
+        # The echo server replies with the commands as it got them.
+        assert util._send_cmd_to_wpas('wlan0', 'STATUS', True) == \
+            'IFNAME=wlan0 STATUS'
+        assert util._send_cmd_to_wpas('wlan1', 'SCAN', True) == \
+            'IFNAME=wlan1 SCAN'
+        assert util._send_cmd_to_wpas(global_iface, 'PING', True) == \
+            'PONG\n'
+    finally:
+        util.close()
+        srv.close()
+
+def test_cached_global_interfaces(tmp_path, monkeypatch):
+
+    global_iface = str(tmp_path / 'wpa_supplicant-global')
+    monkeypatch.setattr(_wifiutil_linux, 'CTRL_IFACE_DIR',
+                        str(tmp_path / 'ifaces'))
+    monkeypatch.setattr(_wifiutil_linux, 'CTRL_GLOBAL_IFACE', global_iface)
+    replies = {b'INTERFACES': b'wlan0\n'}
+    srv = ctrl_sock_echo_server(global_iface, replies)
+    os.utime(global_iface, (1000, 1000))
+
+    util = _wifiutil_linux.WifiUtil()
+    try:
+        assert [i['name'] for i in util.interfaces()] == ['wlan0']
+        assert util._ifaces_stamp is not None
+        assert [i['name'] for i in util.interfaces()] == ['wlan0']
+
+        # INTERFACE_ADD through the global iface creates no socket.
+        replies[b'INTERFACES'] = b'wlan0\nwlan1\n'
+        assert [i['name'] for i in util.interfaces()] == ['wlan0', 'wlan1']
+        assert util._send_cmd_to_wpas('wlan1', 'STATUS', True) == \
+            'IFNAME=wlan1 STATUS'
+
+        replies[b'INTERFACES'] = b'wlan1\n'
+        assert [i['name'] for i in util.interfaces()] == ['wlan1']
+        assert 'wlan0' not in util._connections
+    finally:
+        util.close()
+        srv.close()
+
+def test_fast_connect_hint():
+
+    util = _wifiutil_linux.WifiUtil()
+    sent, util._send_cmd_to_wpas = wpas_cmd_mock({
+        'LIST_NETWORKS': 'network id / ssid / bssid / flags\n'
+                         '0\tcafé\tany\t[CURRENT]\n',
+        'STATUS': 'bssid=00:11:22:33:44:55\nfreq=5180\n'
+                  'ssid=caf\\xc3\\xa9\nid=0\nwpa_state=COMPLETED\n'})
+    obj = {'name': 'wlan_hint'}
+
+    profile = pywifi.Profile()
+    profile.ssid = 'café'
+
+    # The association is keyed by the decoded SSID.
+    assert util.status(obj) == const.IFACE_CONNECTED
+    assert util.last_association(obj, profile) == \
+        {'bssid': '00:11:22:33:44:55', 'freq': 5180}
+
+    util.connect(obj, profile, fast=True)
+    assert sent[-2] == 'SET_NETWORK 0 bssid_hint 00:11:22:33:44:55'
+    util.connect(obj, profile, fast=True)
+    assert sent.count('SET_NETWORK 0 bssid_hint any') == 0
+
+    # The hint is cleared when the association ends.
+    util.disconnect(obj)
+    assert sent[-2:] == ['DISCONNECT', 'SET_NETWORK 0 bssid_hint any']
+    util.disconnect(obj)
+    assert sent[-1] == 'DISCONNECT'
+
+    util.connect(obj, profile, fast=True)
+    util.connect(obj, profile)
+    assert sent[-2:] == ['SET_NETWORK 0 bssid_hint any', 'SELECT_NETWORK 0']
+
+def make_bss(bssid, ssid, freq, signal, akm=const.AKM_TYPE_NONE):
+
+    bss = pywifi.Profile()
+    bss.bssid = bssid
+    bss.ssid = ssid
+    bss.freq = freq
+    bss.signal = signal
+    bss.akm = akm
+
+    return bss
+
+def test_scan_flags(wpas, wifi):
+
+    wpas.add_bss('02:00:00:00:00:01', 'mixed', 2462, -60,
+                 '[WPA2-FT/PSK+SAE-CCMP+TKIP][ESS]')
+    wpas.add_bss('02:00:00:00:00:02', 'open', 2462, -60, '[ESS]')
+
+    iface = wifi.interfaces()[0]
+    bsses = {bss.ssid: bss for bss in iface.scan_results()}
+
+    assert bsses['joyfulness'].akm == const.AKM_TYPE_WPA2PSK
+    assert bsses['joyfulness'].akm_flags == \
+        const.AkmFlag.WPAPSK | const.AkmFlag.WPA2PSK
+    assert bsses['mixed'].akm == const.AKM_TYPE_WPA3SAE
+    assert bsses['mixed'].akm_flags & const.AkmFlag.WPA2_OR_BETTER
+    assert const.flag_values(bsses['mixed'].akm_flags) == \
+        [const.AKM_TYPE_WPA2PSK, const.AKM_TYPE_WPA3SAE]
+    assert bsses['mixed'].cipher == const.CIPHER_TYPE_CCMP
+    assert bsses['mixed'].cipher_flags == \
+        const.CipherFlag.TKIP | const.CipherFlag.CCMP
+    assert bsses['mixed'].ft
+    assert bsses['open'].akm == const.AKM_TYPE_NONE
+    assert bsses['open'].akm_flags == const.AkmFlag.NONE
+    assert bsses['open'].cipher_flags == const.CipherFlag.NONE
+
+def test_interning():
+
+    table = interning.InternTable(2)
+    assert table.get('a', str.upper) == 'A'
+    assert table.get('b', str.upper) == 'B'
+    assert table.get('a', str.lower) == 'A'
+    table.get('c', str.upper)
+    assert 'b' not in table and 'a' in table and len(table) == 2
+
+    raw = bytes([0x00, 0x11, 0x22, 0xaa, 0xbb, 0xcc])
+    assert interning.format_bssid(raw) == '00:11:22:aa:bb:cc'
+    assert interning.bssid_to_int('00:11:22:AA:BB:CC') == 0x001122aabbcc
+    assert interning.format_bssid(0x001122aabbcc) == '00:11:22:aa:bb:cc'
+    assert interning.intern_bssid(raw) is interning.intern_bssid(raw)
+    assert interning.join_hex(raw[:3], '-') == '00-11-22'
+
+def test_interned_scan_results(wifi):
+
+    iface = wifi.interfaces()[0]
+    first = iface.scan_results()
+    second = iface.scan_results()
+    for bss1, bss2 in zip(first, second):
+        assert bss1.bssid is bss2.bssid
+        assert bss1.ssid is bss2.ssid
+
+def wifi6_ies():
+
+    ie = bytes([0, 6]) + b'wifi6a' + bytes([3, 1, 36])
+    # BSS Load: 12 stations, utilization 100/255.
+    ie += bytes([11, 5, 12, 0, 100, 0, 0])
+    # HT capabilities with 2 streams and a 40 MHz operation.
+    ie += bytes([45, 26, 0x62, 0, 0, 0xff, 0xff] + [0] * 21)
+    ie += bytes([61, 22, 36, 0x05] + [0] * 20)
+    # VHT capabilities with 2 streams and an 80 MHz operation.
+    ie += bytes([191, 12, 0, 0, 0, 0, 0xfa, 0xff, 0, 0, 0xfa, 0xff, 0, 0])
+    ie += bytes([192, 5, 1, 42, 0, 0, 0])
+    # HE capabilities with 4 streams.
+    ie += bytes([255, 22, 35] + [0] * 17 + [0xaa, 0xff, 0xaa, 0xff])
+    # RSN of CCMP with PSK and SAE, MFP capable.
+    ie += bytes([48, 24, 1, 0, 0x00, 0x0f, 0xac, 4, 1, 0,
+                 0x00, 0x0f, 0xac, 4, 2, 0, 0x00, 0x0f, 0xac, 2,
+                 0x00, 0x0f, 0xac, 8, 0x80, 0])
+
+    return ie
+
+def test_information_elements():
+
+    ie = wifi6_ies()
+    ies = InformationElements(ie.hex())
+    with pytest.raises(AttributeError):
+        object.__getattribute__(ies, 'elements')
+    assert ies.channel_width == 80
+    assert ies.spatial_streams == 4
+    assert ies.ht and ies.vht and ies.he
+    assert ies.station_count == 12
+    assert ies.channel_utilization == 100
+    assert ies.channel == 36
+    assert ies.rsn.pairwise_ciphers == ['CCMP']
+    assert ies.rsn.akm_suites == ['PSK', 'SAE']
+    assert ies.rsn.mfp_capable and not ies.rsn.mfp_required
+    assert ies.element(0) == b'wifi6a'
+
+    truncated = InformationElements(ie[:40].hex())
+    assert truncated.station_count == 12 and truncated.rsn is None
+
+    # An unknown suite is named by its OUI and type.
+    vendor = InformationElements(bytes([48, 18, 1, 0, 0x00, 0x0f, 0xac, 4,
+                                        1, 0, 0x00, 0x0f, 0xac, 4,
+                                        1, 0, 0x00, 0x50, 0xf2, 2]))
+    assert vendor.rsn.akm_suites == ['00-50-f2:2']
+
+def test_scan_results_ies(wpas, wifi):
+
+    wpas.add_bss('06:00:00:00:00:0a', 'wifi6a', 5180, -45,
+                 '[WPA2-PSK+SAE-CCMP][ESS]', ie=wifi6_ies().hex())
+    # More BSSes than one BSS reply holds.
+    wpas.populate(60)
+
+    iface = wifi.interfaces()[0]
+    bsses = iface.scan_results(ies=True)
+    assert len(bsses) == len(iface.scan_results())
+
+    bss = [b for b in bsses if b.ssid == 'wifi6a'][0]
+    assert bss.akm == const.AKM_TYPE_WPA3SAE
+    assert bss.ies.rsn.akm_suites == ['PSK', 'SAE']
+    assert bss.ies.channel_width == 80
+
+    # The generated IEs of the other BSSes.
+    testap = [b for b in bsses if b.ssid == 'testap'][0]
+    assert testap.ies.rsn.akm_suites == ['PSK']
+    assert not testap.ies.he and testap.ies.channel_width == 20
+    evan = [b for b in bsses if b.ssid == 'Evan'][0]
+    assert evan.ies.channel == 6
+
+def test_channel_analytics():
+
+    assert analytics.freq_channel(2412) == 1
+    assert analytics.freq_channel(2484) == 14
+    assert analytics.freq_channel(5180) == 36
+    assert analytics.freq_channel(5935) == 2
+    assert analytics.freq_band(5955) == const.BAND_6GHZ
+    assert analytics.freq_channel(2413) == 0
+
+    scan = [make_bss('00:00:00:00:00:01', 'a', 2412, -67),
+            make_bss('00:00:00:00:00:02', 'b', 2417, -79),
+            make_bss('00:00:00:00:00:03', 'c', 2422, -91),
+            make_bss('00:00:00:00:00:04', 'd', 2437, -63),
+            make_bss('00:00:00:00:00:05', 'e', 5180, -50)]
+    result = analytics.analyze(scan)
+    assert result['occupancy'] == {
+        (const.BAND_2GHZ, 1): 1, (const.BAND_2GHZ, 2): 1,
+        (const.BAND_2GHZ, 3): 1, (const.BAND_2GHZ, 6): 1,
+        (const.BAND_5GHZ, 36): 1}
+    assert result['bands'][const.BAND_2GHZ]['count'] == 4
+    assert result['bands'][const.BAND_2GHZ]['max_signal'] == -63
+    assert result['bands'][const.BAND_5GHZ]['channels'] == [36]
+
+    # Alone on its channel, the score is the signal itself, and the
+    # overlapping channels add their share.
+    assert result['interference'][(const.BAND_5GHZ, 36)] == -50
+    assert -63 < result['interference'][(const.BAND_2GHZ, 6)] < -62.99
+    assert -67 < result['interference'][(const.BAND_2GHZ, 1)] < -66
+
+    columns = {'freq': [2412, 2412, 9999], 'signal': [-50, -50, -10]}
+    result = analytics.analyze(columns, use_numpy=False)
+    assert result['occupancy'] == {(const.BAND_2GHZ, 1): 2}
+    assert round(result['interference'][(const.BAND_2GHZ, 1)], 6) == \
+        round(-50 + 10 * math.log10(2), 6)
+    if analytics.numpy is not None:
+        vectorized = analytics.analyze(columns, use_numpy=True)
+        assert vectorized['occupancy'] == result['occupancy']
+        assert vectorized['bands'] == result['bands']
+
+def test_survey(tmp_path):
+
+    scan = [make_bss('00:11:22:33:44:55', 'testap', 5180, -50),
+            make_bss('00:11:22:33:44:66', 'other', 2412, -70)]
+    path = str(tmp_path / 'survey.log')
+    with SurveyRecorder(path) as recorder:
+        for i in range(3):
+            scan[0].signal = -50 - i
+            recorder.record(scan, at=1000.0 + i, iface='wlan0')
+
+    log = SurveyLog(path)
+    assert len(log) == 3
+    assert len(log.bssids()) == 2
+    assert log.history('00:11:22:33:44:55') == \
+        [(1000.0, -50), (1001.0, -51), (1002.0, -52)]
+    assert log.history('00:11:22:33:44:55', since=1001) == \
+        [(1001.0, -51), (1002.0, -52)]
+    assert log.history('00:11:22:33:44:55', 1000.5, 1001.5) == \
+        [(1001.0, -51)]
+    assert log.history('02:00:00:00:00:00') == []
+
+    # Appending after a crash drops the incomplete record.
+    with open(path, 'ab') as f:
+        f.write(b'\x02\xff\xff')
+    with SurveyRecorder(path) as recorder:
+        recorder.record(scan[:1], at=2000.0)
+    log.refresh()
+    assert len(log) == 4
+
+    stream = io.StringIO()
+    log.export_jsonl(stream, since=2000)
+    records = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert len(records) == 1 and records[0]['time'] == 2000.0
+    assert records[0]['iface'] == ''
+
+    stream = io.StringIO()
+    log.export_csv(stream, until=1000)
+    lines = stream.getvalue().splitlines()
+    assert lines[0].startswith('time,iface,bssid,ssid')
+    assert len(lines) == 3
+    assert 'wlan0,00:11:22:33:44:55,testap,5180,-50' in stream.getvalue()
+    log.close()
+
+def test_fingerprint(tmp_path):
+
+    db = FingerprintDB()
+    db.add('kitchen', {'00:00:00:00:00:01': -40, '00:00:00:00:00:02': -70})
+    db.add('office', {'00:00:00:00:00:02': -45, '00:00:00:00:00:03': -60})
+    db.add('hall', {'00:00:00:00:00:01': -65, '00:00:00:00:00:02': -65,
+                    '00:00:00:00:00:03': -80})
+
+    scan = {'00:00:00:00:00:01': -42, '00:00:00:00:00:02': -72,
+            '00:00:00:00:00:09': -90}
+    nearest = db.nearest(scan, k=2, use_numpy=False)
+    assert [location for location, _ in nearest] == ['kitchen', 'hall']
+    # The unknown AP and the missing ones take the missing RSSI.
+    assert nearest[0][1] == pytest.approx(math.sqrt(4 + 4 + 100))
+
+    path = str(tmp_path / 'fingerprints.db')
+    db.save(path)
+    loaded = FingerprintDB.load(path)
+    assert loaded.nearest(scan, k=3, use_numpy=False) == \
+        db.nearest(scan, k=3, use_numpy=False)
+    if fingerprint.numpy is not None:
+        assert [d for _, d in db.nearest(scan, 3, True)] == \
+            pytest.approx([d for _, d in db.nearest(scan, 3, False)])
+
+    # Reference points from the scans of a survey.
+    scan = [make_bss('00:00:00:00:00:04', 'lab', 5180, -50),
+            make_bss('00:00:00:00:00:05', 'lab', 2412, -75)]
+    with SurveyRecorder(str(tmp_path / 'survey.log')) as recorder:
+        recorder.record(scan, at=1.0)
+    with SurveyLog(str(tmp_path / 'survey.log')) as log:
+        db.add_survey(log, 'lab')
+    assert db.nearest(scan, k=1) == [('lab', 0.0)]
+
+def test_rule_engine():
+
+    testap = make_bss('00:11:22:33:44:55', 'testap', 5180, -50,
+                      const.AKM_TYPE_WPA2PSK)
+    other = make_bss('00:11:22:33:44:66', 'other', 2412, -70,
+                     const.AKM_TYPE_WPA2PSK)
+    engine = RuleEngine(known={'testap': ['00:11:22:33:44:55']})
+    assert engine.update([testap, other], now=0) == []
+    assert engine.update([testap, other], now=1) == []
+
+    # An evil twin of testap: unknown BSSID and open.
+    twin = make_bss('66:11:22:33:44:55', 'testap', 2412, -30)
+    alerts = engine.update([testap, other, twin], now=2)
+    assert sorted(a['rule'] for a in alerts) == \
+        [rules.RULE_SECURITY_DOWNGRADE, rules.RULE_UNKNOWN_BSSID]
+    assert all(a['bssid'] == '66:11:22:33:44:55' for a in alerts)
+    assert alerts[-1]['level'] == 0 and alerts[-1]['expected'] == 3
+
+    # Raised once, and the RSSI jumps of the known BSS.
+    testap.signal = -80
+    alerts = engine.update([testap, other, twin], now=3)
+    assert [(a['rule'], a['previous'], a['signal']) for a in alerts] == \
+        [(rules.RULE_RSSI_JUMP, -50, -80)]
+    assert len(engine.events()) == 3
+    assert engine.events() == []
+
+    # A weaker BSS seen first is a downgrade once a stronger one shows.
+    engine = RuleEngine()
+    open_bss = make_bss('02:00:00:00:00:01', 'cafe', 2412, -60)
+    secure_bss = make_bss('02:00:00:00:00:02', 'cafe', 2412, -60,
+                          const.AKM_TYPE_WPA3SAE)
+    assert engine.update([open_bss], now=0) == []
+    alerts = engine.update([open_bss, secure_bss], now=1)
+    assert [(a['rule'], a['bssid']) for a in alerts] == \
+        [(rules.RULE_SECURITY_DOWNGRADE, '02:00:00:00:00:01')]
+
+    # Forgotten after the expiry.
+    engine.update([secure_bss], now=100)
+    assert engine.bss('02:00:00:00:00:01') is None
+
+def test_channel_analytics_khz():
+
+    assert analytics.freq_mhz(5180000) == 5180
+    assert analytics.freq_mhz(2412) == 2412
+    assert analytics.freq_channel(2437000) == 6
+    assert analytics.freq_band(5955000) == const.BAND_6GHZ
+
+    # The kHz frequencies of a Windows scan are analyzed like MHz ones.
+    scan = [make_bss('00:00:00:00:00:01', 'a', 2412000, -60),
+            make_bss('00:00:00:00:00:02', 'b', 5180000, -50)]
+    expected = analytics.analyze([
+        make_bss('00:00:00:00:00:01', 'a', 2412, -60),
+        make_bss('00:00:00:00:00:02', 'b', 5180, -50)])
+    assert analytics.analyze(scan) == expected
+    columns = {'freq': [2412000, 5180000], 'signal': [-60, -50]}
+    assert analytics.analyze(columns, use_numpy=False) == expected
+
+def test_roaming_engine_khz():
+
+    # A 5 GHz BSS in kHz keeps its band preference over a 2.4 GHz one.
+    engine = RoamingEngine()
+    engine.update([make_bss('aa:aa:aa:aa:aa:01', 'corp', 2412000, -50),
+                   make_bss('aa:aa:aa:aa:aa:02', 'corp', 5180000, -53)],
+                  now=0)
+    assert engine.best('corp', now=0) == 'aa:aa:aa:aa:aa:02'
+
+def test_survey_index(tmp_path):
+
+    scan = [make_bss('00:11:22:33:44:55', 'testap', 5180, -50),
+            make_bss('00:11:22:33:44:66', 'other', 2412, -70)]
+    path = str(tmp_path / 'survey.log')
+    recorder = SurveyRecorder(path, index_interval=2)
+    for i in range(5):
+        scan[i % 2].signal = -40 - i
+        recorder.record(scan[:i % 2 + 1], at=1000.0 + i)
+
+    # The last scan is only in the log until the next index write.
+    with SurveyLog(path) as log:
+        assert len(log) == 5
+        assert log.history('00:11:22:33:44:66') == \
+            [(1001.0, -41), (1003.0, -43)]
+        assert log.history('00:11:22:33:44:55', since=1003) == \
+            [(1003.0, -42), (1004.0, -44)]
+        recorder.record(scan[1:], at=1005.0)
+        log.refresh()
+        assert log.history('00:11:22:33:44:66', since=1004) == \
+            [(1005.0, -43)]
+    recorder.close()
+
+    # Opening an indexed log walks no record.
+    with SurveyLog(path) as log:
+        assert log._indexed == os.path.getsize(path)
+        assert sorted(log.bssids()) == \
+            ['00:11:22:33:44:55', '00:11:22:33:44:66']
+        assert len(log.history('00:11:22:33:44:55')) == 5
+        assert [o['ssid'] for o in log.observations(since=1005)] == \
+            ['other']
+
+    # Appending reuses the SSIDs of the index.
+    with SurveyRecorder(path) as recorder:
+        recorder.record(scan, at=1006.0)
+    with SurveyLog(path) as log:
+        assert len(log) == 7
+        assert [o['ssid'] for o in log.observations(since=1006)] == \
+            ['testap', 'other']
+
+def test_wait_connect_without_events(monkeypatch):
+
+    class SilentCtrlMock(EventCtrlMock):
+
+        def __init__(self):
+            super().__init__()
+            self.polls = 0
+
+        def events(self, obj, timeout=0):
+            # Like a backend with no event support or a lost monitor.
+            self.polls += 1
+            return []
+
+        def connect(self, obj, params, fast=False):
+            self.connected_to.append(params.ssid)
+            self.state = const.IFACE_CONNECTED
+
+    monkeypatch.setattr(pywifi.iface, 'STATUS_POLL_INTERVAL', 0.3)
+    ctrl = SilentCtrlMock()
+    iface = Interface({'name': 'wlan0'}, ctrl)
+    profile = pywifi.Profile()
+    profile.ssid = 'testap'
+
+    # The association is seen by the status queries before the timeout,
+    # without spinning on the events.
+    start = time.monotonic()
+    assert iface.attempt_connect(profile, 5)
+    assert time.monotonic() - start < 1
+    assert ctrl.polls <= 5
+
+def test_scan_complete_metrics(wpas):
+
+    util = _wifiutil_linux.WifiUtil()
+    iface = Interface(util.interfaces()[0], util)
+    util.attach(iface._raw_obj)
+
+    metrics.reset()
+    metrics.enable()
+    try:
+        iface.scan()
+        deadline = time.monotonic() + 2
+        while time.monotonic() < deadline and not any(
+                e.startswith('CTRL-EVENT-SCAN-RESULTS')
+                for e in util.events(iface._raw_obj, 0.1)):
+            pass
+    finally:
+        metrics.disable()
+        util.close()
+
+    # The latency runs from SCAN to the results event.
+    entry = metrics.stats()['events']['scan_complete']
+    assert entry['count'] == 1
+    assert entry['latency_sum'] >= wpas.scan_delay
+    assert 'pywifi_event_latency_seconds_count{event="scan_complete"} 1\n' \
+        in metrics.prometheus_text()
+    metrics.reset()
+
+def test_reconnect_backoff_unlocked(tmp_path, monkeypatch):
+
+    monkeypatch.setattr(_wifiutil_linux, 'CTRL_IFACE_DIR', str(tmp_path))
+    srv = ctrl_sock_echo_server(str(tmp_path / 'wlan1'))
+
+    util = _wifiutil_linux.WifiUtil(timeout=1)
+    errors = []
+    def send():
+        try:
+            util._send_cmd_to_wpas('wlan0', 'STATUS', True)
+        except socket.timeout as err:
+            errors.append(err)
+    thread = threading.Thread(target=send)
+    thread.start()
+    time.sleep(0.2)
+
+    # The other interfaces are not blocked by the backoff.
+    start = time.monotonic()
+    util.attach({'name': 'wlan1'})
+    assert time.monotonic() - start < 0.1
+    thread.join()
+    assert len(errors) == 1
+
+    util.close()
+    srv.close()